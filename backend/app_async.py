@@ -1,261 +1,801 @@
 import asyncio
-import json
+import logging
 import re
 import os
-from typing import Dict, List, Optional
-from quart import Quart, jsonify, request
+import time
+from contextlib import aclosing
+from contextvars import ContextVar
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+from quart import Quart, Response, g, jsonify, request
 from dotenv import load_dotenv
-import aiohttp
 from quart_cors import cors
 
+import json_codec
+from branch_cache import BRANCH_CACHE_SEED, BranchCache
+from chapter_digest import ChapterSummarizer, fallback_summary
+from illustrations import (ILLUSTRATIONS_ENABLED, MAX_POLL_WAIT, IllustrationQueue, ImageCache, ImageGenerator,
+                           valid_key)
+from json_parsing import StoryStreamReader, extract_counts
+from llm_router import LLMRouter, build_routes
+from llm_scheduler import INTERACTIVE, PRIORITIES, LLMScheduler, Overloaded, call_priority
+from metrics import TOKEN_BUCKETS, MetricsRegistry
+from structured_logging import LogPipeline, correlation_id, log_body, new_correlation_id
+from prefetch import BranchPrefetcher
+from procedural_story import TURN_DEADLINE, ProceduralStoryteller
+from prompts import (PromptCacheTracker, choice_prompt, conclusion_messages, moral_choice_messages,
+                     new_game_messages, summary_messages)
+from context_window import ContextManager, StoryContext
+from session_backends import build_session_backend
+from session_store import SESSION_IDEMPOTENCY_KEYS, GameSession, SessionStore, Turn
+from static_assets import FRONTEND_ENABLED, FrontendAssets
+from response_cache import ResponseCache
+from response_schemas import (FILLER_CHOICES, JSON_REASK_DEADLINE, JSON_REASK_MAX_TOKENS, ChoicesResponse,
+                              ConclusionResponse, ResponseValidator, StoryResponse, SummaryResponse, conforms)
+from warm_pool import OpeningPool
+
 # Load environment variables
 load_dotenv()
 
-# Get API key from environment variables
-api_key = os.getenv("DEEPSEEK_API_KEY")
-if not api_key:
-    raise ValueError("DEEPSEEK_API_KEY environment variable is not set")
+# JSON logs written from a background thread, so log I/O never blocks the event loop
+log_pipeline = LogPipeline()
+log_pipeline.start()
+logger = logging.getLogger("game.app")
+
+# One route per provider and API key (DEEPSEEK_API_KEY/DEEPSEEK_API_KEYS, OPENAI_API_KEY/OPENAI_API_KEYS)
+llm_routes = build_routes()
+if not llm_routes:
+    raise ValueError("No API key is set for the providers in LLM_PROVIDERS (e.g. DEEPSEEK_API_KEY)")
 
 # Create Quart app (async version of Flask)
-app = Quart(__name__)
-app = cors(app, allow_origin="*")  # For development only
+app = Quart(__name__, static_folder=None)  # /static/... belongs to the frontend build
+app.json = json_codec.CodecJSONProvider(app)  # orjson for jsonify/get_json when installed
+# Served with the frontend (FRONTEND_ENABLED) the API is same-origin and needs no CORS;
+# set CORS_ALLOW_ORIGIN for a frontend on another origin, e.g. the npm dev server
+CORS_ALLOW_ORIGIN = os.getenv("CORS_ALLOW_ORIGIN", "" if FRONTEND_ENABLED else "*")
+if CORS_ALLOW_ORIGIN:
+    app = cors(app, allow_origin=CORS_ALLOW_ORIGIN)
+
+# Strong references to fire-and-forget tasks so they are not garbage collected
+background_tasks = set()
+
+@app.before_serving
+async def start_log_pipeline():
+    """Start the log writer thread (again, if the app is served more than once)"""
+    log_pipeline.start()
 
-# Session storage - maps session_id to game state
-sessions = {}
+@app.before_request
+async def assign_correlation_id():
+    """Tag every log line of this request (and the tasks it starts) with one ID"""
+    correlation_id.set(request.headers.get("X-Request-ID", "")[:64] or new_correlation_id())
+
+@app.after_request
+async def return_correlation_id(response):
+    """Echo the correlation ID so clients can quote it"""
+    response.headers["X-Request-ID"] = correlation_id.get()
+    return response
 
 # ------------------------
-# DeepSeek API Integration
+# Metrics
 # ------------------------
 
-async def generate_ai_response(messages: List[Dict[str, str]]) -> str:
-    """Send a request to DeepSeek API and get a response asynchronously"""
-    url = "https://api.deepseek.com/v1/chat/completions"
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
-    
-    payload = {
-        "model": "deepseek-chat",
-        "messages": messages,
-        "temperature": 0.7,
-        "max_tokens": 250
-    }
-    
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.post(url, headers=headers, json=payload) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    return data["choices"][0]["message"]["content"]
-                else:
-                    error_text = await response.text()
-                    print(f"API Error {response.status}: {error_text}")
-                    return None
-        except Exception as e:
-            print(f"Request error: {str(e)}")
-            return None
+metrics = MetricsRegistry()
+request_latency = metrics.histogram(
+    "http_request_duration_seconds", "Time to produce a response (until headers for streams)",
+    ["method", "route", "status"])
+upstream_latency = metrics.histogram(
+    "llm_request_duration_seconds", "LLM call latency, retries and failovers included", ["call", "outcome"])
+upstream_first_token = metrics.histogram(
+    "llm_time_to_first_token_seconds", "Time until the first streamed delta", ["call"])
+upstream_queue_wait = metrics.histogram(
+    "llm_queue_wait_seconds", "Time LLM calls waited for a scheduler slot", ["priority"])
+prompt_size = metrics.histogram(
+    "llm_prompt_tokens", "Prompt tokens per LLM call", ["call"], TOKEN_BUCKETS)
+prompt_tokens = metrics.counter("llm_prompt_tokens_total", "Prompt tokens billed", ["call"])
+completion_tokens = metrics.counter("llm_completion_tokens_total", "Completion tokens billed", ["call"])
+cache_hit_tokens = metrics.counter(
+    "llm_prompt_cache_hit_tokens_total", "Prompt tokens served from the provider's prefix cache", ["call"])
+cache_miss_tokens = metrics.counter(
+    "llm_prompt_cache_miss_tokens_total", "Prompt tokens not found in the provider's prefix cache", ["call"])
+upstream_events = metrics.counter(
+    "llm_upstream_events_total", "LLM client calls, failures, retries, hedges and failovers", ["event"])
+json_extract = metrics.counter(
+    "json_extract_total", "extract_json() results by the pattern that matched", ["pattern"])
+json_validation = metrics.counter(
+    "llm_json_validation_total",
+    "AI responses checked against their schema: valid, repaired locally, re-asked or failed", ["call", "outcome"])
+json_repairs = metrics.counter("llm_json_repairs_total", "Local repairs of AI responses by kind", ["kind"])
+story_responses = metrics.counter(
+    "story_responses_total",
+    "Story passages served: ok, or told locally after a timeout, upstream error or unparseable response",
+    ["endpoint", "outcome"])
+sessions_active = metrics.gauge("sessions_active", "Game sessions held in memory")
+session_memory = metrics.gauge("session_memory_bytes", "Approximate memory held by game sessions")
+session_backend_events = metrics.counter(
+    "session_backend_events_total",
+    "Shared session backend traffic: loads, reloads, writes, conflicts, flushes and errors", ["event"])
+session_backend_dirty = metrics.gauge("session_backend_dirty", "Changed sessions waiting to be written")
+upstream_connections = metrics.gauge(
+    "llm_pool_connections", "LLM connection pool usage, all routes", ["state"])
+upstream_breaker_open = metrics.gauge("llm_breaker_open", "1 while the circuit breaker of every route is open")
+route_latency = metrics.gauge(
+    "llm_route_latency_ewma_seconds", "Smoothed call latency the router sees per provider/key", ["route"])
+route_error_rate = metrics.gauge(
+    "llm_route_error_rate", "Smoothed share of failed calls per provider/key", ["route"])
+route_calls = metrics.counter("llm_route_calls_total", "Calls routed per provider/key", ["route", "outcome"])
+scheduler_calls = metrics.counter(
+    "llm_scheduler_calls_total", "LLM calls admitted or rejected (queue full, waited too long) per priority",
+    ["priority", "outcome"])
+scheduler_queue_depth = metrics.gauge("llm_scheduler_queue_depth", "LLM calls waiting for a slot", ["priority"])
+scheduler_in_flight = metrics.gauge("llm_scheduler_in_flight", "LLM calls holding a scheduler slot")
+opening_pool_depth = metrics.gauge("opening_pool_depth", "Pre-generated openings ready to serve")
+branch_cache_lookups = metrics.counter(
+    "branch_cache_lookups_total", "Story-tree cache lookups: passages shared between games (hit) or generated (miss)",
+    ["outcome"])
+branch_cache_bytes = metrics.gauge("branch_cache_bytes", "Passages held by the story-tree cache")
+illustration_queue_depth = metrics.gauge("illustration_queue_depth", "Illustration jobs waiting for a worker")
+illustration_jobs = metrics.counter(
+    "illustration_jobs_total", "Illustration requests by outcome (cached and reused ones were not regenerated)",
+    ["outcome"])
+chapter_summaries = metrics.counter(
+    "chapter_summaries_total",
+    "Background chapter summaries (completed, failed) and how /summarize was answered from them", ["outcome"])
+duplicate_choices = metrics.counter(
+    "choice_duplicates_total", "Repeated /choice submissions answered with the original turn's result", ["endpoint"])
+log_records_dropped = metrics.counter("log_records_dropped_total", "Log records dropped because the log queue was full")
 
-# -----------------------
-# Game State Management
-# -----------------------
+@app.before_request
+async def start_request_timer():
+    """Remember when the request started"""
+    g.request_start = time.perf_counter()
 
-def extract_json(text: str) -> Optional[Dict]:
-    """Extract JSON from the AI response text with improved pattern matching"""
-    if not text:
-        print("Empty response received")
+@app.after_request
+async def record_request_latency(response):
+    """Record the request latency by route pattern (not raw path, to bound cardinality)"""
+    start = g.get("request_start")
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        request_latency.observe(time.perf_counter() - start, method=request.method,
+                                route=route, status=str(response.status_code))
+    return response
+
+# Prefix-cache efficiency reported by the provider, overall and per session
+prompt_cache = PromptCacheTracker()
+
+# Report of the turn the current task is playing, for callers that set one (see playthroughs.py):
+# LLM calls and tokens per call site, schema validation per call site, and the turn's outcome
+turn_report: ContextVar[Optional[Dict]] = ContextVar("turn_report", default=None)
+
+def record_upstream_call(call: str, seconds: float, ok: bool, usage: Dict,
+                         session_id: Optional[str] = None) -> None:
+    """Record the latency, token usage and prompt-cache hits of one LLM call"""
+    upstream_latency.observe(seconds, call=call, outcome="ok" if ok else "error")
+    report = turn_report.get()
+    if report is not None:
+        calls = report.setdefault("calls", {}).setdefault(
+            call, {"calls": 0, "failures": 0, "seconds": 0.0, "prompt_tokens": 0, "completion_tokens": 0})
+        calls["calls"] += 1
+        calls["failures"] += 0 if ok else 1
+        calls["seconds"] += seconds
+        calls["prompt_tokens"] += usage.get("prompt_tokens", 0)
+        calls["completion_tokens"] += usage.get("completion_tokens", 0)
+    if usage:
+        prompt_size.observe(usage.get("prompt_tokens", 0), call=call)
+        prompt_tokens.inc(usage.get("prompt_tokens", 0), call=call)
+        completion_tokens.inc(usage.get("completion_tokens", 0), call=call)
+        cache_hit_tokens.inc(usage.get("prompt_cache_hit_tokens", 0), call=call)
+        cache_miss_tokens.inc(usage.get("prompt_cache_miss_tokens", 0), call=call)
+        prompt_cache.record(usage, session_id)
+
+# ------------------------
+# LLM API Integration
+# ------------------------
+
+# Pooled clients for every provider/key, opened/closed with the server lifecycle;
+# each call goes to the healthiest and fastest of them
+llm_router = LLMRouter(llm_routes)
+
+@app.before_serving
+async def start_llm_router():
+    """Open the connection pool of every route"""
+    await llm_router.start()
+
+@app.after_serving
+async def close_llm_router():
+    """Close the connection pool of every route"""
+    await llm_router.close()
+
+# Admission control: a global cap (with slots kept for players), per-provider caps,
+# and priority queues so background work waits behind /start and /choice
+llm_scheduler = LLMScheduler(
+    capacity=llm_router.has_capacity,
+    on_admit=lambda priority, seconds: upstream_queue_wait.observe(seconds, priority=priority))
+
+def overloaded_response(error: Overloaded):
+    """503 for a request turned away by the LLM scheduler"""
+    logger.warning(str(error))
+    return jsonify({"error": "The story server is busy, please try again in a moment"}), 503, {"Retry-After": "2"}
+
+async def generate_ai_response(messages: List[Dict[str, str]], call: str = "choice",
+                               session_id: Optional[str] = None, max_tokens: int = 250,
+                               deadline: Optional[float] = None) -> Optional[str]:
+    """Send a request to the LLM API and get a response asynchronously.
+
+    Raises Overloaded if an interactive call is turned away by the scheduler;
+    other calls have fallbacks and get None.
+    """
+    priority = call_priority(call)
+    try:
+        await llm_scheduler.acquire(priority, session_id)
+    except Overloaded:
+        if priority == INTERACTIVE:
+            raise
         return None
-        
     try:
-        # Print the response for debugging
-        print(f"AI Response: {text[:200]}...")  # Print first 200 chars for debugging
-        
-        # Try different regex patterns to find JSON
-        # Pattern 1: Look for the most complete JSON object
-        json_match = re.search(r'\{(?:[^{}]|(?:\{[^{}]*\}))*\}', text, re.DOTALL)
-        if json_match:
-            json_str = json_match.group(0).replace("'", "\"")
-            try:
-                return json.loads(json_str)
-            except json.JSONDecodeError:
-                print(f"Failed to parse JSON using pattern 1: {json_str[:100]}...")
-        
-        # Pattern 2: More aggressive approach - find anything between curly braces
-        json_match = re.search(r'\{.*?\}', text, re.DOTALL)
-        if json_match:
-            json_str = json_match.group(0).replace("'", "\"")
-            try:
-                return json.loads(json_str)
-            except json.JSONDecodeError:
-                print(f"Failed to parse JSON using pattern 2: {json_str[:100]}...")
-        
-        # Pattern 3: Last resort - try to extract structured fields manually
-        story_match = re.search(r'"story"\s*:\s*"([^"]*)"', text)
-        choices_match = re.search(r'"choices"\s*:\s*\[(.*?)\]', text)
+        usage: Dict = {}
+        start = time.perf_counter()
+        # Every prompt of the game asks for a JSON object
+        response = await llm_router.chat(messages, max_tokens=max_tokens, deadline=deadline, usage=usage,
+                                         session_id=session_id, json_mode=True)
+    finally:
+        llm_scheduler.release()
+    record_upstream_call(call, time.perf_counter() - start, response is not None, usage, session_id)
+    return response
+
+async def stream_ai_response(messages: List[Dict[str, str]], call: str = "stream",
+                             session_id: Optional[str] = None) -> AsyncIterator[str]:
+    """Stream an LLM response, recording the same metrics as generate_ai_response"""
+    await llm_scheduler.acquire(call_priority(call), session_id)
+    usage: Dict = {}
+    start = time.perf_counter()
+    received = False
+    try:
+        async for delta in llm_router.chat_stream(messages, usage=usage, session_id=session_id, json_mode=True):
+            if not received:
+                received = True
+                upstream_first_token.observe(time.perf_counter() - start, call=call)
+            yield delta
+    finally:
+        llm_scheduler.release()
+        record_upstream_call(call, time.perf_counter() - start, received, usage, session_id)
+
+# Shared cache for stateless call sites (/summarize, /moral_choice, /conclude)
+response_cache = ResponseCache()
+
+@app.after_serving
+async def close_response_cache():
+    """Close the on-disk response cache tier"""
+    response_cache.close()
+
+async def generate_cached_response(messages: List[Dict[str, str]], call: str,
+                                   cacheable: Optional[Callable[[str], bool]] = None) -> Optional[str]:
+    """generate_ai_response for stateless prompts: identical requests are answered from cache"""
+    return await response_cache.get_or_generate(
+        messages, lambda messages: generate_ai_response(messages, call),
+        params={"model": llm_router.model},
+        cacheable=cacheable
+    )
+
+def report_validation(call: str, outcome: str, repairs: List[str]) -> None:
+    report = turn_report.get()
+    if report is not None:
+        report.setdefault("validation", {})[call] = {"outcome": outcome, "repairs": list(repairs)}
+
+async def reask_ai_response(messages: List[Dict[str, str]], call: str,
+                            session_id: Optional[str] = None) -> Optional[str]:
+    """Re-ask for a response that failed validation; None if the scheduler turns it away"""
+    try:
+        return await generate_ai_response(messages, f"{call}_reask", session_id, max_tokens=JSON_REASK_MAX_TOKENS,
+                                          deadline=JSON_REASK_DEADLINE)
+    except Overloaded:
+        return None  # The passage was already generated: a failed re-ask falls back, it is not a 503
+
+# Checks every response against its schema; repairs locally, else re-asks with a short correction
+response_validator = ResponseValidator(reask_ai_response, on_outcome=report_validation)
+
+# Passages of the first chapters shared between games that took the same path
+branch_cache = BranchCache(params={"model": llm_router.model})
+
+@app.before_serving
+async def seed_branch_cache():
+    """Fill the story-tree cache from a playthroughs.py run (BRANCH_CACHE_SEED)"""
+    if BRANCH_CACHE_SEED and branch_cache.enabled:
+        stored = await asyncio.to_thread(branch_cache.seed, BRANCH_CACHE_SEED)
+        logger.info(f"Seeded the story-tree cache with {stored} passages from {BRANCH_CACHE_SEED}")
+
+# Tells a turn locally when the AI misses the turn's deadline or fails
+storyteller = ProceduralStoryteller()
+
+# Speculatively generates every branch while the player reads the current one
+prefetcher = BranchPrefetcher(
+    lambda messages, session_id: generate_ai_response(messages, "prefetch", session_id))
+
+# Keeps each prompt to a synopsis plus the last few turns
+context_manager = ContextManager(lambda messages: generate_ai_response(messages, "compaction"))
+
+def parse_summary(response: str) -> str:
+    """The summary in a /summarize response that failed validation, pulled out of its text"""
+    summary_match = re.search(r'"summary"\s*:\s*"([^"]*)"', response)
+    if summary_match:
+        return summary_match.group(1)
         
-        if story_match and choices_match:
-            story = story_match.group(1)
-            choices_text = choices_match.group(1)
-            choices = re.findall(r'"([^"]*)"', choices_text)
-            
-            return {
-                "story": story,
-                "choices": choices
-            }
-            
-        print("No valid JSON pattern found in response")
-        return None
-    except Exception as e:
-        print(f"Error extracting JSON: {str(e)}")
-        return None
+    # Fallback - use response text directly with cleanup
+    clean_response = re.sub(r'[\{\}\"\[\]]', '', response)  # Remove JSON syntax
+    clean_response = re.sub(r'summary\s*:', '', clean_response).strip()  # Remove field name
+    return clean_response[:100] + "..." if len(clean_response) > 100 else clean_response
 
-async def create_new_game() -> Dict:
-    """Create a new game session and return the initial story"""
-    # System prompt for consistent JSON formatting
-    system_prompt = """You are creating an interactive story game with moral choices.
-IMPORTANT: Always respond with valid JSON in EXACTLY this format, with no additional text before or after:
-{
-  "story": "The story text goes here",
-  "choices": ["Virtuous choice", "Good choice", "Selfish choice", "Evil choice"]
-}
-The choices should represent a moral spectrum from good to evil.
-Use escaped quotes (\") within the text if needed. Do not include backticks, code blocks, or any other formatting.
-Your responses should be creative and engaging."""
-
-    # Initial prompt to start the story
-    user_prompt = """Create the beginning of an interactive story with moral choices. 
-The player is standing at a crossroads, both literal and metaphorical.
-Write exactly 3 sentences that describe what happens next.
-After the story, provide exactly 4 choices for the player, arranged from most virtuous/moral to most selfish/evil."""
-
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": user_prompt}
-    ]
-
-    # Get response from AI
-    response = await generate_ai_response(messages)
+async def summarize_chapter(story: str, choice: str = "") -> str:
+    """Summarize a chapter and the choice that ended it (a stand-in if the AI fails)"""
+    # Retries of the same chapter are served from cache
+    response = await generate_cached_response(summary_messages(story, choice), "summarize",
+                                              cacheable=conforms(SummaryResponse))
     if not response:
-        return {
-            "story": "There was an error connecting to the AI service. Please try again.",
-            "choices": ["Make the virtuous choice", "Make a good choice", 
-                        "Make a selfish choice", "Make a dark choice"]
-        }
-    
-    # Extract JSON data
-    story_data = extract_json(response)
-    if not story_data or "story" not in story_data or "choices" not in story_data:
-        return {
-            "story": "There was an issue generating the story. Please try again.",
-            "choices": ["Retry", "Exit", "Start a new story", "Try a different theme"]
-        }
+        return fallback_summary(choice)
+    _, summary_data = await response_validator.validate(response, SummaryResponse, "summarize")
+    if summary_data is not None:
+        return summary_data.summary
+    return parse_summary(response)
+
+# Summarizes each finished chapter while the player reads the next one
+summarizer = ChapterSummarizer(summarize_chapter, on_update=lambda session: sessions.touch(session))
+
+# -----------------------
+# Session Storage
+# -----------------------
+
+def release_session(session: GameSession) -> None:
+    """Stop background work for a session that ended or was evicted"""
+    prefetcher.discard(session.session_id)
+    summarizer.discard(session.session_id)
+    context_manager.discard(session.context)
+    prompt_cache.discard(session.session_id)
+    llm_router.forget(session.session_id)
+
+# Maps session_id to game state, evicting idle and least-recently-used games; with
+# SESSION_BACKEND=sqlite or redis it caches the games every worker process shares
+sessions = SessionStore(on_evict=release_session, backend=build_session_backend())
+
+@app.before_serving
+async def start_session_sweeper():
+    """Connect the session backend and start evicting idle sessions"""
+    await sessions.start()
+
+@app.after_serving
+async def stop_session_sweeper():
+    """Write pending session changes and stop evicting idle sessions"""
+    await sessions.close()
+
+# -----------------------
+# Illustrations
+# -----------------------
+
+# Scene images, generated in the background so they never delay a turn
+illustrations = IllustrationQueue(ImageGenerator(), ImageCache())
+
+@app.before_serving
+async def start_illustrations():
+    """Start the illustration workers"""
+    if ILLUSTRATIONS_ENABLED:
+        await illustrations.start()
+
+@app.after_serving
+async def stop_illustrations():
+    """Stop the illustration workers"""
+    await illustrations.close()
+
+def illustration_links(job: Dict) -> Dict:
+    """Add the status URL (and image URL, once done) to an illustration job"""
+    job = dict(job)
+    job["status_url"] = f"/illustrations/{job['job_id']}"
+    if job["status"] == "done":
+        job["image_url"] = f"/illustrations/{job['job_id']}/image"
+    return job
+
+def add_illustration(result: Dict) -> Dict:
+    """Queue the illustration of a passage and tell the client where to poll for it"""
+    if ILLUSTRATIONS_ENABLED:
+        job = illustrations.submit(result["story"])
+        if job is not None:
+            result["illustration"] = illustration_links(job)
+    return result
+
+# -----------------------
+# Game State Management
+# -----------------------
+
+def turn_deadline() -> Optional[float]:
+    """Event loop time by which a turn starting now must have its passage (None without a limit)"""
+    return asyncio.get_running_loop().time() + TURN_DEADLINE if TURN_DEADLINE > 0 else None
+
+def deadline_passed(deadline: Optional[float]) -> bool:
+    return deadline is not None and asyncio.get_running_loop().time() >= deadline
+
+async def before(deadline: Optional[float], work: Awaitable, default=None):
+    """Await some work, or give up on it with `default` when the deadline passes"""
+    try:
+        async with asyncio.timeout_at(deadline):
+            return await work
+    except TimeoutError:
+        return default
+
+async def validate_story(response: Optional[str], call: str, deadline: Optional[float],
+                         session_id: Optional[str] = None) -> Tuple[Optional[str], Optional[StoryResponse], str]:
+    """Validate a passage before the turn's deadline: (response, story, "ok"), or (None, None, reason)"""
+    if response is None:
+        validated, story_data = None, None
+        outcome = "timeout" if deadline_passed(deadline) else "upstream_error"
+    else:
+        validated, story_data = await before(
+            deadline, response_validator.validate(response, StoryResponse, call, session_id), (None, None))
+        outcome = "ok" if story_data is not None else "timeout" if deadline_passed(deadline) else "parse_error"
+    report = turn_report.get()
+    if report is not None:
+        report["outcome"] = outcome
+    return validated, story_data, outcome
+
+def tell_locally(endpoint: str, reason: str, seed: Optional[str] = None, option: Optional[str] = None,
+                 choice: Optional[int] = None) -> Tuple[str, StoryResponse]:
+    """A passage from the local storyteller, for a turn the AI did not deliver in time (or at all)"""
+    logger.warning(f"Telling a {endpoint} turn locally ({reason})")
+    story_data = StoryResponse.model_validate(storyteller.tell(seed, option, choice))
+    return json_codec.dumps_str(story_data.model_dump()), story_data
+
+async def complete_new_game(messages: List[Dict[str, str]], response: Optional[str],
+                            deadline: Optional[float] = None) -> Dict:
+    """Create a game session from the opening AI response, told locally if it is missing or invalid"""
+    # Validate, repairing or re-asking if needed
+    response, story_data, outcome = await validate_story(response, "start", deadline)
+    story_responses.inc(endpoint="start", outcome=outcome)
+    degraded = story_data is None
+    if degraded:
+        response, story_data = tell_locally("start", outcome)
+    else:
+        branch_cache.add(messages, 1, response)
+        storyteller.learn(story_data.story)
     
     # Create a new session
-    session_id = f"game_{len(sessions) + 1}_{os.urandom(4).hex()}"
-    
-    # Store session data
-    sessions[session_id] = {
-        "story_context": story_data["story"],
-        "messages": messages + [{"role": "assistant", "content": response}],
-        "moral_score": 0  # 0 = neutral starting point
-    }
+    context = StoryContext(messages[0]["content"])
+    context_manager.add_turn(context, Turn(messages[1]["content"], response,
+                                           story_data.story, story_data.choices, degraded=degraded))
+    session_id = sessions.create(context).session_id
+    prefetch_branches(session_id, len(story_data.choices))
     
     # Return response with session ID
-    return {
+    result = {
         "session_id": session_id,
-        "story": story_data["story"],
-        "choices": story_data["choices"]
+        "story": story_data.story,
+        "choices": story_data.choices
     }
+    if degraded:
+        result["degraded"] = True
+    return add_illustration(result)
 
-async def process_player_choice(session_id: str, choice: int) -> Dict:
-    """Process a player's choice and continue the story"""
+async def generate_opening() -> Optional[str]:
+    """Generate an opening for the warm pool, keeping only valid (or repaired) ones"""
+    response = await generate_ai_response(new_game_messages(), "opening")
+    response, _ = await response_validator.validate(response, StoryResponse, "opening")
+    return response
+
+# Pre-generated openings, so /start does not wait for the AI
+opening_pool = OpeningPool(generate_opening)
+
+@app.before_serving
+async def start_opening_pool():
+    """Start filling the opening pool"""
+    opening_pool.start()
+
+@app.after_serving
+async def stop_opening_pool():
+    """Stop refilling the opening pool"""
+    await opening_pool.close()
+
+async def create_new_game() -> Dict:
+    """Create a new game session and return the initial story"""
+    messages = new_game_messages()
+
+    deadline = turn_deadline()
+
+    # Serve a shared opening once every variant exists, else a pre-generated one
+    # if one is ready, else get a response from AI (if it answers in time)
+    response = branch_cache.lookup(messages, 1) or opening_pool.pop()
+    if response is None:
+        response = await before(deadline, generate_ai_response(messages, "start"))
+    return await complete_new_game(messages, response, deadline)
+
+def prepare_player_choice(session_id: str, choice: int) -> Dict:
+    """Validate a player's choice and build the next prompt without changing the session"""
     # Check if session exists
-    if session_id not in sessions:
+    session = sessions.get(session_id)
+    if session is None:
         return {
             "error": "Invalid or expired session"
         }
     
-    session = sessions[session_id]
-    
-    # Get the last AI response
-    if not session["messages"] or len(session["messages"]) < 1:
+    # Get the choices offered by the last turn (parsed when it was received)
+    last_turn = session.context.last_turn
+    if last_turn is None:
         return {
             "error": "Invalid session state - no message history"
         }
-        
-    last_response = session["messages"][-1]["content"]
-    story_data = extract_json(last_response)
     
-    # Handle case where we can't parse the previous response
-    if not story_data or "choices" not in story_data:
-        print(f"Failed to parse previous AI response for session {session_id}")
+    # Handle case where the previous turn had no choices
+    if not last_turn.choices:
+        logger.warning(f"No choices recorded for the previous turn of session {session_id}")
         # Use fallback choices
         choices = ["Continue virtuously", "Take a good path", "Choose selfishly", "Embrace darkness"]
         chosen_option = choices[min(choice-1, len(choices)-1)]
     else:
         # Validate choice against available options
-        if choice < 1 or choice > len(story_data["choices"]):
+        if choice < 1 or choice > len(last_turn.choices):
             return {
-                "error": f"Invalid choice number {choice}. Valid range: 1-{len(story_data['choices'])}"
+                "error": f"Invalid choice number {choice}. Valid range: 1-{len(last_turn.choices)}"
             }
-        chosen_option = story_data["choices"][choice-1]
-    
-    # Determine the moral nature of the choice (1=most good, 4=most evil)
-    moral_alignment = choice
-    moral_descriptor = ["virtuous", "good", "selfish", "dark"][min(moral_alignment-1, 3)]
-    
-    # Update moral score
-    moral_change = {1: 2, 2: 1, 3: -1, 4: -2}[min(choice, 4)]
-    session["moral_score"] += moral_change
+        chosen_option = last_turn.choices[choice-1]
     
-    # Create prompt for the next part of the story
-    prompt = f"""The story so far: "{session["story_context"]}"
+    # Create prompt for the next part of the story - earlier chapters are
+    # already in the context as a synopsis and the turns since, verbatim
+    prompt = choice_prompt(chosen_option, choice)
 
-The player chose: "{chosen_option}" (a {moral_descriptor} choice)
+    return {
+        "choice": choice,
+        "chapter": session.context.turn_count + 1,
+        "deadline": turn_deadline(),
+        "chosen_option": chosen_option,
+        "prompt": prompt,
+        "messages": context_manager.build_messages(session.context, prompt)
+    }
 
-Continue the story based on this choice. The consequences should subtly reflect the moral nature of their decision.
-Write exactly 3 sentences that describe what happens next.
-After the story, provide exactly 4 new choices for the player, arranged from most virtuous/moral to most selfish/evil.
-Remember to structure your response as valid JSON with "story" and "choices" fields."""
+def moral_alignment(moral_score: int) -> str:
+    """Name the alignment a moral score falls in"""
+    return ("good" if moral_score > 3 else
+            "mostly_good" if moral_score > 0 else
+            "neutral" if moral_score == 0 else
+            "mostly_evil" if moral_score > -3 else
+            "evil")
 
-    # Add player choice to messages
-    session["messages"].append({"role": "user", "content": prompt})
-    
-    # Get response from AI
-    response = await generate_ai_response(session["messages"])
-    if not response:
-        return {
-            "error": "Failed to generate response from AI service"
-        }
+async def complete_player_choice(session_id: str, turn: Dict, response: Optional[str]) -> Dict:
+    """Apply the AI response for a prepared turn to the session, told locally if it is missing or invalid"""
+    # Log a sample of full responses for debugging
+    if response:
+        log_body(logger, "Full AI response", response, session_id=session_id)
     
-    # Print full response for debugging
-    print(f"Full AI response: {response}")
+    # Validate, repairing or re-asking if needed
+    response, new_story_data, outcome = await validate_story(response, "choice", turn["deadline"], session_id)
+    degraded = new_story_data is None
+    if degraded:
+        response, new_story_data = tell_locally("choice", outcome, f"{session_id}:{turn['chapter']}",
+                                                turn["chosen_option"], turn["choice"])
     
-    # Extract JSON data
-    new_story_data = extract_json(response)
-    if not new_story_data or "story" not in new_story_data or "choices" not in new_story_data:
-        # Try to generate a recovery response
+    # The session may have been ended while the AI was generating
+    session = sessions.get(session_id)
+    if session is None:
         return {
-            "error": "Failed to parse AI response",
-            "story": "There was an issue generating the next part of the story. The AI's response couldn't be parsed correctly.",
-            "choices": ["Try again", "Go back", "Start over", "End game"]
+            "error": "Invalid or expired session"
         }
     
-    # Update session
-    session["messages"].append({"role": "assistant", "content": response})
-    session["story_context"] += " " + new_story_data["story"]
+    # Update moral score
+    moral_change = {1: 2, 2: 1, 3: -1, 4: -2}[min(turn["choice"], 4)]
+    session.moral_score += moral_change
+    
+    # Update session, then summarize the chapter the player just finished
+    if not degraded:
+        branch_cache.add(turn["messages"], turn["chapter"], response)
+        storyteller.learn(new_story_data.story)
+    chapter = session.context.turn_count
+    finished = session.context.last_turn
+    context_manager.add_turn(session.context, Turn(turn["prompt"], response, new_story_data.story,
+                                                   new_story_data.choices, turn["chosen_option"], degraded))
+    sessions.touch(session)
+    summarizer.schedule(session, chapter, finished.story, turn["chosen_option"])
+    prefetch_branches(session_id, len(new_story_data.choices))
+    story_responses.inc(endpoint="choice", outcome=outcome)
     
     # Return response with session ID
-    return {
+    result = {
         "session_id": session_id,
-        "story": new_story_data["story"],
-        "choices": new_story_data["choices"],
-        "moral_alignment": "good" if session["moral_score"] > 3 else 
-                           "mostly_good" if session["moral_score"] > 0 else
-                           "neutral" if session["moral_score"] == 0 else
-                           "mostly_evil" if session["moral_score"] > -3 else
-                           "evil"
+        "story": new_story_data.story,
+        "choices": new_story_data.choices,
+        "moral_alignment": moral_alignment(session.moral_score)
     }
+    if degraded:
+        result["degraded"] = True
+    return add_illustration(result)
+
+async def process_player_choice(session_id: str, choice: int) -> Dict:
+    """Process a player's choice and continue the story"""
+    turn = prepare_player_choice(session_id, choice)
+    if "error" in turn:
+        return turn
+    
+    # Serve a passage other players got on this path, else the speculatively
+    # generated branch if there is one, else ask the AI now - as long as the
+    # turn's deadline has not passed
+    deadline = turn["deadline"]
+    response = branch_cache.lookup(turn["messages"], turn["chapter"])
+    if response is None:
+        response = await before(deadline, prefetcher.take(session_id, choice, turn["messages"]))
+    if response is None and not deadline_passed(deadline):
+        response = await before(deadline, generate_ai_response(turn["messages"], "choice", session_id))
+    return await complete_player_choice(session_id, turn, response)
+
+def prefetch_branches(session_id: str, num_choices: int) -> None:
+    """Start generating the continuation of every choice the player can make next"""
+    branches = {}
+    for choice in range(1, num_choices + 1):
+        turn = prepare_player_choice(session_id, choice)
+        # Branches the story-tree cache will serve are not generated again
+        if "error" not in turn and not branch_cache.full(turn["messages"], turn["chapter"]):
+            branches[choice] = turn["messages"]
+    prefetcher.schedule(session_id, branches)
+
+# -----------------------
+# Streaming
+# -----------------------
+
+def sse_event(event: str, data: Dict) -> str:
+    """Format a single server-sent event"""
+    return f"event: {event}\ndata: {json_codec.dumps_str(data)}\n\n"
+
+def sse_response(events: AsyncIterator[str]) -> Response:
+    """Wrap an event generator in a streaming text/event-stream response"""
+    response = Response(events, mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"  # Stop reverse proxies from buffering the stream
+    })
+    response.timeout = None
+    return response
+
+def final_event(result: Dict) -> str:
+    """The last event of a story stream: a "choices" event (the non-streaming payload) or an error"""
+    return sse_event("error" if "error" in result else "choices", result)
+
+def run_in_background(coroutine: Awaitable) -> asyncio.Task:
+    """Run a coroutine in a task that outlives the request that started it"""
+    task = asyncio.ensure_future(coroutine)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+async def generate_story(queue: asyncio.Queue, messages: List[Dict[str, str]],
+                         complete: Callable[[Optional[str]], Awaitable[Dict]],
+                         prefetched: Union[str, asyncio.Task, None] = None,
+                         session_id: Optional[str] = None, deadline: Optional[float] = None) -> Dict:
+    """Generate a story response, queueing its text as "story" events as it arrives.
+
+    Ends the queue with the final event and a None sentinel and returns the
+    final result. If a prefetched response (or a task producing one) is
+    given it is sent in one piece, unless it failed. If no story text has
+    arrived by the deadline, the AI is given up on and complete() gets None.
+    """
+    reader = StoryStreamReader()
+    result = None
+
+    def forward(delta: str) -> None:
+        text = reader.feed(delta)
+        if text:
+            queue.put_nowait(sse_event("story", {"text": text}))
+
+    def finish(final: Dict) -> None:
+        nonlocal result
+        result = final
+        queue.put_nowait(final_event(final))
+        queue.put_nowait(None)
+
+    try:
+        try:
+            async with asyncio.timeout_at(deadline) as timeout:
+                if isinstance(prefetched, asyncio.Task):
+                    response = await prefetcher.wait(prefetched)
+                else:
+                    response = prefetched
+                if response:
+                    forward(response)
+                else:
+                    async with aclosing(stream_ai_response(messages, session_id=session_id)) as deltas:
+                        async for delta in deltas:
+                            if result is not None:
+                                continue  # Only the usage report is left
+                            forward(delta)
+                            if reader.text:
+                                timeout.reschedule(None)  # The player is reading: no more deadline
+                            if reader.complete:
+                                # The choices array is inside the object, so the player is done
+                                finish(await complete(reader.text))
+        except TimeoutError:
+            pass  # Nothing arrived in time: complete() below has the turn told locally
+        if result is None:
+            finish(await complete(reader.text or None))
+    except Exception as e:
+        logger.error(f"Error streaming story: {str(e)}")
+        if result is None:
+            finish({"error": f"Error streaming story: {str(e)}"})
+    return result
+
+async def queued_events(queue: asyncio.Queue) -> AsyncIterator[str]:
+    """Yield the events generate_story() queues, until its sentinel"""
+    while True:
+        event = await queue.get()
+        if event is None:
+            break
+        yield event
+
+def stream_story(messages: List[Dict[str, str]],
+                 complete: Callable[[Optional[str]], Awaitable[Dict]],
+                 prefetched: Union[str, asyncio.Task, None] = None,
+                 session_id: Optional[str] = None, deadline: Optional[float] = None) -> AsyncIterator[str]:
+    """Stream the story text of an AI response as "story" events, then the full result.
+
+    Generation runs in its own task so the session is still updated if the
+    player disconnects halfway through.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    run_in_background(generate_story(queue, messages, complete, prefetched, session_id, deadline))
+    return queued_events(queue)
+
+async def stream_player_choice(queue: asyncio.Queue, session_id: str, choice: int) -> Dict:
+    """Streaming counterpart of process_player_choice: queue the turn's events, return its result"""
+    turn = prepare_player_choice(session_id, choice)
+    if "error" in turn:
+        queue.put_nowait(final_event(turn))
+        queue.put_nowait(None)
+        return turn
+    prefetched = (branch_cache.lookup(turn["messages"], turn["chapter"])
+                  or prefetcher.claim(session_id, choice, turn["messages"]))
+    return await generate_story(queue, turn["messages"],
+                                lambda response: complete_player_choice(session_id, turn, response),
+                                prefetched, session_id, turn["deadline"])
+
+async def attached_events(task: asyncio.Task) -> AsyncIterator[str]:
+    """The final event of a turn another request started"""
+    yield final_event(await asyncio.shield(task))
+
+# -----------------------
+# Turn Serialization
+# -----------------------
+
+def idempotency_key(data: Dict, session: GameSession) -> str:
+    """The client's idempotency key for a /choice request, or one derived from the turn it answers.
+
+    Without a key, a request is identified by the turn number it arrived at,
+    so a double-click or a retry while the turn is still being generated
+    attaches to that turn instead of playing the next one.
+    """
+    key = request.headers.get("Idempotency-Key") or data.get("idempotency_key")
+    if key:
+        return f"key:{str(key)[:128]}"
+    return f"turn:{session.context.turn_count}"
+
+async def locked_turn(session: GameSession, work: Callable[[], Awaitable[Dict]]) -> Dict:
+    """Play one turn while holding the session's lock, so turns never interleave"""
+    async with session.lock:
+        return await work()
+
+def submit_turn(session: GameSession, key: str, choice: int,
+                work: Callable[[], Awaitable[Dict]]) -> Tuple[Optional[asyncio.Task], bool]:
+    """Start the turn for an idempotency key, or find the one already started for it.
+
+    Returns the task producing the turn's result and whether it was started
+    now, or (None, False) if the key was submitted with a different choice. The
+    task runs in the background, so the turn completes even if the client
+    disconnects and its retry can pick up the result.
+    """
+    existing = session.requests.get(key)
+    if existing is not None:
+        existing_choice, task = existing
+        return (task, False) if existing_choice == choice else (None, False)
+
+    task = run_in_background(locked_turn(session, work))
+    session.requests[key] = (choice, task)
+    while len(session.requests) > SESSION_IDEMPOTENCY_KEYS:
+        session.requests.popitem(last=False)
+
+    def forget_failure(task: asyncio.Task) -> None:
+        # A failed turn changed nothing, so a retry with the same key should run again
+        if task.cancelled() or task.exception() is not None or "error" in task.result():
+            if session.requests.get(key, (None, None))[1] is task:
+                del session.requests[key]
+
+    task.add_done_callback(forget_failure)
+    return task, True
 
 # --------------------
 # API Routes
@@ -267,8 +807,10 @@ async def start_game():
     try:
         result = await create_new_game()
         return jsonify(result)
+    except Overloaded as e:
+        return overloaded_response(e)
     except Exception as e:
-        print(f"Error starting game: {str(e)}")
+        logger.error(f"Error starting game: {str(e)}")
         return jsonify({
             "error": f"Error starting game: {str(e)}"
         }), 500
@@ -285,20 +827,190 @@ async def make_choice():
         
         choice = data["choice"]
         session_id = data["session_id"]
+        session = await sessions.load(session_id)
+        if session is None:
+            return jsonify({"error": "Invalid or expired session"}), 400
         
-        # Process choice
-        result = await process_player_choice(session_id, choice)
+        # Process choice, once per idempotency key and one turn at a time per session
+        task, started = submit_turn(session, idempotency_key(data, session), choice,
+                                    lambda: process_player_choice(session_id, choice))
+        if task is None:
+            return jsonify({"error": "This turn was already submitted with a different choice"}), 409
+        if not started:
+            duplicate_choices.inc(endpoint="choice")
+        result = await asyncio.shield(task)
         
         if "error" in result:
             return jsonify(result), 400
             
         return jsonify(result)
+    except Overloaded as e:
+        return overloaded_response(e)
+    except Exception as e:
+        logger.error(f"Error processing choice: {str(e)}")
+        return jsonify({
+            "error": f"Error processing choice: {str(e)}"
+        }), 500
+
+@app.route('/start/stream', methods=['GET'])
+async def start_game_stream():
+    """Start a new game, streaming the initial story as server-sent events"""
+    messages = new_game_messages()
+    deadline = turn_deadline()
+    opening = branch_cache.lookup(messages, 1) or opening_pool.pop()
+    if opening is None and not llm_scheduler.admits(INTERACTIVE):
+        return overloaded_response(Overloaded(INTERACTIVE, "queue full"))
+    return sse_response(stream_story(
+        messages, lambda response: complete_new_game(messages, response, deadline), opening, deadline=deadline
+    ))
+
+@app.route('/choice/stream', methods=['POST'])
+async def make_choice_stream():
+    """Process a player's choice, streaming the next part of the story as server-sent events"""
+    try:
+        data = await request.get_json()
+        
+        # Validate request
+        if not data or "choice" not in data or "session_id" not in data:
+            return jsonify({"error": "Missing choice or session_id"}), 400
+        
+        choice = data["choice"]
+        session_id = data["session_id"]
+        session = await sessions.load(session_id)
+        
+        # Reject invalid requests up front; the turn itself is prepared once the session is free
+        turn = prepare_player_choice(session_id, choice)
+        if "error" in turn:
+            return jsonify(turn), 400
+        if not llm_scheduler.admits(INTERACTIVE):
+            return overloaded_response(Overloaded(INTERACTIVE, "queue full"))
+        
+        queue: asyncio.Queue = asyncio.Queue()
+        task, started = submit_turn(session, idempotency_key(data, session), choice,
+                                    lambda: stream_player_choice(queue, session_id, choice))
+        if task is None:
+            return jsonify({"error": "This turn was already submitted with a different choice"}), 409
+        if not started:
+            # A duplicate gets the original turn's result in one piece
+            duplicate_choices.inc(endpoint="choice_stream")
+            return sse_response(attached_events(task))
+        return sse_response(queued_events(queue))
     except Exception as e:
-        print(f"Error processing choice: {str(e)}")
+        logger.error(f"Error processing choice: {str(e)}")
         return jsonify({
             "error": f"Error processing choice: {str(e)}"
         }), 500
 
+@app.route('/stats', methods=['GET'])
+async def get_stats():
+    """Report server-side resource usage (pass ?session_id= for per-session counters)"""
+    session_id = request.args.get("session_id")
+    stats = {
+        "upstream_pool": llm_router.pool_stats(),
+        "upstream": llm_router.resilience_stats(),
+        "sessions": sessions.stats(),
+        "response_cache": response_cache.stats(),
+        "opening_pool": opening_pool.stats(),
+        "prefetch": prefetcher.stats(session_id),
+        "summaries": summarizer.stats(),
+        "scheduler": llm_scheduler.stats(),
+        "branch_cache": branch_cache.stats(),
+        "storyteller": storyteller.stats(),
+        "json_validation": response_validator.stats(),
+        "prompt_cache": prompt_cache.stats(session_id)
+    }
+    if ILLUSTRATIONS_ENABLED:
+        stats["illustrations"] = illustrations.stats()
+    if FRONTEND_ENABLED:
+        stats["frontend"] = frontend.stats()
+    session = await sessions.load(session_id) if session_id else None
+    if session is not None:
+        stats["context"] = context_manager.stats(session.context)
+    return jsonify(stats)
+
+@app.route('/metrics', methods=['GET'])
+async def get_metrics():
+    """Expose latency, token usage and error metrics in Prometheus text format"""
+    session_stats = sessions.stats()
+    sessions_active.set(session_stats["active"])
+    session_memory.set(session_stats["memory_bytes"])
+    if "backend" in session_stats:
+        backend_stats = session_stats["backend"]
+        session_backend_dirty.set(backend_stats["dirty"])
+        for event in ("loads", "reloads", "recreated", "writes", "conflicts", "deletes", "flushes", "errors"):
+            session_backend_events.set_total(backend_stats[event], event=event)
+    pool_stats = llm_router.pool_stats()
+    for state in ("active", "idle", "waiting"):
+        upstream_connections.set(pool_stats[state], state=state)
+    upstream_stats = llm_router.resilience_stats()
+    for event in ("calls", "failures", "retries", "deadline_exceeded", "hedges", "hedge_wins",
+                  "breaker_rejected", "failovers"):
+        upstream_events.set_total(upstream_stats[event], event=event)
+    upstream_breaker_open.set(1 if upstream_stats["breaker_state"] == "open" else 0)
+    for route in upstream_stats["routes"]:
+        if route["latency_ewma_seconds"] is not None:
+            route_latency.set(route["latency_ewma_seconds"], route=route["route"])
+        route_error_rate.set(route["error_rate"], route=route["route"])
+        route_calls.set_total(route["calls"] - route["failures"], route=route["route"], outcome="ok")
+        route_calls.set_total(route["failures"], route=route["route"], outcome="error")
+    opening_pool_depth.set(len(opening_pool))
+    scheduler_stats = llm_scheduler.stats()
+    scheduler_in_flight.set(scheduler_stats["in_flight"])
+    for priority in PRIORITIES:
+        class_stats = scheduler_stats["classes"][priority]
+        scheduler_queue_depth.set(class_stats["depth"], priority=priority)
+        for outcome in ("admitted", "rejected_full", "rejected_wait"):
+            scheduler_calls.set_total(class_stats[outcome], priority=priority, outcome=outcome)
+    tree_stats = branch_cache.stats()
+    branch_cache_lookups.set_total(tree_stats["hits"], outcome="hit")
+    branch_cache_lookups.set_total(tree_stats["misses"], outcome="miss")
+    branch_cache_bytes.set(tree_stats["bytes"])
+    if ILLUSTRATIONS_ENABLED:
+        illustration_stats = illustrations.stats()
+        illustration_queue_depth.set(illustration_stats["queued"])
+        for outcome in ("generated", "cached", "reused", "failed", "rejected"):
+            illustration_jobs.set_total(illustration_stats[outcome], outcome=outcome)
+    summary_stats = summarizer.stats()
+    for outcome in ("completed", "failed", "served_ready", "served_waiting", "not_ready"):
+        chapter_summaries.set_total(summary_stats[outcome], outcome=outcome)
+    for pattern, count in extract_counts.items():
+        json_extract.set_total(count, pattern=pattern)
+    validation_stats = response_validator.stats()
+    for call, outcomes in validation_stats["outcomes"].items():
+        for outcome, count in outcomes.items():
+            json_validation.set_total(count, call=call, outcome=outcome)
+    for kind, count in validation_stats["repairs"].items():
+        json_repairs.set_total(count, kind=kind)
+    log_records_dropped.set_total(log_pipeline.dropped)
+    return Response(metrics.render(), content_type=metrics.content_type)
+
+@app.route('/illustrations/<job_id>', methods=['GET'])
+async def get_illustration(job_id):
+    """Report an illustration job (pass ?wait=SECONDS to hold the request until it finishes)"""
+    if not ILLUSTRATIONS_ENABLED or not valid_key(job_id):
+        return jsonify({"error": "Unknown illustration"}), 404
+    wait = min(max(request.args.get("wait", 0.0, type=float), 0.0), MAX_POLL_WAIT)
+    job = await illustrations.wait(job_id, wait) if wait else await illustrations.job(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown illustration"}), 404
+    return jsonify(illustration_links(job))
+
+@app.route('/illustrations/<job_id>/image', methods=['GET'])
+async def get_illustration_image(job_id):
+    """Serve an illustration; ?width= picks the smallest stored copy at least that wide"""
+    if not valid_key(job_id):
+        return jsonify({"error": "Unknown illustration"}), 404
+    image = await illustrations.cache.read(job_id, request.args.get("width", type=int))
+    if image is None:
+        return jsonify({"error": "Illustration not ready"}), 404
+
+    # Images are content-addressed and never change once written
+    variant, data, content_type = image
+    headers = {"ETag": f'"{job_id}-{variant}"', "Cache-Control": "public, max-age=31536000, immutable"}
+    if headers["ETag"] in request.headers.get("If-None-Match", ""):
+        return Response(b"", status=304, headers=headers)
+    return Response(data, content_type=content_type, headers=headers)
+
 @app.route('/end', methods=['POST'])
 async def end_game():
     """End a game session"""
@@ -311,26 +1023,37 @@ async def end_game():
         
         session_id = data["session_id"]
         
-        # Check if session exists
-        if session_id not in sessions:
+        # Remove session (this also stops its background work)
+        await sessions.load(session_id)
+        if sessions.pop(session_id) is None:
             return jsonify({"error": "Invalid or expired session"}), 400
         
-        # Remove session
-        del sessions[session_id]
-        
         return jsonify({"message": "Game ended successfully"})
     except Exception as e:
-        print(f"Error ending game: {str(e)}")
+        logger.error(f"Error ending game: {str(e)}")
         return jsonify({
             "error": f"Error ending game: {str(e)}"
         }), 500
 
 @app.route('/summarize', methods=['POST'])
 async def summarize_story():
-    """Generate a brief summary of the story and player choice"""
+    """Return the summary of a chapter and the player's choice.
+    
+    With session_id and chapter, the summary written in the background after
+    that chapter's turn is returned (or waited for). Otherwise the story and
+    choice in the request are summarized.
+    """
     try:
         data = await request.get_json()
         
+        # Serve the precomputed summary of a game's chapter
+        if data and data.get("session_id") and isinstance(data.get("chapter"), int):
+            session = await sessions.load(data["session_id"])
+            if session is not None:
+                summary = await summarizer.summary(session, data["chapter"])
+                if summary is not None:
+                    return jsonify({"summary": summary}), 200
+        
         # Validate request
         if not data or "story" not in data:
             return jsonify({"error": "Missing story content"}), 400
@@ -338,63 +1061,13 @@ async def summarize_story():
         story = data["story"]
         choice = data.get("choice", "")  # Get the player's choice if provided
         
-        # Create prompt for summarization - different based on whether we have a choice
-        system_prompt = """You are a storytelling assistant that creates concise narrative summaries.
-Always respond with a JSON object containing only a single 'summary' field with your summary text.
-Keep summaries poetic and under 100 characters while capturing both events and decisions."""
-
-        # Modify prompt based on whether choice is available
-        if choice:
-            user_prompt = f"""Summarize this story excerpt AND the player's choice as a single narrative:
-            
-Story: {story}
-Player chose: {choice}
-
-Create a cohesive dramatic summary that weaves together what happened and what choice was made.
-Be poetic but concise - like a line from a novel that captures both the event and decision."""
-        else:
-            user_prompt = f"""Summarize this story excerpt in one short sentence, capturing its essence:
-            
-{story}
-
-Be poetic but concise."""
-        
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ]
-        
-        # Get summary from AI
-        response = await generate_ai_response(messages)
-        if not response:
-            # Default fallback based on whether we have a choice
-            if choice:
-                return jsonify({"summary": f"You chose {choice} as the world unfolded around you..."}), 200
-            else:
-                return jsonify({"summary": "Chapter in your ongoing adventure..."}), 200
-            
-        # Try to extract JSON
-        summary_data = extract_json(response)
-        if summary_data and "summary" in summary_data:
-            return jsonify({"summary": summary_data["summary"]}), 200
-        
-        # If can't parse JSON, extract text directly
-        summary_match = re.search(r'"summary"\s*:\s*"([^"]*)"', response)
-        if summary_match:
-            return jsonify({"summary": summary_match.group(1)}), 200
-            
-        # Fallback - use response text directly with cleanup
-        clean_response = re.sub(r'[\{\}\"\[\]]', '', response)  # Remove JSON syntax
-        clean_response = re.sub(r'summary\s*:', '', clean_response).strip()  # Remove field name
-        return jsonify({"summary": clean_response[:100] + "..." if len(clean_response) > 100 else clean_response}), 200
+        # Summarize now - different prompts based on whether we have a choice
+        return jsonify({"summary": await summarize_chapter(story, choice)}), 200
             
     except Exception as e:
-        print(f"Error generating summary: {str(e)}")
+        logger.error(f"Error generating summary: {str(e)}")
         # Fallback with choice if available
-        if "choice" in data and data["choice"]:
-            return jsonify({"summary": f"You chose {data['choice']} and continued your journey..."}), 200
-        else:
-            return jsonify({"summary": "Chapter in your ongoing adventure..."}), 200
+        return jsonify({"summary": fallback_summary(data.get("choice") if data else None)}), 200
 
 @app.route('/moral_choice', methods=['POST'])
 async def generate_moral_choices():
@@ -410,120 +1083,69 @@ async def generate_moral_choices():
         current_situation = data.get("current_situation", "")
         
         # Create prompt for generating moral choices
-        system_prompt = """You are a storytelling assistant that creates morally diverse choices.
-Always respond with a JSON object containing a 'choices' array with exactly 4 choices.
-Structure the choices in a spectrum from most virtuous/good (first) to most selfish/evil (last).
-Each choice should be morally distinct but realistic for the character and situation."""
-
-        user_prompt = f"""Given the story context and current situation, generate 4 choices across a moral spectrum:
-
-Story so far: {story_context}
-Current situation: {current_situation}
-
-Create 4 choices where:
-1. First choice is clearly good/virtuous/selfless
-2. Second choice is moderately good/positive
-3. Third choice is morally ambiguous/selfish
-4. Fourth choice is clearly evil/malicious/harmful
-
-Ensure all choices make sense in context and represent realistic options a character might consider.
-Avoid obvious tropes or cartoonish evil. Make choices subtle and interesting."""
-        
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ]
+        messages = moral_choice_messages(story_context, current_situation)
         
         # Get response from AI
-        response = await generate_ai_response(messages)
-        if not response:
-            return jsonify({
-                "choices": [
-                    "Do the selfless thing and help others",
-                    "Take a balanced approach that's mostly good",
-                    "Look out for your own interests first",
-                    "Take advantage of the situation for your gain"
-                ]
-            }), 200
+        response = await generate_cached_response(messages, "moral_choice", cacheable=conforms(ChoicesResponse))
+        _, choices_data = await response_validator.validate(response, ChoicesResponse, "moral_choice")
+        if choices_data is not None:
+            return jsonify({"choices": choices_data.choices}), 200
             
-        # Extract JSON data
-        choices_data = extract_json(response)
-        if choices_data and "choices" in choices_data and len(choices_data["choices"]) == 4:
-            return jsonify({"choices": choices_data["choices"]}), 200
-            
-        # Fallback if extraction fails
-        return jsonify({
-            "choices": [
-                "Do the selfless thing and help others",
-                "Take a balanced approach that's mostly good",
-                "Look out for your own interests first",
-                "Take advantage of the situation for your gain"
-            ]
-        }), 200
+        # Fallback if the AI failed or its response could not be repaired
+        return jsonify({"choices": FILLER_CHOICES}), 200
             
     except Exception as e:
-        print(f"Error generating moral choices: {str(e)}")
+        logger.error(f"Error generating moral choices: {str(e)}")
         return jsonify({
             "error": f"Error generating moral choices: {str(e)}"
         }), 500
 
 @app.route('/conclude', methods=['POST'])
 async def conclude_story():
-    """Generate a conclusion for the story based on player choices and chapter summaries"""
+    """Generate a conclusion for the story based on player choices and chapter summaries.
+    
+    With a session_id, the conclusion is built from the game's digest held by
+    the server; chapters, choices and moral_alignment sent by the client are
+    only used for games the server no longer knows.
+    """
     try:
         data = await request.get_json()
+        session = await sessions.load(data["session_id"]) if data and data.get("session_id") else None
         
-        # Validate request
-        if not data or "chapters" not in data or "moral_alignment" not in data:
-            return jsonify({"error": "Missing chapter data or moral alignment"}), 400
-        
-        chapters = data["chapters"]  # List of chapter summaries/stories
-        choices = data.get("choices", [])  # List of player choices
-        moral_alignment = data["moral_alignment"]  # Player's final moral alignment
+        if session is not None and session.context.last_turn is not None:
+            # Summaries of the finished chapters, then the final chapter itself
+            chapters, choices = await summarizer.chapters(session)
+            chapters.append(session.context.last_turn.story)
+            alignment = moral_alignment(session.moral_score)
+        else:
+            # Validate request
+            if not data or "chapters" not in data or "moral_alignment" not in data:
+                return jsonify({"error": "Missing chapter data or moral alignment"}), 400
+            
+            chapters = data["chapters"]  # List of chapter summaries/stories
+            choices = data.get("choices", [])  # List of player choices
+            alignment = data["moral_alignment"]  # Player's final moral alignment
         
         # Create prompt for story conclusion
-        system_prompt = """You are a master storyteller creating epic conclusions to interactive adventures.
-Your task is to write a satisfying conclusion to a player's journey based on their choices and moral path.
-Always respond with a JSON object containing a 'conclusion' field with your finale text.
-The conclusion should be 3-5 sentences long, dramatic, and reflect the character's journey and moral choices."""
-
-        user_prompt = f"""Write a satisfying conclusion to this adventure based on the player's journey:
-
-Story chapters: {chapters}
-Player choices: {choices}
-Player's moral alignment: {moral_alignment}
-
-Create a conclusion that:
-1. Directly references at least one key choice the player made
-2. Reflects the player's moral alignment ({moral_alignment})
-3. Provides narrative closure but hints at future possibilities
-4. Has an appropriate tone (triumphant for good characters, darker for evil ones)
-5. Is 3-5 sentences long and dramatically satisfying
-
-The conclusion should feel earned based on the player's choices and serve as a fitting end to their unique journey."""
-        
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ]
+        messages = conclusion_messages(chapters, choices, alignment)
         
         # Get conclusion from AI
-        response = await generate_ai_response(messages)
+        response = await generate_cached_response(messages, "conclude", cacheable=conforms(ConclusionResponse))
         if not response:
             # Default fallback based on moral alignment
-            if moral_alignment in ["evil", "mostly_evil"]:
+            if alignment in ["evil", "mostly_evil"]:
                 return jsonify({"conclusion": "Your dark choices have led you down a path from which there may be no return. The world around you bears the scars of your selfish actions, as shadows gather to embrace their new master. Yet even in this darkness, a small voice inside wonders what might have been had you chosen differently."}), 200
-            elif moral_alignment in ["good", "mostly_good"]:
+            elif alignment in ["good", "mostly_good"]:
                 return jsonify({"conclusion": "Your virtuous journey has brought light to those around you, and your name is whispered with reverence across the land. The path wasn't always easy, but your commitment to doing what's right has transformed not just the world, but your own soul. As you look toward the horizon, new adventures await, but you'll face them with the strength of your convictions."}), 200
             else:
                 return jsonify({"conclusion": "Your journey ends here, balanced between light and shadow, having witnessed both the best and worst of what the world has to offer. The choices you made have left their mark, neither fully virtuous nor completely selfish. As you reflect on your path, you realize that in this world of moral complexity, you've carved out your own unique way - and whatever comes next, you'll face it on your own terms."}), 200
             
-        # Try to extract JSON
-        conclusion_data = extract_json(response)
-        if conclusion_data and "conclusion" in conclusion_data:
-            return jsonify({"conclusion": conclusion_data["conclusion"]}), 200
+        # Validate, repairing or re-asking if needed
+        _, conclusion_data = await response_validator.validate(response, ConclusionResponse, "conclude")
+        if conclusion_data is not None:
+            return jsonify({"conclusion": conclusion_data.conclusion}), 200
         
-        # If can't parse JSON, extract text directly
+        # If it could not be repaired, extract text directly
         conclusion_match = re.search(r'"conclusion"\s*:\s*"([^"]*)"', response)
         if conclusion_match:
             return jsonify({"conclusion": conclusion_match.group(1)}), 200
@@ -534,9 +1156,37 @@ The conclusion should feel earned based on the player's choices and serve as a f
         return jsonify({"conclusion": clean_response}), 200
             
     except Exception as e:
-        print(f"Error generating conclusion: {str(e)}")
+        logger.error(f"Error generating conclusion: {str(e)}")
         return jsonify({"conclusion": "Your journey has come to an end. Though the path was filled with challenges and choices, you've emerged changed by the experience. What adventures await beyond the horizon? Only time will tell."}), 200
 
+# -----------------------
+# Frontend
+# -----------------------
+
+# The React build, precompressed in memory; registered after the API so its routes take precedence
+frontend = FrontendAssets()
+
+if FRONTEND_ENABLED:
+    @app.before_serving
+    async def load_frontend():
+        await frontend.load()
+
+    @app.route('/', defaults={'path': ''}, methods=['GET'])
+    @app.route('/<path:path>', methods=['GET'])
+    async def serve_frontend(path):
+        """A file of the build (index.html for client-side routes), gzip/brotli-encoded when accepted"""
+        status, body, headers = frontend.respond(
+            path, request.headers.get("Accept-Encoding", ""), request.headers.get("If-None-Match", ""))
+        if status == 404:
+            return jsonify({"error": "Not found"}), 404
+        return Response(body or b"", status=status, headers=headers)
+
+# Registered last so that log lines from the other shutdown hooks are written too
+@app.after_serving
+async def stop_log_pipeline():
+    """Write out queued log records and stop the writer thread"""
+    log_pipeline.stop()
+
 # --------------------
 # Run the application
 # --------------------
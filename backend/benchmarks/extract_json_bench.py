@@ -0,0 +1,102 @@
+"""Benchmark extract_json on a corpus of real, truncated and adversarial DeepSeek outputs.
+
+Reports parse latency and success rate for every call site, so changes to
+the parser (or to the prompts) can be checked before they ship.
+
+Usage:
+    python backend/benchmarks/extract_json_bench.py [--iterations N] [--scale N]
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from json_parsing import extract_json  # noqa: E402
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "extract_json_corpus.jsonl")
+
+
+def is_valid(call_site: str, data: Optional[Dict]) -> bool:
+    """Mirror the checks each endpoint applies to the parsed response"""
+    if not data:
+        return False
+    if call_site in ("/start", "/choice"):
+        return "story" in data and "choices" in data
+    if call_site == "/summarize":
+        return "summary" in data
+    if call_site == "/moral_choice":
+        return "choices" in data and len(data["choices"]) == 4
+    if call_site == "/conclude":
+        return "conclusion" in data
+    return True
+
+
+def load_corpus(scale: int) -> List[Dict]:
+    """Load the recorded corpus plus generated adversarial inputs of the given size"""
+    with open(CORPUS_PATH) as f:
+        samples = [json.loads(line) for line in f if line.strip()]
+
+    # Inputs that made the old nested regex backtrack
+    samples += [
+        {"call_site": "/choice", "kind": "adversarial", "ok": False,
+         "text": "{" + "a" * scale},
+        {"call_site": "/choice", "kind": "adversarial", "ok": False,
+         "text": "{" + "{x}" * scale},
+        {"call_site": "/choice", "kind": "adversarial", "ok": False,
+         "text": '{"story": "' + "It's dark. " * scale},
+    ]
+    return samples
+
+
+def run(iterations: int, scale: int) -> int:
+    # extract_json logs parse failures; keep them out of the report
+    logging.getLogger("game").setLevel(logging.CRITICAL)
+    samples = load_corpus(scale)
+    latencies = defaultdict(list)
+    results = defaultdict(lambda: [0, 0, 0])  # call site -> [parsed, expected, total]
+    mismatches = []
+
+    for sample in samples:
+        text = sample["text"]
+        data = extract_json(text)
+        start = time.perf_counter()
+        for _ in range(iterations):
+            extract_json(text)
+        elapsed = (time.perf_counter() - start) / iterations
+
+        site = sample["call_site"]
+        ok = is_valid(site, data)
+        latencies[site].append(elapsed)
+        results[site][0] += ok
+        results[site][1] += ok == sample["ok"]
+        results[site][2] += 1
+        if ok != sample["ok"]:
+            mismatches.append(sample)
+
+    print(f"{'call site':<14}{'samples':>8}{'parsed':>9}{'as expected':>13}"
+          f"{'mean us':>10}{'p50 us':>9}{'max us':>10}")
+    for site in sorted(results):
+        parsed, expected, total = results[site]
+        times = latencies[site]
+        print(f"{site:<14}{total:>8}{parsed / total:>9.0%}{expected / total:>13.0%}"
+              f"{statistics.mean(times) * 1e6:>10.1f}{statistics.median(times) * 1e6:>9.1f}"
+              f"{max(times) * 1e6:>10.1f}")
+
+    for sample in mismatches:
+        print(f"Unexpected result for {sample['call_site']} ({sample['kind']}): {sample['text'][:80]!r}")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=200, help="Timed runs per sample")
+    parser.add_argument("--scale", type=int, default=20000, help="Size of generated adversarial inputs")
+    args = parser.parse_args()
+    sys.exit(run(args.iterations, args.scale))
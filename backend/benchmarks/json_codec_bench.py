@@ -0,0 +1,124 @@
+"""Benchmark the JSON codec (orjson vs stdlib) on the encode/decode steps of a 50-turn session.
+
+Times every JSON step a /choice turn goes through: encoding the upstream
+payload (full history and the bounded context window), decoding the API
+response and a streamed chunk, hashing a cache key, parsing the request
+body and building the jsonify response.
+
+Usage:
+    python backend/benchmarks/json_codec_bench.py [--turns 50] [--repeat 5]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import timeit
+from typing import Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from quart import Quart  # noqa: E402
+from quart.json.provider import DefaultJSONProvider  # noqa: E402
+
+import json_codec  # noqa: E402
+from response_cache import cache_key  # noqa: E402
+
+WORDS = ("lantern crossroads ferryman silver oath river shadow merchant knight "
+         "whisper ember ruin promise debt mercy betrayal tower marsh").split()
+
+
+def sentence(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def story_response(rng: random.Random) -> str:
+    """An assistant message shaped like a DeepSeek story turn"""
+    return json.dumps({
+        "story": " ".join(sentence(rng, 18) for _ in range(3)),
+        "choices": [sentence(rng, 8) for _ in range(4)],
+    })
+
+
+def session_messages(turns: int, rng: random.Random) -> List[Dict[str, str]]:
+    """The unbounded message list of a session after the given number of turns"""
+    messages = [{"role": "system", "content": "You are creating an interactive story game with moral choices. "
+                                              + sentence(rng, 60)}]
+    for _ in range(turns):
+        messages.append({"role": "user", "content": f'The player chose: "{sentence(rng, 8)}" '
+                                                    + sentence(rng, 50)})
+        messages.append({"role": "assistant", "content": story_response(rng)})
+    return messages
+
+
+def bounded_messages(messages: List[Dict[str, str]], recent_turns: int = 4) -> List[Dict[str, str]]:
+    """What the context window actually sends: system, synopsis and the last few turns"""
+    synopsis = {"role": "system", "content": "Story so far (earlier chapters): " + " ".join(WORDS * 6)}
+    return [messages[0], synopsis] + messages[-2 * recent_turns:]
+
+
+def timed(function: Callable[[], object], repeat: int) -> float:
+    """Best time of one call in microseconds"""
+    number, _ = timeit.Timer(function).autorange()
+    return min(timeit.repeat(function, number=number, repeat=repeat)) / number * 1e6
+
+
+def run(turns: int, repeat: int) -> None:
+    rng = random.Random(1)
+    history = session_messages(turns, rng)
+    window = bounded_messages(history)
+    full_payload = {"model": "deepseek-chat", "messages": history, "temperature": 0.7, "max_tokens": 250}
+    window_payload = dict(full_payload, messages=window)
+    api_response = json.dumps({
+        "id": "chatcmpl-1", "model": "deepseek-chat",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": story_response(rng)},
+                     "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 900, "completion_tokens": 120, "total_tokens": 1020},
+    }).encode()
+    stream_chunk = json.dumps({"choices": [{"index": 0, "delta": {"content": "the ferryman "}}]}).encode()
+    choice_body = json.dumps({"session_id": "game_1_0123abcd", "choice": 2}).encode()
+    choice_result = {"session_id": "game_1_0123abcd", **json.loads(story_response(rng)),
+                     "moral_alignment": "mostly_good"}
+
+    app = Quart(__name__)
+    stdlib_provider = DefaultJSONProvider(app)
+    codec_provider = json_codec.CodecJSONProvider(app)
+
+    cases = [
+        # name, stdlib baseline (what the code did before), codec call
+        (f"encode payload, full {turns}-turn history",
+         lambda: json.dumps(full_payload).encode(), lambda: json_codec.dumps(full_payload)),
+        ("encode payload, bounded context window",
+         lambda: json.dumps(window_payload).encode(), lambda: json_codec.dumps(window_payload)),
+        ("decode API response",
+         lambda: json.loads(api_response), lambda: json_codec.loads(api_response)),
+        ("decode streamed chunk",
+         lambda: json.loads(stream_chunk), lambda: json_codec.loads(stream_chunk)),
+        ("cache key of the context window",
+         None, lambda: cache_key(window, {"model": "deepseek-chat"})),
+        ("parse /choice request body",
+         lambda: stdlib_provider.loads(choice_body), lambda: codec_provider.loads(choice_body)),
+        ("jsonify /choice response",
+         lambda: stdlib_provider.response(choice_result), lambda: codec_provider.response(choice_result)),
+    ]
+
+    print(f"codec: {json_codec.CODEC_NAME}; payload sizes: full {len(json_codec.dumps(full_payload)) / 1024:.1f} KB, "
+          f"window {len(json_codec.dumps(window_payload)) / 1024:.1f} KB\n")
+    print(f"{'step':<42}{'stdlib us':>11}{'codec us':>11}{'speedup':>9}")
+    for name, baseline, codec in cases:
+        if baseline is None:
+            json_codec.USE_ORJSON = False
+            baseline_us = timed(codec, repeat)
+            json_codec.USE_ORJSON = json_codec.CODEC_NAME == "orjson"
+        else:
+            baseline_us = timed(baseline, repeat)
+        codec_us = timed(codec, repeat)
+        print(f"{name:<42}{baseline_us:>11.1f}{codec_us:>11.1f}{baseline_us / codec_us:>8.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=50, help="Turns in the simulated session")
+    parser.add_argument("--repeat", type=int, default=5, help="Timing repetitions (best is reported)")
+    args = parser.parse_args()
+    run(args.turns, args.repeat)
@@ -0,0 +1,232 @@
+"""Offline load test: N simulated players against app_async.py and a mock DeepSeek.
+
+Each player does /start, a series of /choice calls (each followed by
+/summarize of the previous chapter, which like the React client it does not
+wait for) and finally /conclude, pausing to "read" between turns. The report lists throughput,
+p50/p95/p99 latency per endpoint, errors and memory growth.
+
+By default the app runs in-process against a mock started on a free port,
+so nothing touches the real API. Use --base-url to drive a running server.
+
+Usage:
+    python backend/benchmarks/load_test.py --players 200 --turns 10 --think-time 2
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import statistics
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_deepseek import add_mock_arguments, mock_url, settings_from_args, start_mock  # noqa: E402
+
+
+def rss_mb() -> float:
+    """Current resident set size of this process in MB"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError):
+        # Peak RSS (KB on Linux) where /proc is unavailable
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Recorder:
+    """Collects latency and status of every request by endpoint"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    def record(self, endpoint: str, seconds: float, ok: bool) -> None:
+        self.latencies[endpoint].append(seconds)
+        if not ok:
+            self.errors[endpoint] += 1
+
+
+class HttpDriver:
+    """Sends requests to a running server"""
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url.rstrip("/")
+        self.session: Optional[aiohttp.ClientSession] = None
+
+    async def __aenter__(self):
+        self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0))
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+
+    async def request(self, method: str, path: str, body: Optional[Dict] = None):
+        async with self.session.request(method, self.base_url + path, json=body) as response:
+            if response.content_type == "text/event-stream":
+                return response.status, await response.text()
+            return response.status, await response.json()
+
+
+class InProcessDriver:
+    """Sends requests straight into the Quart app (no sockets between driver and app)"""
+
+    def __init__(self, app):
+        self.app = app
+        self.client = app.test_client()
+        self._context = None
+
+    async def __aenter__(self):
+        self._context = self.app.test_app()
+        await self._context.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._context.__aexit__(*exc)
+
+    async def request(self, method: str, path: str, body: Optional[Dict] = None):
+        response = await self.client.open(path, method=method, json=body)
+        if response.mimetype == "text/event-stream":
+            return response.status_code, (await response.get_data()).decode()
+        return response.status_code, await response.get_json()
+
+
+def last_event(stream: str) -> Dict:
+    """Decode the final event of a server-sent event stream"""
+    data = [line[6:] for line in stream.splitlines() if line.startswith("data: ")]
+    return json.loads(data[-1]) if data else {}
+
+
+async def play(driver, recorder: Recorder, turns: int, think_time: float, stream: bool,
+               rng: random.Random) -> None:
+    """One simulated player from /start to /conclude"""
+
+    async def call(endpoint: str, method: str, path: str, body: Optional[Dict] = None):
+        start = time.perf_counter()
+        try:
+            status, data = await driver.request(method, path, body)
+        except Exception as e:
+            recorder.record(endpoint, time.perf_counter() - start, False)
+            print(f"{endpoint} failed: {str(e)}")
+            return None
+        if isinstance(data, str):
+            data = last_event(data)
+        ok = status == 200 and isinstance(data, dict) and "error" not in data
+        recorder.record(endpoint, time.perf_counter() - start, ok)
+        return data if ok else None
+
+    data = await call("/start", "GET", "/start/stream" if stream else "/start")
+    if not data or "session_id" not in data:
+        return
+    session_id = data["session_id"]
+    summaries, choices_made = [], []
+
+    for chapter in range(1, turns + 1):
+        await asyncio.sleep(rng.uniform(0.5, 1.5) * think_time)
+        choice = rng.randint(1, 4)
+        choice_text = data["choices"][choice - 1] if len(data.get("choices", [])) >= choice else str(choice)
+        previous_story = data["story"]
+
+        data = await call("/choice", "POST", "/choice/stream" if stream else "/choice",
+                          {"session_id": session_id, "choice": choice})
+        if not data:
+            break
+        # The server summarizes the chapter in the background; the player does not wait for it
+        summaries.append(asyncio.create_task(call("/summarize", "POST", "/summarize", {
+            "session_id": session_id, "chapter": chapter, "story": previous_story, "choice": choice_text})))
+        choices_made.append(choice_text)
+
+    chapters = [summary["summary"] if summary else "" for summary in await asyncio.gather(*summaries)]
+    await call("/conclude", "POST", "/conclude", {
+        "session_id": session_id, "chapters": chapters, "choices": choices_made,
+        "moral_alignment": data.get("moral_alignment", "neutral") if data else "neutral"
+    })
+    await call("/end", "POST", "/end", {"session_id": session_id})
+
+
+async def run(args: argparse.Namespace) -> None:
+    mock_runner = None
+    if args.base_url:
+        driver = HttpDriver(args.base_url)
+    else:
+        mock_runner = await start_mock(settings_from_args(args))
+        os.environ["DEEPSEEK_API_URL"] = mock_url(mock_runner)
+        os.environ.setdefault("DEEPSEEK_API_KEY", "load-test")
+        os.environ.setdefault("LOG_LEVEL", "WARNING")  # Keep app logs out of the report
+        sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        import app_async
+        driver = InProcessDriver(app_async.app)
+
+    recorder = Recorder()
+    rng = random.Random(args.seed)
+    semaphore = asyncio.Semaphore(args.concurrency or args.players)
+
+    async def player(index: int) -> None:
+        # Stagger arrivals over the ramp-up period
+        await asyncio.sleep(args.ramp_up * index / args.players)
+        async with semaphore:
+            await play(driver, recorder, args.turns, args.think_time, args.stream,
+                       random.Random(rng.random()))
+
+    async with driver:
+        rss_before = rss_mb()
+        start = time.perf_counter()
+        await asyncio.gather(*(player(i) for i in range(args.players)))
+        elapsed = time.perf_counter() - start
+        rss_after = rss_mb()
+        _, server_stats = await driver.request("GET", "/stats")
+
+    if mock_runner is not None:
+        await mock_runner.cleanup()
+
+    total = sum(len(samples) for samples in recorder.latencies.values())
+    print(f"\n{args.players} players x {args.turns} turns in {elapsed:.1f}s "
+          f"- {total} requests, {total / elapsed:.1f} req/s\n")
+    print(f"{'endpoint':<14}{'count':>7}{'errors':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for endpoint, samples in sorted(recorder.latencies.items()):
+        print(f"{endpoint:<14}{len(samples):>7}{recorder.errors[endpoint]:>8}"
+              f"{percentile(samples, 0.5) * 1000:>9.0f}{percentile(samples, 0.95) * 1000:>9.0f}"
+              f"{percentile(samples, 0.99) * 1000:>9.0f}{max(samples) * 1000:>9.0f}")
+
+    if not args.base_url:
+        print(f"\nProcess RSS: {rss_before:.1f} MB -> {rss_after:.1f} MB ({rss_after - rss_before:+.1f} MB)")
+    sessions = server_stats.get("sessions", {}) if isinstance(server_stats, dict) else {}
+    if sessions:
+        print(f"Sessions still held: {sessions.get('active')} "
+              f"({sessions.get('memory_bytes', 0) / 1024:.1f} KB)")
+    cache = server_stats.get("prompt_cache", {}) if isinstance(server_stats, dict) else {}
+    if cache.get("calls"):
+        print(f"Prompt cache: {cache['hit_rate']:.0%} of prompt tokens hit "
+              f"({cache['hit_tokens']} hit / {cache['miss_tokens']} miss)")
+    storyteller = server_stats.get("storyteller", {}) if isinstance(server_stats, dict) else {}
+    if storyteller.get("told"):
+        print(f"Turns told locally (AI past the turn deadline or failing): {storyteller['told']}")
+    mean = statistics.mean(s for samples in recorder.latencies.values() for s in samples) if total else 0
+    print(f"Mean request latency: {mean * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--players", type=int, default=50)
+    parser.add_argument("--turns", type=int, default=8, help="/choice calls per player")
+    parser.add_argument("--think-time", type=float, default=1.0, help="Mean reading time between turns (s)")
+    parser.add_argument("--ramp-up", type=float, default=5.0, help="Seconds over which players arrive")
+    parser.add_argument("--concurrency", type=int, default=0, help="Max simultaneous players (0 = all)")
+    parser.add_argument("--stream", action="store_true", help="Use /start/stream and /choice/stream")
+    parser.add_argument("--base-url", default="", help="Drive a running server instead of an in-process app")
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+    if args.seed is None:
+        args.seed = 1
+    asyncio.run(run(args))
@@ -0,0 +1,297 @@
+"""Local mock of the DeepSeek /v1/chat/completions endpoint for offline load tests.
+
+Answers with canned, templated JSON bodies shaped like each call site
+expects (story + choices, summary, choices, conclusion, synopsis), with a
+configurable latency distribution, error rate and streaming speed. A share
+of answers can be malformed (--malformed-rate: cut off, wrapped in text,
+single-quoted, or with three or five choices); correction requests are
+always answered correctly. Like DeepSeek it caches prompt prefixes: leading
+64-token blocks seen before are reported as prompt_cache_hit_tokens and
+only uncached tokens add prefill time.
+
+It also stands in for the text-to-image endpoint of the illustration
+pipeline: POST /v1/images answers {"inputs": prompt} with a PNG derived
+from the prompt after --image-latency seconds.
+
+Usage:
+    python backend/benchmarks/mock_deepseek.py --port 8701 --latency lognormal --latency-mean 0.8
+    DEEPSEEK_API_URL=http://127.0.0.1:8701/v1/chat/completions \
+        ILLUSTRATIONS_ENABLED=true ILLUSTRATION_API_URL=http://127.0.0.1:8701/v1/images python backend/app_async.py
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import struct
+import zlib
+from collections import OrderedDict
+from typing import Dict, List
+
+from aiohttp import web
+
+PLACES = ["crossroads", "ruined chapel", "river ford", "market square", "watchtower", "salt marsh"]
+CHARACTERS = ["a hooded traveler", "the old ferryman", "a wounded knight", "a merchant's daughter",
+              "a stray wolf", "the village priest"]
+OBJECTS = ["a brass key", "a flickering lantern", "a sealed letter", "a bag of silver", "a broken sword"]
+CHOICES = [
+    ["Help {who} without asking anything in return", "Offer {who} a fair trade",
+     "Keep {what} for yourself", "Take everything from {who} by force"],
+    ["Tell the truth about {what}", "Share part of what you know",
+     "Lie to protect yourself", "Use {what} to blackmail {who}"],
+]
+
+
+class MockSettings:
+    """Latency, error and streaming behaviour of the mock"""
+
+    def __init__(self, latency: str = "fixed", latency_mean: float = 0.5, latency_sigma: float = 0.3,
+                 error_rate: float = 0.0, error_status: int = 429, retry_after: float = 1.0,
+                 tokens_per_second: float = 60.0, seed: int = None, prefix_cache: bool = True,
+                 prefill_per_1k: float = 0.05, image_latency: float = 2.0, malformed_rate: float = 0.0):
+        self.latency = latency
+        self.latency_mean = latency_mean
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.tokens_per_second = tokens_per_second
+        self.random = random.Random(seed)
+        self.prefix_cache = prefix_cache
+        self.prefill_per_1k = prefill_per_1k  # Seconds per 1000 uncached prompt tokens
+        self.image_latency = image_latency    # Seconds per generated image
+        self.malformed_rate = malformed_rate  # Fraction of answers sent with a defect
+
+    def delay(self) -> float:
+        """Seconds before the first byte, drawn from the configured distribution"""
+        if self.latency == "uniform":
+            return self.random.uniform(0, 2 * self.latency_mean)
+        if self.latency == "normal":
+            return max(0.0, self.random.gauss(self.latency_mean, self.latency_sigma))
+        if self.latency == "lognormal":
+            # Long right tail, like real LLM latencies; the median is latency_mean
+            return self.latency_mean * self.random.lognormvariate(0, self.latency_sigma)
+        return self.latency_mean
+
+
+def story_body(rng: random.Random) -> Dict:
+    who, what, where = rng.choice(CHARACTERS), rng.choice(OBJECTS), rng.choice(PLACES)
+    return {
+        "story": f"At the {where} you meet {who}, who is clutching {what}. "
+                 f"The wind carries a warning you can't quite make out. "
+                 f"Whatever you do next, {who} will remember it.",
+        "choices": [choice.format(who=who, what=what) for choice in rng.choice(CHOICES)],
+    }
+
+
+def is_correction(messages: List[Dict[str, str]]) -> bool:
+    """Whether a request re-asks for a reply that failed validation"""
+    return bool(messages) and "malformed JSON" in messages[0]["content"]
+
+
+def response_body(messages: List[Dict[str, str]], rng: random.Random) -> Dict:
+    """Pick a JSON body matching what the system prompt asks for"""
+    system = messages[0]["content"] if messages else ""
+    if is_correction(messages):
+        # A correction request: answer in the format it shows
+        example = messages[-1]["content"]
+        for field in ("story", "summary", "conclusion", "synopsis"):
+            if f'{{"{field}"' in example:
+                return response_body([{"role": "system", "content": f"'{field}'"}], rng)
+        return {"choices": story_body(rng)["choices"]}
+    if "'synopsis'" in system:
+        return {"synopsis": "You wandered from place to place, helping some and betraying others."}
+    if "'summary'" in system:
+        return {"summary": f"At the {rng.choice(PLACES)}, a choice echoed into the night."}
+    if "'conclusion'" in system:
+        return {"conclusion": "Your journey ends where it began, changed by every choice. "
+                              "The roads remember your name. Somewhere, a new story waits."}
+    if "'choices' array" in system:
+        return {"choices": story_body(rng)["choices"]}
+    return story_body(rng)
+
+
+DEFECTS = ["truncated", "trailing_text", "single_quotes", "three_choices", "five_choices"]
+
+
+def malformed(body: Dict, rng: random.Random) -> str:
+    """Encode a body with one of the defects models commonly produce"""
+    defect = rng.choice(DEFECTS if "choices" in body else DEFECTS[:3])
+    if defect == "three_choices":
+        return json.dumps(dict(body, choices=body["choices"][:2] + body["choices"][3:]))
+    if defect == "five_choices":
+        return json.dumps(dict(body, choices=body["choices"] + ["Walk away and say nothing"]))
+    content = json.dumps(body)
+    if defect == "truncated":
+        return content[:int(len(content) * rng.uniform(0.6, 0.95))]
+    if defect == "trailing_text":
+        return f"Here is the next part of the story:\n{content}\nI hope you enjoy it!"
+    return content.replace("'", "\\'").replace('"', "'")
+
+
+class PrefixCache:
+    """Remembers prompt prefixes in 64-token (256-character) blocks, like DeepSeek's context cache"""
+
+    BLOCK_CHARS = 256
+
+    def __init__(self, max_blocks: int = 200000):
+        self.max_blocks = max_blocks
+        self._blocks: "OrderedDict[str, None]" = OrderedDict()
+
+    def lookup(self, messages: List[Dict[str, str]]) -> int:
+        """Number of leading prompt characters already cached; caches the rest"""
+        text = "".join(f"{message['role']}\0{message['content']}\0" for message in messages)
+        digest = hashlib.sha1()
+        cached, hit = 0, True
+        for start in range(0, len(text) - self.BLOCK_CHARS + 1, self.BLOCK_CHARS):
+            # Each block is keyed by everything before it, so only true prefixes match
+            digest.update(text[start:start + self.BLOCK_CHARS].encode())
+            key = digest.hexdigest()
+            if hit and key in self._blocks:
+                cached += self.BLOCK_CHARS
+                self._blocks.move_to_end(key)
+            else:
+                hit = False
+                self._blocks[key] = None
+        while len(self._blocks) > self.max_blocks:
+            self._blocks.popitem(last=False)
+        return cached
+
+
+def usage(messages: List[Dict[str, str]], content: str, cached_chars: int = 0) -> Dict[str, int]:
+    prompt_tokens = sum(len(message["content"]) for message in messages) // 4
+    cached = min(prompt_tokens, cached_chars // 4)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": len(content) // 4,
+        "total_tokens": prompt_tokens + len(content) // 4,
+        "prompt_cache_hit_tokens": cached,
+        "prompt_cache_miss_tokens": prompt_tokens - cached,
+    }
+
+
+def png_image(prompt: str, size: int = 512) -> bytes:
+    """A PNG with a two-colour gradient picked from the prompt hash"""
+    digest = hashlib.sha256(prompt.encode("utf-8")).digest()
+    top, bottom = digest[:3], digest[3:6]
+    rows = []
+    for y in range(size):
+        pixel = bytes(top[c] + (bottom[c] - top[c]) * y // size for c in range(3))
+        rows.append(b"\x00" + pixel * size)
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0)  # 8-bit RGB
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header)
+            + chunk(b"IDAT", zlib.compress(b"".join(rows), 6)) + chunk(b"IEND", b""))
+
+
+def create_app(settings: MockSettings) -> web.Application:
+    stats = {"requests": 0, "errors": 0, "streams": 0, "images": 0, "malformed": 0}
+    cache = PrefixCache()
+
+    async def chat_completions(request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        stats["requests"] += 1
+        messages = body.get("messages", [])
+        cached_chars = cache.lookup(messages) if settings.prefix_cache else 0
+        uncached_tokens = max(0, sum(len(message["content"]) for message in messages) - cached_chars) // 4
+        await asyncio.sleep(settings.delay() + uncached_tokens / 1000 * settings.prefill_per_1k)
+
+        if settings.random.random() < settings.error_rate:
+            stats["errors"] += 1
+            return web.json_response({"error": {"message": "Mock upstream error"}},
+                                     status=settings.error_status,
+                                     headers={"Retry-After": str(settings.retry_after)})
+
+        body_data = response_body(messages, settings.random)
+        if settings.random.random() < settings.malformed_rate and not is_correction(messages):
+            stats["malformed"] += 1
+            content = malformed(body_data, settings.random)
+        else:
+            content = json.dumps(body_data)
+
+        if not body.get("stream"):
+            return web.json_response({
+                "model": body.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                             "finish_reason": "stop"}],
+                "usage": usage(messages, content, cached_chars),
+            })
+
+        stats["streams"] += 1
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        step = 8  # Characters per chunk, about two tokens
+        for i in range(0, len(content), step):
+            chunk = {"choices": [{"index": 0, "delta": {"content": content[i:i + step]}}]}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            await asyncio.sleep(2 / settings.tokens_per_second)
+        final = {"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                 "usage": usage(messages, content, cached_chars)}
+        await response.write(f"data: {json.dumps(final)}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+    async def images(request: web.Request) -> web.Response:
+        body = await request.json()
+        stats["images"] += 1
+        await asyncio.sleep(settings.image_latency)
+        return web.Response(body=png_image(body.get("inputs", "")), content_type="image/png")
+
+    async def get_stats(request: web.Request) -> web.Response:
+        return web.json_response(stats)
+
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    app.router.add_post("/v1/images", images)
+    app.router.add_get("/stats", get_stats)
+    return app
+
+
+async def start_mock(settings: MockSettings, host: str = "127.0.0.1", port: int = 0) -> web.AppRunner:
+    """Start the mock inside the running event loop; returns the runner (call .cleanup())"""
+    runner = web.AppRunner(create_app(settings), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    return runner
+
+
+def mock_url(runner: web.AppRunner) -> str:
+    """The chat completions URL of a started mock"""
+    host, port = runner.addresses[0][:2]
+    return f"http://{host}:{port}/v1/chat/completions"
+
+
+def add_mock_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--latency", choices=["fixed", "uniform", "normal", "lognormal"], default="lognormal")
+    parser.add_argument("--latency-mean", type=float, default=0.5, help="Mean/median latency in seconds")
+    parser.add_argument("--latency-sigma", type=float, default=0.3)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests that fail")
+    parser.add_argument("--error-status", type=int, default=429)
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--tokens-per-second", type=float, default=60.0, help="Streaming speed")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--prefill-per-1k", type=float, default=0.05,
+                        help="Extra seconds per 1000 prompt tokens not in the prefix cache")
+    parser.add_argument("--no-prefix-cache", action="store_true", help="Report every prompt token as a miss")
+    parser.add_argument("--image-latency", type=float, default=2.0, help="Seconds per generated image")
+    parser.add_argument("--malformed-rate", type=float, default=0.0,
+                        help="Fraction of answers with a JSON defect (truncation, extra text, quotes, choices)")
+
+
+def settings_from_args(args: argparse.Namespace) -> MockSettings:
+    return MockSettings(args.latency, args.latency_mean, args.latency_sigma, args.error_rate,
+                        args.error_status, args.retry_after, args.tokens_per_second, args.seed,
+                        not args.no_prefix_cache, args.prefill_per_1k, args.image_latency, args.malformed_rate)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8701)
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+    web.run_app(create_app(settings_from_args(args)), host=args.host, port=args.port, access_log=None)
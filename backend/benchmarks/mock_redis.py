@@ -0,0 +1,178 @@
+"""Local stand-in for a Redis server, for testing SESSION_BACKEND=redis offline.
+
+Speaks the Redis protocol (RESP2) and keeps keys in memory, with just the
+commands the session backend sends: PING, AUTH, SELECT, HGET, HSET, DEL,
+PEXPIRE, DBSIZE, FLUSHDB, SCRIPT LOAD and EVALSHA/EVAL. It cannot run Lua;
+the backend's two scripts are recognised by their SHA1 and carried out by
+equivalent Python functions. Point the app at a real Redis to test the
+scripts themselves.
+
+Usage:
+    python backend/benchmarks/mock_redis.py --port 6390
+    SESSION_BACKEND=redis SESSION_REDIS_URL=redis://127.0.0.1:6390/0 python backend/app_async.py
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from session_backends import FETCH_SCRIPT, SAVE_SCRIPT, RedisConnection, script_sha  # noqa: E402
+
+
+class Error(Exception):
+    """Sent to the client as an error reply"""
+
+
+class Store:
+    """Hashes with optional expiry times"""
+
+    def __init__(self):
+        self.hashes: Dict[bytes, Dict[bytes, bytes]] = {}
+        self.expires: Dict[bytes, float] = {}
+        self.scripts: Dict[str, bytes] = {}
+
+    def live(self, key: bytes) -> Optional[Dict[bytes, bytes]]:
+        expires = self.expires.get(key)
+        if expires is not None and expires <= time.monotonic():
+            self.delete(key)
+        return self.hashes.get(key)
+
+    def delete(self, key: bytes) -> int:
+        self.expires.pop(key, None)
+        return 1 if self.hashes.pop(key, None) is not None else 0
+
+    def fetch(self, key: bytes, known_version: bytes) -> List:
+        """FETCH_SCRIPT"""
+        entry = self.live(key)
+        if entry is None:
+            return [0]
+        if entry[b"v"] == known_version:
+            return [int(entry[b"v"])]
+        return [int(entry[b"v"]), entry[b"r"]]
+
+    def save(self, key: bytes, expected: bytes, record: bytes, ttl_ms: bytes) -> int:
+        """SAVE_SCRIPT"""
+        entry = self.live(key)
+        version = int(entry[b"v"]) if entry else 0
+        if version != int(expected):
+            return 0
+        self.hashes[key] = {b"v": str(version + 1).encode(), b"r": record}
+        self.expires[key] = time.monotonic() + int(ttl_ms) / 1000
+        return 1
+
+    def execute(self, command: List[bytes]):
+        name, args = command[0].upper().decode(), command[1:]
+        if name in ("PING", "AUTH", "SELECT"):
+            return "PONG" if name == "PING" else "OK"
+        if name == "HGET":
+            return (self.live(args[0]) or {}).get(args[1])
+        if name == "HSET":
+            entry = self.live(args[0])
+            if entry is None:
+                entry = self.hashes[args[0]] = {}
+            added = sum(1 for field in args[1::2] if field not in entry)
+            entry.update(zip(args[1::2], args[2::2]))
+            return added
+        if name == "DEL":
+            return sum(self.delete(key) for key in args if self.live(key) is not None)
+        if name == "PEXPIRE":
+            if self.live(args[0]) is None:
+                return 0
+            self.expires[args[0]] = time.monotonic() + int(args[1]) / 1000
+            return 1
+        if name == "DBSIZE":
+            return sum(1 for key in list(self.hashes) if self.live(key) is not None)
+        if name == "FLUSHDB":
+            self.hashes.clear()
+            self.expires.clear()
+            return "OK"
+        if name == "SCRIPT" and args and args[0].upper() == b"LOAD":
+            sha = script_sha(args[1].decode())
+            self.scripts[sha] = args[1]
+            return sha
+        if name in ("EVAL", "EVALSHA"):
+            sha = script_sha(args[0].decode()) if name == "EVAL" else args[0].decode()
+            if name == "EVALSHA" and sha not in self.scripts:
+                raise Error("NOSCRIPT No matching script. Please use EVAL.")
+            keys, argv = args[2:2 + int(args[1])], args[2 + int(args[1]):]
+            if sha == script_sha(FETCH_SCRIPT):
+                return self.fetch(keys[0], argv[0])
+            if sha == script_sha(SAVE_SCRIPT):
+                return self.save(keys[0], *argv)
+            raise Error("ERR this mock only runs the session backend's scripts")
+        raise Error(f"ERR unknown command '{name}'")
+
+
+def encode_reply(reply) -> bytes:
+    if isinstance(reply, Error):
+        return b"-%s\r\n" % str(reply).encode()
+    if isinstance(reply, str):
+        return b"+%s\r\n" % reply.encode()
+    if isinstance(reply, int):
+        return b":%d\r\n" % reply
+    if reply is None:
+        return b"$-1\r\n"
+    if isinstance(reply, bytes):
+        return b"$%d\r\n%s\r\n" % (len(reply), reply)
+    return b"*%d\r\n" % len(reply) + b"".join(encode_reply(item) for item in reply)
+
+
+async def read_command(reader: asyncio.StreamReader) -> Optional[List[bytes]]:
+    line = await reader.readline()
+    if not line:
+        return None
+    if not line.startswith(b"*"):
+        # Inline command, e.g. typed into telnet
+        return line.split()
+    command = []
+    for _ in range(int(line[1:-2])):
+        length = int((await reader.readline())[1:-2])
+        command.append((await reader.readexactly(length + 2))[:-2])
+    return command
+
+
+async def start_mock_redis(host: str = "127.0.0.1", port: int = 0) -> Tuple[asyncio.AbstractServer, Store]:
+    """Start the server inside the running event loop; returns it and its store"""
+    store = Store()
+
+    async def serve(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                command = await read_command(reader)
+                if not command:
+                    break
+                try:
+                    reply = store.execute(command)
+                except Error as e:
+                    reply = e
+                writer.write(encode_reply(reply))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(serve, host, port)
+    return server, store
+
+
+async def main(args: argparse.Namespace) -> None:
+    server, _ = await start_mock_redis(args.host, args.port)
+    print(f"Mock Redis listening on redis://{args.host}:{args.port}/0")
+    # Check the client and server agree before serving others
+    client = RedisConnection(f"redis://{args.host}:{args.port}/0")
+    assert await client.execute("PING") == "PONG"
+    await client.close()
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6390)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,124 @@
+import os
+import random
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import json_codec
+from response_cache import cache_key
+
+# ------------------------
+# Story-tree cache settings
+# ------------------------
+
+BRANCH_CACHE_ENABLED = os.getenv("BRANCH_CACHE_ENABLED", "false").lower() == "true"
+BRANCH_CACHE_VARIANTS = int(os.getenv("BRANCH_CACHE_VARIANTS", "3"))       # Passages kept per node
+BRANCH_CACHE_MAX_DEPTH = int(os.getenv("BRANCH_CACHE_MAX_DEPTH", "4"))     # Deepest chapter cached (1 = opening)
+BRANCH_CACHE_MAX_BYTES = int(os.getenv("BRANCH_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+BRANCH_CACHE_SEED = os.getenv("BRANCH_CACHE_SEED", "")  # playthroughs.py output to fill the cache from at startup
+
+
+class BranchCache:
+    """Passages shared between players for the popular paths of the story tree.
+
+    Every game starts from the same prompt and each turn offers four
+    choices, so the first chapters of different games follow the same
+    paths. A node of the tree is identified by the hash of the prompt that
+    generates it, which holds the opening and every choice made since
+    (with the passage served for each). Each node keeps up to `variants`
+    passages: the first players to reach it generate them as usual, later
+    ones get one of them at random without an AI call. Only chapters up to
+    `max_depth` are cached, as deeper paths rarely repeat; the least
+    recently used nodes are evicted beyond `max_bytes`.
+    """
+
+    def __init__(self, enabled: bool = BRANCH_CACHE_ENABLED, variants: int = BRANCH_CACHE_VARIANTS,
+                 max_depth: int = BRANCH_CACHE_MAX_DEPTH, max_bytes: int = BRANCH_CACHE_MAX_BYTES,
+                 params: Optional[Dict] = None):
+        self.enabled = enabled and variants > 0
+        self.variants = variants
+        self.max_depth = max_depth
+        self.max_bytes = max_bytes
+        self.params = params or {}
+        self._nodes: "OrderedDict[str, List[List]]" = OrderedDict()  # key -> [[passage, times served], ...]
+        self._bytes = 0
+        self._depths: Dict[int, Dict[str, int]] = {}
+        self._stats = {"hits": 0, "misses": 0, "stored": 0, "evicted": 0}
+
+    def _key(self, messages: List[Dict[str, str]], depth: int) -> Optional[str]:
+        if not self.enabled or depth > self.max_depth:
+            return None
+        return cache_key(messages, self.params)
+
+    def _count(self, depth: int, outcome: str) -> None:
+        self._stats[outcome] += 1
+        stats = self._depths.setdefault(depth, {"hits": 0, "misses": 0})
+        stats[outcome] += 1
+
+    def full(self, messages: List[Dict[str, str]], depth: int) -> bool:
+        """Whether lookup() would serve this node from memory (no counters change)"""
+        key = self._key(messages, depth)
+        return key is not None and len(self._nodes.get(key, ())) >= self.variants
+
+    def lookup(self, messages: List[Dict[str, str]], depth: int) -> Optional[str]:
+        """One of the node's passages once all its variants exist, else None (generate and add())"""
+        key = self._key(messages, depth)
+        if key is None:
+            return None
+        node = self._nodes.get(key)
+        if node is None or len(node) < self.variants:
+            self._count(depth, "misses")
+            return None
+        self._nodes.move_to_end(key)
+        variant = random.choice(node)
+        variant[1] += 1
+        self._count(depth, "hits")
+        return variant[0]
+
+    def add(self, messages: List[Dict[str, str]], depth: int, passage: str) -> None:
+        """Keep a validated passage generated for this node, while it has room for variants"""
+        key = self._key(messages, depth)
+        if key is not None:
+            self._store(key, passage)
+
+    def seed(self, path: str) -> int:
+        """Fill the cache from the passages of a playthroughs.py run; returns how many were stored"""
+        if not self.enabled:
+            return 0
+        stored = self._stats["stored"]
+        with open(path, "rb") as f:
+            for line in f:
+                try:
+                    record = json_codec.loads(line)
+                except json_codec.JSONDecodeError:
+                    continue  # Cut off by an interrupted run
+                for turn in record.get("turns", ()):
+                    if turn.get("branch_key") and not turn.get("degraded") and turn["depth"] <= self.max_depth:
+                        self._store(turn["branch_key"], turn["response"])
+        return self._stats["stored"] - stored
+
+    def _store(self, key: str, passage: str) -> None:
+        node = self._nodes.setdefault(key, [])
+        self._nodes.move_to_end(key)
+        if len(node) >= self.variants or any(variant[0] == passage for variant in node):
+            return
+        node.append([passage, 0])
+        self._bytes += len(passage)
+        self._stats["stored"] += 1
+        while self._bytes > self.max_bytes and len(self._nodes) > 1:
+            _, evicted = self._nodes.popitem(last=False)
+            self._bytes -= sum(len(variant[0]) for variant in evicted)
+            self._stats["evicted"] += 1
+
+    def stats(self) -> Dict:
+        """Hits and misses (overall and per chapter), tree size and how often stored passages were reused"""
+        stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        served = [variant[1] for node in self._nodes.values() for variant in node]
+        stats["nodes"] = len(self._nodes)
+        stats["variants"] = len(served)
+        stats["bytes"] = self._bytes
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        stats["reused_variants"] = sum(1 for count in served if count)
+        stats["mean_reuse"] = sum(served) / len(served) if served else 0.0
+        stats["depths"] = {depth: dict(counts) for depth, counts in sorted(self._depths.items())}
+        return stats
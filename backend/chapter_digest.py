@@ -0,0 +1,113 @@
+import asyncio
+import os
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from session_store import GameSession
+
+# ------------------------
+# Chapter summary settings
+# ------------------------
+
+SUMMARY_MAX_CONCURRENT = int(os.getenv("SUMMARY_MAX_CONCURRENT", "8"))  # Background summaries in flight, all games
+SUMMARY_WAIT = float(os.getenv("SUMMARY_WAIT", "15"))  # Seconds /summarize and /conclude wait for a pending summary
+
+
+def fallback_summary(choice: Optional[str]) -> str:
+    """Stand-in for a chapter whose summary is not available"""
+    if choice:
+        return f"You chose {choice} and continued your journey..."
+    return "Chapter in your ongoing adventure..."
+
+
+class ChapterSummarizer:
+    """Summarizes every finished chapter in the background and keeps each game's digest.
+
+    When a turn succeeds, schedule() starts summarizing the chapter the player
+    just left (its story and the choice made). The result is added to the
+    game's digest (GameSession.digest, one [summary, choice] entry per
+    chapter), so /summarize answers from the digest or waits for the task in
+    flight, and /conclude builds its prompt from the digest instead of the
+    chapters the client sends back.
+    """
+
+    def __init__(self, summarize: Callable[[str, str], Awaitable[str]],
+                 on_update: Optional[Callable[[GameSession], None]] = None,
+                 max_concurrent: int = SUMMARY_MAX_CONCURRENT, wait: float = SUMMARY_WAIT):
+        self.summarize = summarize  # Called with (story, choice); always returns a summary
+        self.on_update = on_update  # Called after a summary was added to a game's digest
+        self.wait = wait
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._pending: Dict[str, Dict[int, asyncio.Task]] = {}  # session_id -> chapter -> task
+        self._stats = {"scheduled": 0, "completed": 0, "failed": 0, "served_ready": 0, "served_waiting": 0,
+                       "not_ready": 0}
+
+    @staticmethod
+    def _entry(session: GameSession, chapter: int) -> List:
+        while len(session.digest) < chapter:
+            session.digest.append([None, None])
+        return session.digest[chapter - 1]
+
+    def schedule(self, session: GameSession, chapter: int, story: str, choice: str) -> None:
+        """Start summarizing a finished chapter (numbered from 1, the opening)"""
+        entry = self._entry(session, chapter)
+        entry[1] = choice
+        pending = self._pending.setdefault(session.session_id, {})
+        if entry[0] is not None or chapter in pending:
+            return
+        pending[chapter] = asyncio.create_task(self._summarize(session, chapter, story, choice))
+        self._stats["scheduled"] += 1
+
+    async def _summarize(self, session: GameSession, chapter: int, story: str, choice: str) -> Optional[str]:
+        try:
+            async with self._semaphore:
+                summary = await self.summarize(story, choice)
+        except Exception:
+            self._stats["failed"] += 1
+            return None
+        finally:
+            pending = self._pending.get(session.session_id, {})
+            pending.pop(chapter, None)
+            if not pending:
+                self._pending.pop(session.session_id, None)
+        # Looked up again: the digest may have been replaced by a newer copy of the game
+        self._entry(session, chapter)[0] = summary
+        self._stats["completed"] += 1
+        if self.on_update is not None:
+            self.on_update(session)
+        return summary
+
+    async def summary(self, session: GameSession, chapter: int) -> Optional[str]:
+        """A chapter's summary, waiting for it if it is still being written (None if unknown)"""
+        if 0 < chapter <= len(session.digest) and session.digest[chapter - 1][0] is not None:
+            self._stats["served_ready"] += 1
+            return session.digest[chapter - 1][0]
+        task = self._pending.get(session.session_id, {}).get(chapter)
+        if task is not None:
+            try:
+                summary = await asyncio.wait_for(asyncio.shield(task), self.wait)
+            except asyncio.TimeoutError:
+                summary = None
+            if summary is not None:
+                self._stats["served_waiting"] += 1
+                return summary
+        self._stats["not_ready"] += 1
+        return None
+
+    async def chapters(self, session: GameSession) -> Tuple[List[str], List[str]]:
+        """Summaries and choices of every finished chapter, after waiting for the pending ones"""
+        tasks = list(self._pending.get(session.session_id, {}).values())
+        if tasks:
+            await asyncio.wait(tasks, timeout=self.wait)
+        summaries = [summary or fallback_summary(choice) for summary, choice in session.digest]
+        choices = [choice for _, choice in session.digest if choice]
+        return summaries, choices
+
+    def discard(self, session_id: str) -> None:
+        """Cancel the pending summaries of a game that ended or was evicted"""
+        for task in self._pending.pop(session_id, {}).values():
+            task.cancel()
+
+    def stats(self) -> Dict[str, int]:
+        stats = dict(self._stats)
+        stats["pending"] = sum(len(tasks) for tasks in self._pending.values())
+        return stats
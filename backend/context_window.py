@@ -0,0 +1,151 @@
+import asyncio
+import logging
+import os
+import sys
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from json_parsing import extract_json
+from prompts import compaction_messages, synopsis_message
+from session_store import Turn
+
+logger = logging.getLogger("game.context")
+
+# ------------------------
+# Context window settings
+# ------------------------
+
+CONTEXT_RECENT_TURNS = int(os.getenv("CONTEXT_RECENT_TURNS", "4"))    # Turns kept verbatim after compaction
+CONTEXT_COMPACT_BATCH = int(os.getenv("CONTEXT_COMPACT_BATCH", "4"))  # Older turns folded per compaction
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))  # Prompt tokens per request
+SYNOPSIS_MAX_WORDS = int(os.getenv("SYNOPSIS_MAX_WORDS", "120"))
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (roughly 4 characters per token for English)"""
+    return len(text) // 4 + 1
+
+
+class StoryContext:
+    """The prompt state of one game: system prompt, running synopsis and recent turns"""
+
+    __slots__ = ("system_prompt", "synopsis", "turns", "folded_turns", "compaction")
+
+    def __init__(self, system_prompt: str):
+        self.system_prompt = system_prompt  # Shared by every game, so not counted in memory_size()
+        self.synopsis = ""
+        self.turns: List[Turn] = []
+        self.folded_turns = 0  # Turns already merged into the synopsis
+        self.compaction: Optional[asyncio.Task] = None
+
+    @property
+    def last_turn(self) -> Optional[Turn]:
+        return self.turns[-1] if self.turns else None
+
+    @property
+    def turn_count(self) -> int:
+        """Turns played so far, including the ones folded into the synopsis"""
+        return self.folded_turns + len(self.turns)
+
+    def memory_size(self) -> int:
+        """Approximate bytes held by this context"""
+        return (sys.getsizeof(self) + sys.getsizeof(self.synopsis) + sys.getsizeof(self.turns)
+                + sum(turn.memory_size() for turn in self.turns))
+
+
+class ContextManager:
+    """Keeps prompts bounded no matter how long a story runs.
+
+    Every request carries the system prompt, a compact synopsis of older
+    chapters and the turns since the last compaction verbatim. Once enough
+    turns pile up beyond the verbatim window they are folded into the
+    synopsis by a background LLM call. The result is applied on the next
+    turn, so the prompt for the current turn never changes while the player
+    is reading.
+
+    Between compactions the conversation only grows at the tail, so every
+    request starts with the previous request byte for byte and the
+    provider's prefix cache covers all but the newest turn. The prefix
+    changes only once per compaction batch.
+    """
+
+    def __init__(self, summarize: Callable[[List[Dict[str, str]]], Awaitable[Optional[str]]],
+                 recent_turns: int = CONTEXT_RECENT_TURNS, compact_batch: int = CONTEXT_COMPACT_BATCH,
+                 token_budget: int = CONTEXT_TOKEN_BUDGET):
+        self.summarize = summarize
+        self.recent_turns = max(1, recent_turns)
+        self.compact_batch = max(1, compact_batch)
+        self.token_budget = token_budget
+
+    def build_messages(self, context: StoryContext, prompt: str) -> List[Dict[str, str]]:
+        """Build the request for the next turn: an append-only prefix plus the new prompt"""
+        head = [{"role": "system", "content": context.system_prompt}]
+        if context.synopsis:
+            head.append(synopsis_message(context.synopsis))
+        tail = [{"role": "user", "content": prompt}]
+
+        used = sum(estimate_tokens(message["content"]) for message in head + tail)
+        recent: List[Dict[str, str]] = []
+        # Every turn not yet folded into the synopsis, so the prefix does not slide each turn.
+        # Only the token budget (a safety cap) drops the oldest ones; the last is always kept.
+        for turn in reversed(context.turns):
+            cost = estimate_tokens(turn.prompt) + estimate_tokens(turn.response)
+            if recent and used + cost > self.token_budget:
+                break
+            used += cost
+            recent[:0] = [
+                {"role": "user", "content": turn.prompt},
+                {"role": "assistant", "content": turn.response}
+            ]
+
+        return head + recent + tail
+
+    def add_turn(self, context: StoryContext, turn: Turn) -> None:
+        """Record a completed turn, applying or scheduling synopsis compaction"""
+        self._apply_compaction(context)
+        context.turns.append(turn)
+
+        overflow = len(context.turns) - self.recent_turns
+        if overflow >= self.compact_batch and context.compaction is None:
+            context.compaction = asyncio.create_task(
+                self._compact(context.synopsis, context.turns[:overflow])
+            )
+
+    def _apply_compaction(self, context: StoryContext) -> None:
+        task = context.compaction
+        if task is None or not task.done():
+            return
+        context.compaction = None
+        if task.cancelled() or task.exception() is not None or task.result() is None:
+            return
+
+        synopsis, folded = task.result()
+        context.synopsis = synopsis
+        context.turns = context.turns[folded:]
+        context.folded_turns += folded
+
+    async def _compact(self, synopsis: str, turns: List[Turn]):
+        """Fold older turns into the synopsis; returns (synopsis, turns folded) or None"""
+        chapters = [turn.story + (f" (The player chose: {turn.choice})" if turn.choice else "")
+                    for turn in turns]
+        response = await self.summarize(compaction_messages(synopsis, chapters, SYNOPSIS_MAX_WORDS))
+        data = extract_json(response)
+        if not data or not data.get("synopsis"):
+            logger.warning("Failed to compact story context, keeping turns verbatim")
+            return None
+        return data["synopsis"], len(turns)
+
+    def discard(self, context: StoryContext) -> None:
+        """Cancel any compaction still running for an ended game"""
+        if context.compaction is not None:
+            context.compaction.cancel()
+            context.compaction = None
+
+    def stats(self, context: StoryContext, prompt: str = "") -> Dict[str, int]:
+        """Report the size of a game's prompt state"""
+        return {
+            "verbatim_turns": len(context.turns),
+            "folded_turns": context.folded_turns,
+            "synopsis_tokens": estimate_tokens(context.synopsis) if context.synopsis else 0,
+            "prompt_tokens": sum(estimate_tokens(message["content"])
+                                 for message in self.build_messages(context, prompt))
+        }
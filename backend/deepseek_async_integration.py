@@ -0,0 +1,376 @@
+import asyncio
+import logging
+import os
+import time
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import aiohttp
+
+import json_codec
+from resilience import CircuitBreaker, LatencyTracker, RetryPolicy, UpstreamError, parse_retry_after
+
+# ------------------------
+# Connection pool settings
+# ------------------------
+
+DEEPSEEK_API_URL = os.getenv("DEEPSEEK_API_URL", "https://api.deepseek.com/v1/chat/completions")
+DEEPSEEK_MODEL = os.getenv("DEEPSEEK_MODEL", "deepseek-chat")
+# Allow JSON output mode (response_format json_object) for the calls that ask for it with json_mode=True
+JSON_MODE = os.getenv("DEEPSEEK_JSON_MODE", "true").lower() == "true"
+
+POOL_LIMIT = int(os.getenv("DEEPSEEK_POOL_LIMIT", "100"))  # Total sockets across all hosts
+POOL_LIMIT_PER_HOST = int(os.getenv("DEEPSEEK_POOL_LIMIT_PER_HOST", "32"))
+KEEPALIVE_TIMEOUT = float(os.getenv("DEEPSEEK_KEEPALIVE_TIMEOUT", "60"))
+DNS_CACHE_TTL = int(os.getenv("DEEPSEEK_DNS_CACHE_TTL", "300"))
+CONNECT_TIMEOUT = float(os.getenv("DEEPSEEK_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("DEEPSEEK_READ_TIMEOUT", "60"))
+
+# ------------------------
+# Resilience settings
+# ------------------------
+
+CALL_DEADLINE = float(os.getenv("DEEPSEEK_CALL_DEADLINE", "30"))  # Seconds per call, retries included
+MAX_ATTEMPTS = int(os.getenv("DEEPSEEK_MAX_ATTEMPTS", "3"))
+RETRY_BASE_DELAY = float(os.getenv("DEEPSEEK_RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY = float(os.getenv("DEEPSEEK_RETRY_MAX_DELAY", "8"))
+BREAKER_THRESHOLD = int(os.getenv("DEEPSEEK_BREAKER_THRESHOLD", "5"))  # Consecutive failures to open
+BREAKER_RESET = float(os.getenv("DEEPSEEK_BREAKER_RESET", "30"))       # Seconds before a probe
+HEDGE_ENABLED = os.getenv("DEEPSEEK_HEDGE_ENABLED", "false").lower() == "true"
+HEDGE_PERCENTILE = float(os.getenv("DEEPSEEK_HEDGE_PERCENTILE", "0.95"))
+HEDGE_MIN_SAMPLES = int(os.getenv("DEEPSEEK_HEDGE_MIN_SAMPLES", "20"))  # Latencies needed before hedging
+HEDGE_MIN_DELAY = float(os.getenv("DEEPSEEK_HEDGE_MIN_DELAY", "1"))
+
+
+class DeepSeekClient:
+    """Long-lived DeepSeek client backed by a keep-alive connection pool.
+
+    One instance is created when the app starts serving and closed when it
+    stops, so every story turn reuses warm TCP/TLS connections instead of
+    paying for a fresh DNS lookup and handshake.
+
+    Every call has a deadline. Transient failures (429, 5xx, connection
+    errors) are retried with jittered exponential backoff that respects
+    Retry-After, and a circuit breaker fails calls fast while DeepSeek is
+    unhealthy. With hedging on, a second identical request is fired when the
+    first one is slower than the recent p95 latency and the faster one wins.
+
+    The API is OpenAI-compatible, so adapters for other providers only change
+    the defaults and how the token usage is reported (see OpenAIClient).
+    """
+
+    provider = "deepseek"
+
+    def __init__(self, api_key: str, url: str = DEEPSEEK_API_URL, model: str = DEEPSEEK_MODEL,
+                 limit: int = POOL_LIMIT, limit_per_host: int = POOL_LIMIT_PER_HOST,
+                 keepalive_timeout: float = KEEPALIVE_TIMEOUT, dns_cache_ttl: int = DNS_CACHE_TTL,
+                 connect_timeout: float = CONNECT_TIMEOUT, read_timeout: float = READ_TIMEOUT,
+                 call_deadline: float = CALL_DEADLINE, hedge_enabled: bool = HEDGE_ENABLED,
+                 json_mode: bool = JSON_MODE):
+        self.api_key = api_key
+        self.logger = logging.getLogger(f"game.{self.provider}")
+        self.url = url
+        self.model = model
+        self.json_mode = json_mode
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.timeout = aiohttp.ClientTimeout(connect=connect_timeout, sock_read=read_timeout)
+
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._connector: Optional[aiohttp.TCPConnector] = None
+
+        # Pool usage counters
+        self._in_flight = 0  # Requests sent through the pool and not yet finished
+        self._waiting = 0    # Requests queued because the pool is exhausted
+
+        # Resilience
+        self.call_deadline = call_deadline
+        self.hedge_enabled = hedge_enabled
+        self.retry = RetryPolicy(MAX_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY)
+        self.breaker = CircuitBreaker(BREAKER_THRESHOLD, BREAKER_RESET)
+        self.latency = LatencyTracker()
+        self._counters = {"calls": 0, "failures": 0, "retries": 0, "deadline_exceeded": 0,
+                          "hedges": 0, "hedge_wins": 0}
+
+    async def start(self) -> None:
+        """Open the connection pool (idempotent)"""
+        if self._session is not None and not self._session.closed:
+            return
+
+        self._connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=self.dns_cache_ttl,
+            use_dns_cache=True,
+        )
+
+        # Count requests that have to wait for a free connection
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_queued_start.append(self._on_queued_start)
+        trace_config.on_connection_queued_end.append(self._on_queued_end)
+
+        self._session = aiohttp.ClientSession(
+            connector=self._connector,
+            timeout=self.timeout,
+            headers={
+                "Authorization": f"Bearer {self.api_key}",
+                "Content-Type": "application/json"
+            },
+            trace_configs=[trace_config],
+        )
+
+    async def close(self) -> None:
+        """Close the pool and every idle connection in it"""
+        if self._session is not None:
+            await self._session.close()
+        self._session = None
+        self._connector = None
+
+    async def _on_queued_start(self, session, ctx, params) -> None:
+        self._waiting += 1
+
+    async def _on_queued_end(self, session, ctx, params) -> None:
+        self._waiting -= 1
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            raise RuntimeError(f"{type(self).__name__} is not started")
+        return self._session
+
+    async def _request(self, body: bytes) -> Tuple[str, Dict]:
+        """Make one chat completion request, raising UpstreamError on failure.
+
+        Returns the message content and the token usage reported by the API.
+        """
+        start = time.monotonic()
+        self._in_flight += 1
+        try:
+            async with self.session.post(self.url, data=body) as response:
+                if response.status != 200:
+                    error_text = await response.text()
+                    raise UpstreamError(f"API Error {response.status}: {error_text}", response.status,
+                                        parse_retry_after(response.headers.get("Retry-After")))
+                data = json_codec.loads(await response.read())
+                content = data["choices"][0]["message"]["content"]
+                usage = self._normalize_usage(data.get("usage") or {})
+        except aiohttp.ClientError as e:
+            raise UpstreamError(f"Request error: {str(e)}") from e
+        finally:
+            self._in_flight -= 1
+
+        self.latency.record(time.monotonic() - start)
+        return content, usage
+
+    def _normalize_usage(self, usage: Dict) -> Dict:
+        """Report usage in DeepSeek's shape (prompt_cache_hit_tokens/prompt_cache_miss_tokens)"""
+        return usage
+
+    def _hedge_delay(self) -> Optional[float]:
+        if not self.hedge_enabled or len(self.latency) < HEDGE_MIN_SAMPLES:
+            return None
+        return max(HEDGE_MIN_DELAY, self.latency.percentile(HEDGE_PERCENTILE))
+
+    async def _hedged_request(self, body: bytes) -> Tuple[str, Dict]:
+        """Make a request, firing a backup copy if the first is slower than usual"""
+        hedge_delay = self._hedge_delay()
+        if hedge_delay is None:
+            return await self._request(body)
+
+        primary = asyncio.create_task(self._request(body))
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+            if not done:
+                self._counters["hedges"] += 1
+                tasks.add(asyncio.create_task(self._request(body)))
+
+            # Return the first success; only fail once every copy has failed
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self._counters["hedge_wins"] += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def chat(self, messages: List[Dict[str, str]], temperature: float = 0.7,
+                   max_tokens: int = 250, deadline: Optional[float] = None,
+                   usage: Optional[Dict] = None, attempts: Optional[int] = None,
+                   json_mode: bool = False) -> Optional[str]:
+        """Send a chat completion request and return the message content (None on failure).
+
+        If a usage dict is given it is filled with the token counts the API
+        reported for the successful attempt. `attempts` lowers the retry
+        budget, e.g. when the caller would rather fail over to another key.
+        `json_mode` asks for a JSON object (the prompt must mention JSON),
+        unless the client was created with JSON mode off.
+        """
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens
+        }
+        if json_mode and self.json_mode:
+            payload["response_format"] = {"type": "json_object"}
+        # Encoded once and reused by every retry and hedged copy
+        body = json_codec.dumps(payload)
+
+        self._counters["calls"] += 1
+        give_up_at = time.monotonic() + (deadline or self.call_deadline)
+        max_attempts = min(attempts or self.retry.max_attempts, self.retry.max_attempts)
+        for attempt in range(1, max_attempts + 1):
+            probe = self.breaker.allow()
+            if probe is None:
+                self.logger.warning(f"{self.provider} circuit breaker is open - failing fast")
+                break
+            try:
+                content, reported = await asyncio.wait_for(self._hedged_request(body),
+                                                           give_up_at - time.monotonic())
+                self.breaker.record_success()
+                if usage is not None:
+                    usage.update(reported)
+                return content
+            except asyncio.CancelledError:
+                self.breaker.release_probe(probe)  # Abandoned by the caller: says nothing about the upstream
+                raise
+            except asyncio.TimeoutError:
+                self.breaker.record_failure()
+                self._counters["deadline_exceeded"] += 1
+                self.logger.warning(f"{self.provider} call exceeded its deadline")
+                break
+            except UpstreamError as e:
+                self.breaker.record_failure()
+                self.logger.warning(str(e), extra={"status": e.status, "attempt": attempt})
+                if not e.retryable:
+                    break
+                delay = self.retry.delay(attempt, e.retry_after)
+            except Exception as e:
+                self.breaker.record_failure()
+                self.logger.error(f"Request error: {str(e)}")
+                break
+
+            if attempt == max_attempts or time.monotonic() + delay >= give_up_at:
+                break
+            self._counters["retries"] += 1
+            await asyncio.sleep(delay)
+
+        self._counters["failures"] += 1
+        return None
+
+    async def chat_stream(self, messages: List[Dict[str, str]], temperature: float = 0.7,
+                          max_tokens: int = 250, usage: Optional[Dict] = None,
+                          attempts: Optional[int] = None, json_mode: bool = False) -> AsyncIterator[str]:
+        """Send a streaming chat completion request and yield content deltas as they arrive.
+
+        Failures before the first delta are retried like chat(); once text has
+        been forwarded the stream simply ends on error. A given usage dict is
+        filled from the final chunk, if the stream is read to the end.
+        `json_mode` is as for chat().
+        """
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stream": True,
+            "stream_options": {"include_usage": True}
+        }
+        if json_mode and self.json_mode:
+            payload["response_format"] = {"type": "json_object"}
+        body = json_codec.dumps(payload)
+
+        self._counters["calls"] += 1
+        give_up_at = time.monotonic() + self.call_deadline
+        max_attempts = min(attempts or self.retry.max_attempts, self.retry.max_attempts)
+        for attempt in range(1, max_attempts + 1):
+            probe = self.breaker.allow()
+            if probe is None:
+                self.logger.warning(f"{self.provider} circuit breaker is open - failing fast")
+                break
+
+            started = False
+            delay = None
+            self._in_flight += 1
+            try:
+                async with self.session.post(self.url, data=body) as response:
+                    if response.status != 200:
+                        error_text = await response.text()
+                        raise UpstreamError(f"API Error {response.status}: {error_text}", response.status,
+                                            parse_retry_after(response.headers.get("Retry-After")))
+
+                    # Server-sent events: one "data: {...}" line per chunk
+                    async for line in response.content:
+                        line = line.strip()
+                        if not line.startswith(b"data:"):
+                            continue
+                        data = line[5:].strip()
+                        if data == b"[DONE]":
+                            break
+
+                        chunk = json_codec.loads(data)
+                        if usage is not None and chunk.get("usage"):
+                            usage.update(self._normalize_usage(chunk["usage"]))
+                        if not chunk.get("choices"):
+                            continue
+                        delta = chunk["choices"][0].get("delta", {}).get("content")
+                        if delta:
+                            started = True
+                            yield delta
+                self.breaker.record_success()
+                return
+            except (asyncio.CancelledError, GeneratorExit):
+                self.breaker.release_probe(probe)  # Abandoned by the caller: says nothing about the upstream
+                raise
+            except UpstreamError as e:
+                self.breaker.record_failure()
+                self.logger.warning(str(e), extra={"status": e.status, "attempt": attempt})
+                if e.retryable and not started:
+                    delay = self.retry.delay(attempt, e.retry_after)
+            except Exception as e:
+                self.breaker.record_failure()
+                self.logger.error(f"Stream error: {str(e)}")
+                if isinstance(e, aiohttp.ClientError) and not started:
+                    delay = self.retry.delay(attempt)
+            finally:
+                self._in_flight -= 1
+
+            if (delay is None or attempt == max_attempts
+                    or time.monotonic() + delay >= give_up_at):
+                break
+            self._counters["retries"] += 1
+            await asyncio.sleep(delay)
+
+        self._counters["failures"] += 1
+
+    def pool_stats(self) -> Dict[str, int]:
+        """Report connection pool usage: active, idle and waiting requests"""
+        idle = 0
+        if self._connector is not None and not self._connector.closed:
+            # aiohttp keeps idle keep-alive connections per host key
+            idle = sum(len(conns) for conns in getattr(self._connector, "_conns", {}).values())
+
+        return {
+            "active": self._in_flight - self._waiting,
+            "idle": idle,
+            "waiting": self._waiting,
+            "limit": self.limit,
+            "limit_per_host": self.limit_per_host,
+        }
+
+    def resilience_stats(self) -> Dict:
+        """Report call outcomes, breaker state and recent latency"""
+        stats = dict(self._counters)
+        stats["breaker_state"] = self.breaker.state
+        stats["breaker_rejected"] = self.breaker.rejected
+        stats.update(self.latency.stats())
+        return stats
@@ -0,0 +1,363 @@
+import asyncio
+import hashlib
+import io
+import logging
+import os
+import re
+import tempfile
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import aiohttp
+
+from resilience import UpstreamError, parse_retry_after
+
+try:
+    from PIL import Image
+except ImportError:  # Optional dependency; without it only the original image is served
+    Image = None
+
+logger = logging.getLogger("game.illustrations")
+
+# ------------------------
+# Illustration settings
+# ------------------------
+
+ILLUSTRATIONS_ENABLED = os.getenv("ILLUSTRATIONS_ENABLED", "false").lower() == "true"
+ILLUSTRATION_API_URL = os.getenv(
+    "ILLUSTRATION_API_URL", "https://api-inference.huggingface.co/models/xue089/stable_diffusion_pixelart4")
+ILLUSTRATION_API_TOKEN = os.getenv("ILLUSTRATION_API_TOKEN", os.getenv("HUGGINGFACE_API_TOKEN", ""))
+ILLUSTRATION_STYLE = os.getenv("ILLUSTRATION_STYLE", "pixel art, fantasy scene")  # Prefix of every image prompt
+ILLUSTRATION_WORKERS = int(os.getenv("ILLUSTRATION_WORKERS", "2"))         # Images generated at once
+ILLUSTRATION_QUEUE_SIZE = int(os.getenv("ILLUSTRATION_QUEUE_SIZE", "100"))  # Waiting jobs before new ones are refused
+ILLUSTRATION_TIMEOUT = float(os.getenv("ILLUSTRATION_TIMEOUT", "120"))      # Seconds per image
+ILLUSTRATION_CACHE_DIR = os.getenv("ILLUSTRATION_CACHE_DIR", "illustration_cache")
+ILLUSTRATION_VARIANTS = os.getenv("ILLUSTRATION_VARIANTS", "256,512")  # Widths of downscaled copies (needs Pillow)
+ILLUSTRATION_MAX_JOBS = int(os.getenv("ILLUSTRATION_MAX_JOBS", "10000"))  # Finished jobs remembered for polling
+
+MAX_SCENE_CHARS = 400
+MAX_POLL_WAIT = 30  # Longest long-poll a client may ask for, in seconds
+
+# Leading bytes of the image formats text-to-image endpoints return
+IMAGE_SIGNATURES = (
+    (b"\x89PNG", "png", "image/png"),
+    (b"\xff\xd8\xff", "jpg", "image/jpeg"),
+    (b"RIFF", "webp", "image/webp"),
+    (b"GIF8", "gif", "image/gif"),
+)
+CONTENT_TYPES = {extension: content_type for _, extension, content_type in IMAGE_SIGNATURES}
+
+_KEY_PATTERN = re.compile(r"[0-9a-f]{64}")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def scene_prompt(story: str, style: str = ILLUSTRATION_STYLE) -> str:
+    """Image prompt for a passage: the style, then the passage's first two sentences"""
+    sentences = _SENTENCE_END.split(" ".join(story.split()))
+    scene = " ".join(sentences[:2])[:MAX_SCENE_CHARS]
+    return f"{style}, {scene}" if style else scene
+
+
+def image_key(prompt: str, model: str) -> str:
+    """Content address of an illustration: the hash of the model and the prompt"""
+    return hashlib.sha256(f"{model}\n{prompt}".encode("utf-8")).hexdigest()
+
+
+def valid_key(key: str) -> bool:
+    return bool(_KEY_PATTERN.fullmatch(key))
+
+
+def image_extension(data: bytes) -> Optional[str]:
+    for signature, extension, _ in IMAGE_SIGNATURES:
+        if data.startswith(signature):
+            return extension
+    return None
+
+
+def parse_widths(spec: str) -> List[int]:
+    """Parse "256,512" into sorted widths"""
+    return sorted({int(width) for width in spec.split(",") if width.strip()})
+
+
+class ImageCache:
+    """Content-addressed image store on disk.
+
+    Every illustration lives in <directory>/<key[:2]>/<key>/ as
+    original.<ext> plus w<width>.webp downscaled copies. Files are written
+    once, atomically, and never change, so they can be served with immutable
+    caching headers. All disk I/O runs in a worker thread.
+    """
+
+    def __init__(self, directory: str = ILLUSTRATION_CACHE_DIR, widths: Optional[List[int]] = None):
+        self.directory = directory
+        self.widths = parse_widths(ILLUSTRATION_VARIANTS) if widths is None else widths
+        if Image is None:
+            self.widths = []
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def _files(self, key: str) -> Dict[str, str]:
+        """Variant name ("original", "w256", ...) -> file name"""
+        try:
+            names = os.listdir(self._path(key))
+        except FileNotFoundError:
+            return {}
+        return {name.split(".", 1)[0]: name for name in names if not name.startswith(".")}
+
+    def _write(self, path: str, data: bytes) -> None:
+        # Write to a temporary file and rename, so readers never see a partial image
+        handle, temporary = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".")
+        with os.fdopen(handle, "wb") as file:
+            file.write(data)
+        os.replace(temporary, path)
+
+    def _store(self, key: str, data: bytes) -> List[int]:
+        extension = image_extension(data)
+        if extension is None:
+            raise ValueError("Not an image (unknown format)")
+        os.makedirs(self._path(key), exist_ok=True)
+
+        widths = []
+        if self.widths:
+            image = Image.open(io.BytesIO(data))
+            image.load()
+            for width in self.widths:
+                if width >= image.width:
+                    continue
+                height = max(1, round(image.height * width / image.width))
+                output = io.BytesIO()
+                image.convert("RGB").resize((width, height), Image.LANCZOS).save(output, "WEBP", quality=80)
+                self._write(os.path.join(self._path(key), f"w{width}.webp"), output.getvalue())
+                widths.append(width)
+        # The original goes last: its presence marks a complete entry
+        self._write(os.path.join(self._path(key), f"original.{extension}"), data)
+        return widths
+
+    def _read(self, key: str, width: Optional[int]) -> Optional[Tuple[str, bytes, str]]:
+        files = self._files(key)
+        if "original" not in files:
+            return None
+        variant = "original"
+        if width:
+            # Smallest stored copy at least as wide as requested, else the original
+            for candidate in sorted(int(name[1:]) for name in files if name[1:].isdigit()):
+                if candidate >= width:
+                    variant = f"w{candidate}"
+                    break
+        name = files[variant]
+        with open(os.path.join(self._path(key), name), "rb") as file:
+            data = file.read()
+        return variant, data, CONTENT_TYPES.get(name.rsplit(".", 1)[-1], "application/octet-stream")
+
+    def _variants(self, key: str) -> Optional[List[int]]:
+        files = self._files(key)
+        if "original" not in files:
+            return None
+        return sorted(int(name[1:]) for name in files if name[1:].isdigit())
+
+    async def store(self, key: str, data: bytes) -> List[int]:
+        """Store an image and its downscaled copies, returning the widths of the copies"""
+        return await asyncio.to_thread(self._store, key, data)
+
+    async def read(self, key: str, width: Optional[int] = None) -> Optional[Tuple[str, bytes, str]]:
+        """(variant, bytes, content type) of the best copy for a display width, or None"""
+        return await asyncio.to_thread(self._read, key, width)
+
+    async def variants(self, key: str) -> Optional[List[int]]:
+        """Widths of the stored copies, or None if the image is not cached"""
+        return await asyncio.to_thread(self._variants, key)
+
+
+class ImageGenerator:
+    """Client for a text-to-image endpoint in the Hugging Face inference API format.
+
+    POSTs {"inputs": prompt} and expects the image bytes back.
+    """
+
+    def __init__(self, url: str = ILLUSTRATION_API_URL, token: str = ILLUSTRATION_API_TOKEN,
+                 timeout: float = ILLUSTRATION_TIMEOUT):
+        self.url = url
+        self.token = token
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def start(self) -> None:
+        if self._session is None or self._session.closed:
+            headers = {"Authorization": f"Bearer {self.token}"} if self.token else {}
+            self._session = aiohttp.ClientSession(timeout=self.timeout, headers=headers)
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+        self._session = None
+
+    async def generate(self, prompt: str) -> bytes:
+        """Generate one image, raising UpstreamError on failure"""
+        if self._session is None:
+            raise RuntimeError("ImageGenerator is not started")
+        payload = {"inputs": prompt, "options": {"wait_for_model": True}}
+        try:
+            async with self._session.post(self.url, json=payload) as response:
+                if response.status != 200:
+                    error_text = await response.text()
+                    raise UpstreamError(f"Image API Error {response.status}: {error_text[:200]}", response.status,
+                                        parse_retry_after(response.headers.get("Retry-After")))
+                return await response.read()
+        except aiohttp.ClientError as e:
+            raise UpstreamError(f"Image request error: {str(e)}") from e
+
+
+class IllustrationJob:
+    """One scene illustration, identified by its content address"""
+
+    def __init__(self, key: str, prompt: str):
+        self.key = key
+        self.prompt = prompt
+        self.status = "queued"  # queued, running, done or failed
+        self.error: Optional[str] = None
+        self.variants: List[int] = []
+        self.created = time.monotonic()
+        self.finished = asyncio.Event()
+
+    def info(self) -> Dict:
+        info = {"job_id": self.key, "status": self.status}
+        if self.status == "done":
+            info["variants"] = self.variants
+        if self.error:
+            info["error"] = self.error
+        return info
+
+
+class IllustrationQueue:
+    """Generates scene illustrations in the background with a bounded pool of workers.
+
+    submit() never waits: it hashes the scene prompt and either returns the
+    job that already has (or is making) that image or queues a new one, and
+    refuses work when the queue is full. Workers check the disk cache before
+    calling the image API, so a scene is generated once per cache directory.
+    Clients poll (or long-poll with wait()) the job by its ID, which is also
+    the content address of the image.
+    """
+
+    def __init__(self, generator: ImageGenerator, cache: ImageCache, workers: int = ILLUSTRATION_WORKERS,
+                 queue_size: int = ILLUSTRATION_QUEUE_SIZE, max_jobs: int = ILLUSTRATION_MAX_JOBS):
+        self.generator = generator
+        self.cache = cache
+        self.workers = max(1, workers)
+        self.max_jobs = max_jobs
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._jobs: "OrderedDict[str, IllustrationJob]" = OrderedDict()
+        self._tasks: List[asyncio.Task] = []
+        self._stats = {"submitted": 0, "reused": 0, "cached": 0, "generated": 0, "failed": 0, "rejected": 0}
+        self._generation_time = 0.0
+
+    def submit(self, story: str) -> Optional[Dict]:
+        """Queue the illustration of a passage (None if the queue is full)"""
+        prompt = scene_prompt(story)
+        key = image_key(prompt, self.generator.url)
+        self._stats["submitted"] += 1
+
+        job = self._jobs.get(key)
+        if job is not None and job.status != "failed":
+            self._jobs.move_to_end(key)
+            self._stats["reused"] += 1
+            return job.info()
+
+        job = IllustrationJob(key, prompt)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self._stats["rejected"] += 1
+            return None
+        self._jobs[key] = job
+        self._trim()
+        return job.info()
+
+    def _trim(self) -> None:
+        # Forget the oldest finished jobs; their images stay on disk
+        for key in list(self._jobs):
+            if len(self._jobs) <= self.max_jobs:
+                break
+            if self._jobs[key].finished.is_set():
+                del self._jobs[key]
+
+    async def _run(self, job: IllustrationJob) -> None:
+        job.status = "running"
+        try:
+            variants = await self.cache.variants(job.key)
+            if variants is not None:
+                self._stats["cached"] += 1
+            else:
+                start = time.monotonic()
+                data = await self.generator.generate(job.prompt)
+                variants = await self.cache.store(job.key, data)
+                self._generation_time += time.monotonic() - start
+                self._stats["generated"] += 1
+            job.variants = variants
+            job.status = "done"
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            self._stats["failed"] += 1
+            logger.warning(f"Illustration failed: {str(e)}", extra={"job_id": job.key})
+        finally:
+            job.finished.set()
+
+    async def _work(self) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self._queue.task_done()
+
+    async def job(self, key: str) -> Optional[Dict]:
+        """Status of a job; finished images that are no longer tracked are found on disk"""
+        job = self._jobs.get(key)
+        if job is not None:
+            return job.info()
+        variants = await self.cache.variants(key)
+        if variants is None:
+            return None
+        return {"job_id": key, "status": "done", "variants": variants}
+
+    async def wait(self, key: str, timeout: float) -> Optional[Dict]:
+        """Like job(), but first wait up to `timeout` seconds for the job to finish"""
+        job = self._jobs.get(key)
+        if job is not None and not job.finished.is_set():
+            try:
+                await asyncio.wait_for(job.finished.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return await self.job(key)
+
+    async def start(self) -> None:
+        """Start the workers (idempotent)"""
+        if not self._tasks:
+            await self.generator.start()
+            self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def close(self) -> None:
+        """Stop the workers; queued jobs are dropped"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.generator.close()
+
+    def __len__(self) -> int:
+        return self._queue.qsize()
+
+    def stats(self) -> Dict:
+        """Report queue depth, job outcomes and generation time"""
+        stats = dict(self._stats)
+        stats["queued"] = self._queue.qsize()
+        stats["running"] = sum(1 for job in self._jobs.values() if job.status == "running")
+        stats["tracked_jobs"] = len(self._jobs)
+        stats["workers"] = self.workers
+        stats["variants"] = self.cache.widths
+        stats["mean_generation_seconds"] = (round(self._generation_time / stats["generated"], 3)
+                                            if stats["generated"] else 0.0)
+        return stats
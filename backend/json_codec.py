@@ -0,0 +1,76 @@
+import json
+import os
+from typing import Any, Callable, Optional, Union
+
+from quart.json.provider import DefaultJSONProvider
+
+# ------------------------
+# JSON codec settings
+# ------------------------
+
+JSON_CODEC = os.getenv("JSON_CODEC", "auto").lower()  # auto (orjson if installed), orjson or stdlib
+
+try:
+    import orjson
+except ImportError:  # Optional dependency; the stdlib codec is used without it
+    orjson = None
+
+if JSON_CODEC == "orjson" and orjson is None:
+    raise ValueError("JSON_CODEC=orjson but the orjson package is not installed")
+
+USE_ORJSON = orjson is not None and JSON_CODEC != "stdlib"
+CODEC_NAME = "orjson" if USE_ORJSON else "stdlib"
+
+# Raised for invalid input by both codecs (orjson's error subclasses it)
+JSONDecodeError = json.JSONDecodeError
+
+
+def dumps(obj: Any, sort_keys: bool = False, default: Optional[Callable[[Any], Any]] = None) -> bytes:
+    """Encode obj as compact UTF-8 JSON bytes.
+
+    The stdlib fallback escapes non-ASCII characters (its fastest mode), so
+    the two codecs only produce identical bytes for ASCII text.
+    """
+    if USE_ORJSON:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+        return orjson.dumps(obj, default=default, option=option)
+    return json.dumps(obj, sort_keys=sort_keys, default=default, separators=(",", ":")).encode("utf-8")
+
+
+def dumps_str(obj: Any, sort_keys: bool = False, default: Optional[Callable[[Any], Any]] = None) -> str:
+    """dumps() decoded to str, for text protocols (SSE, log lines)"""
+    return dumps(obj, sort_keys, default).decode("utf-8")
+
+
+def loads(data: Union[str, bytes, bytearray, memoryview]) -> Any:
+    """Decode JSON text or UTF-8 bytes"""
+    if USE_ORJSON:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class CodecJSONProvider(DefaultJSONProvider):
+    """Quart JSON provider (jsonify, request.get_json) backed by this module's codec"""
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        if kwargs or not USE_ORJSON:
+            # Pretty-printing (debug responses) and custom options go through the stdlib
+            kwargs.setdefault("default", self.default)
+            return json.dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+
+    def response(self, *args: Any, **kwargs: Any):
+        if not USE_ORJSON:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            option |= orjson.OPT_INDENT_2
+        # Encode straight to the response bytes, skipping the str round trip
+        return self._app.response_class(orjson.dumps(obj, default=self.default, option=option),
+                                        mimetype=self.mimetype)
+
+    def loads(self, s: Union[str, bytes], **kwargs: Any) -> Any:
+        if kwargs:
+            return json.loads(s, **kwargs)
+        return loads(s)
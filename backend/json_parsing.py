@@ -0,0 +1,297 @@
+import logging
+import re
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import json_codec
+
+logger = logging.getLogger("game.json")
+
+# Simple JSON escapes -> decoded character
+_ESCAPES = {
+    '"': '"',
+    '\\': '\\',
+    '/': '/',
+    'b': '\b',
+    'f': '\f',
+    'n': '\n',
+    'r': '\r',
+    't': '\t',
+}
+
+# How extract_json() calls ended, by the pattern that matched (or why none did)
+extract_counts = {
+    "strict": 0,            # A balanced object was valid JSON
+    "tolerant": 0,          # Valid once single quotes were rewritten
+    "fields": 0,            # Story/choices pulled out by regex (e.g. truncated output)
+    "empty": 0,             # No response text at all
+    "no_match": 0,          # Nothing usable found
+    "error": 0,             # Unexpected exception while extracting
+    "invalid_candidate": 0,  # Balanced objects that were not valid JSON (any pass)
+}
+
+
+class StoryStreamReader:
+    """Incremental reader that pulls the "story" string out of a partial JSON buffer.
+
+    Feed it the model output chunk by chunk as it streams in. Each call to
+    feed() returns the newly decoded characters of the top-level "story"
+    value, so they can be forwarded to the player before the rest of the
+    object (the "choices" array) has been generated. Every character is
+    looked at exactly once.
+    """
+
+    def __init__(self, field: str = "story"):
+        self.field = field
+        self.buffer = ""       # Everything received so far
+        self.start = -1        # Index of the opening brace of the top-level object
+        self.end = -1          # Index just past the closing brace
+        self._pos = 0          # Next buffer index to scan
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._unicode = None   # Pending hex digits of a \uXXXX escape
+        self._expect_key = False
+        self._string_is_key = False
+        self._key: List[str] = []
+        self._last_key: Optional[str] = None
+        self._capturing = False
+        self._captured: List[str] = []
+
+    @property
+    def complete(self) -> bool:
+        """True once the top-level JSON object has been closed"""
+        return self.end != -1
+
+    @property
+    def text(self) -> str:
+        """The raw text of the top-level object if complete, else the whole buffer"""
+        if self.complete:
+            return self.buffer[self.start:self.end]
+        return self.buffer
+
+    @property
+    def story(self) -> str:
+        """The story text decoded so far"""
+        return "".join(self._captured)
+
+    def feed(self, chunk: str) -> str:
+        """Add a chunk of model output and return newly decoded story text"""
+        self.buffer += chunk
+        if self.complete:
+            return ""
+
+        emitted: List[str] = []
+        buffer = self.buffer
+        for pos in range(self._pos, len(buffer)):
+            char = buffer[pos]
+
+            if self._in_string:
+                decoded = self._string_char(char)
+                if decoded and self._capturing:
+                    emitted.append(decoded)
+                continue
+
+            if self._depth == 0:
+                # Skip any chatter before the object starts
+                if char == '{':
+                    self.start = pos
+                    self._depth = 1
+                    self._expect_key = True
+                continue
+
+            if char == '"':
+                self._in_string = True
+                self._string_is_key = self._depth == 1 and self._expect_key
+                self._capturing = (self._depth == 1 and not self._expect_key
+                                   and self._last_key == self.field)
+                self._key = []
+            elif char in '{[':
+                self._depth += 1
+            elif char in '}]':
+                self._depth -= 1
+                if self._depth == 0:
+                    self.end = pos + 1
+                    self._pos = pos + 1
+                    break
+            elif self._depth == 1 and char == ',':
+                self._expect_key = True
+            elif self._depth == 1 and char == ':':
+                self._expect_key = False
+        else:
+            self._pos = len(buffer)
+
+        text = "".join(emitted)
+        self._captured.append(text)
+        return text
+
+    def _string_char(self, char: str) -> str:
+        """Advance through one character inside a string, returning its decoded form"""
+        if self._unicode is not None:
+            self._unicode += char
+            if len(self._unicode) < 4:
+                return ""
+            try:
+                decoded = chr(int(self._unicode, 16))
+            except ValueError:
+                decoded = ""
+            self._unicode = None
+            return self._collect(decoded)
+
+        if self._escape:
+            self._escape = False
+            if char == 'u':
+                self._unicode = ""
+                return ""
+            return self._collect(_ESCAPES.get(char, char))
+
+        if char == '\\':
+            self._escape = True
+            return ""
+
+        if char == '"':
+            self._in_string = False
+            if self._string_is_key:
+                self._last_key = "".join(self._key)
+            self._capturing = False
+            return ""
+
+        return self._collect(char)
+
+    def _collect(self, decoded: str) -> str:
+        if self._string_is_key:
+            self._key.append(decoded)
+        return decoded
+
+
+# -----------------------
+# Complete responses
+# -----------------------
+
+def iter_json_objects(text: str, tolerant: bool = False) -> Iterator[str]:
+    """Yield each balanced top-level {...} object in text, in order.
+
+    The scanner is aware of strings and escapes, so braces inside story text
+    do not confuse it, and it never revisits a character: the whole text is
+    scanned in linear time even if it is long, truncated or malformed. When
+    a { never balances (e.g. a stray brace in prose before the object, or a
+    truncated response), the objects nested in it that did balance are
+    yielded instead; every other { after it cannot balance either.
+
+    In tolerant mode single-quoted strings (e.g. {'story': ...}) are accepted
+    and rewritten with double quotes, leaving apostrophes inside properly
+    double-quoted strings untouched.
+    """
+    length = len(text)
+    pos = text.find('{')
+    while pos != -1:
+        depth = 0
+        quote = None      # Quote character of the string we are inside, if any
+        escape = False
+        out: List[str] = []
+        end = -1
+        opened: List[Tuple[str, int, int]] = []  # Bracket, its index in text and in out, for each open one
+        nested: List[Tuple[int, int, int, int]] = []  # Outermost balanced {...} inside this one: text and out spans
+
+        for i in range(pos, length):
+            char = text[i]
+
+            if quote is not None:
+                if escape:
+                    escape = False
+                    # \' is not a valid JSON escape, so drop the backslash
+                    if tolerant and char == "'":
+                        out.pop()
+                elif char == '\\':
+                    escape = True
+                elif char == quote:
+                    quote = None
+                    char = '"'
+                elif char == '"':
+                    # Only reachable inside a single-quoted string
+                    char = '\\"'
+            elif char == '"' or (tolerant and char == "'"):
+                quote = char
+                char = '"'
+            elif char == '{' or char == '[':
+                depth += 1
+                opened.append((char, i, len(out)))
+            elif char == '}' or char == ']':
+                depth -= 1
+                if depth == 0:
+                    end = i + 1
+                    if tolerant:
+                        out.append(char)
+                    break
+                bracket, start, out_start = opened.pop()
+                if bracket == '{':
+                    while nested and nested[-1][0] > start:
+                        nested.pop()  # Inside this one
+                    nested.append((start, i + 1, out_start, len(out) + 1))
+
+            if tolerant:
+                out.append(char)
+
+        if end == -1:
+            for start, stop, out_start, out_stop in nested:
+                yield "".join(out[out_start:out_stop]) if tolerant else text[start:stop]
+            return
+
+        yield "".join(out) if tolerant else text[pos:end]
+        pos = text.find('{', end)
+
+
+def extract_json(text: str) -> Optional[Dict]:
+    """Extract JSON from the AI response text with improved pattern matching"""
+    if not text:
+        logger.warning("Empty response received")
+        extract_counts["empty"] += 1
+        return None
+        
+    try:
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"AI Response: {text[:200]}...")  # First 200 chars for debugging
+        
+        # Pass 1: the first balanced object that is valid JSON
+        for candidate in iter_json_objects(text):
+            try:
+                data = json_codec.loads(candidate)
+                extract_counts["strict"] += 1
+                return data
+            except json_codec.JSONDecodeError:
+                extract_counts["invalid_candidate"] += 1
+                logger.debug(f"Failed to parse JSON object: {candidate[:100]}...")
+        
+        # Pass 2: accept single-quoted keys and strings
+        if "'" in text:
+            for candidate in iter_json_objects(text, tolerant=True):
+                try:
+                    data = json_codec.loads(candidate)
+                    extract_counts["tolerant"] += 1
+                    return data
+                except json_codec.JSONDecodeError:
+                    extract_counts["invalid_candidate"] += 1
+                    logger.debug(f"Failed to parse tolerant JSON object: {candidate[:100]}...")
+        
+        # Last resort - try to extract structured fields manually (e.g. truncated output)
+        story_match = re.search(r'"story"\s*:\s*"((?:[^"\\]|\\.)*)"', text)
+        choices_match = re.search(r'"choices"\s*:\s*\[([^\]]*)\]', text)
+        
+        if story_match and choices_match:
+            story = json_codec.loads(f'"{story_match.group(1)}"')
+            choices_text = choices_match.group(1)
+            choices = [json_codec.loads(f'"{choice}"')
+                       for choice in re.findall(r'"((?:[^"\\]|\\.)*)"', choices_text)]
+            
+            extract_counts["fields"] += 1
+            return {
+                "story": story,
+                "choices": choices
+            }
+            
+        logger.warning("No valid JSON pattern found in response", extra={"response_chars": len(text)})
+        extract_counts["no_match"] += 1
+        return None
+    except Exception as e:
+        logger.error(f"Error extracting JSON: {str(e)}")
+        extract_counts["error"] += 1
+        return None
@@ -0,0 +1,284 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, List, Optional
+
+from deepseek_async_integration import CALL_DEADLINE, DeepSeekClient
+from llm_scheduler import parse_limits
+from openai_integration import OpenAIClient
+
+logger = logging.getLogger("game.router")
+
+# ------------------------
+# Routing settings
+# ------------------------
+
+LLM_PROVIDERS = os.getenv("LLM_PROVIDERS", "deepseek")  # Providers to route between, e.g. "deepseek,openai"
+ROUTER_EWMA_ALPHA = float(os.getenv("LLM_ROUTER_EWMA_ALPHA", "0.2"))  # Weight of the newest latency/error sample
+ROUTER_EXPLORE_RATE = float(os.getenv("LLM_ROUTER_EXPLORE_RATE", "0.05"))  # Calls sent to a random route to re-measure it
+ROUTER_MAX_ROUTES_PER_CALL = int(os.getenv("LLM_ROUTER_MAX_ROUTES_PER_CALL", "3"))  # Routes tried before giving up
+ROUTER_AFFINITY_SLACK = float(os.getenv("LLM_ROUTER_AFFINITY_SLACK", "1.5"))  # Keep a session's route unless this much worse
+ROUTER_AFFINITY_MAX_SESSIONS = int(os.getenv("LLM_ROUTER_AFFINITY_MAX_SESSIONS", "10000"))
+# Calls in flight per provider, all its keys together, e.g. "deepseek=24,openai=8" (unlisted = no cap)
+PROVIDER_MAX_CONCURRENT = os.getenv("LLM_PROVIDER_MAX_CONCURRENT", "")
+
+# Provider name -> (client class, environment variable holding its key)
+PROVIDERS = {
+    "deepseek": (DeepSeekClient, "DEEPSEEK_API_KEY"),
+    "openai": (OpenAIClient, "OPENAI_API_KEY"),
+}
+
+
+def api_keys(variable: str) -> List[str]:
+    """The keys in VARIABLE and the comma-separated VARIABLE + "S" (e.g. DEEPSEEK_API_KEYS)"""
+    keys = [os.getenv(variable, "")] + os.getenv(variable + "S", "").split(",")
+    return list(dict.fromkeys(key.strip() for key in keys if key.strip()))
+
+
+class Route:
+    """One provider and API key, with live estimates of its latency and error rate.
+
+    The client can be any object with DeepSeekClient's interface (start,
+    close, chat, chat_stream, pool_stats, resilience_stats and breaker).
+    """
+
+    def __init__(self, name: str, client: DeepSeekClient, alpha: float = ROUTER_EWMA_ALPHA):
+        self.name = name
+        self.client = client
+        self.alpha = alpha
+        self.latency: Optional[float] = None  # EWMA seconds per successful call
+        self.error_rate = 0.0                 # EWMA of the share of failed calls
+        self.in_flight = 0
+        self.calls = 0
+        self.failures = 0
+
+    def available(self) -> bool:
+        return self.client.breaker.available()
+
+    def score(self, unmeasured_latency: float) -> float:
+        """Expected cost of sending the next call here (lower is better)"""
+        latency = self.latency if self.latency is not None else unmeasured_latency
+        # Calls already in flight on this route queue up for the same rate limit
+        return latency * (1 + self.in_flight) / max(0.05, 1 - self.error_rate)
+
+    def record(self, seconds: float, ok: bool) -> None:
+        self.calls += 1
+        self.error_rate += self.alpha * ((0.0 if ok else 1.0) - self.error_rate)
+        if not ok:
+            # Failures are often fast, so they only count towards the error rate
+            self.failures += 1
+        elif self.latency is None:
+            self.latency = seconds
+        else:
+            self.latency += self.alpha * (seconds - self.latency)
+
+    def stats(self) -> Dict:
+        upstream = self.client.resilience_stats()
+        return {
+            "route": self.name,
+            "provider": self.client.provider,
+            "model": self.client.model,
+            "calls": self.calls,
+            "failures": self.failures,
+            "in_flight": self.in_flight,
+            "latency_ewma_seconds": self.latency,
+            "error_rate": round(self.error_rate, 4),
+            "breaker_state": upstream["breaker_state"],
+            "p50_seconds": upstream["p50_seconds"],
+            "p95_seconds": upstream["p95_seconds"],
+        }
+
+
+class LLMRouter:
+    """Sends each call to the healthiest, fastest provider/key and fails over to the next.
+
+    Routes are ranked by EWMA latency, weighted by the calls already in flight
+    and by the recent error rate; routes whose circuit breaker is open are
+    skipped. A route that is not the last option gets a single attempt, so a
+    rate-limited key hands the call to another key instead of backing off.
+    Calls of one session stick to the route that served it last (unless it has
+    become much worse), which keeps the provider's prompt prefix cache warm.
+    A small share of calls goes to a random route so recovered routes are
+    measured again. Providers that have reached their concurrency cap are
+    passed over while another one has room.
+
+    The router has the same chat/chat_stream/stats interface as a single
+    client, so the app does not care how many providers or keys are behind it.
+    """
+
+    def __init__(self, routes: List[Route], explore_rate: float = ROUTER_EXPLORE_RATE,
+                 max_routes_per_call: int = ROUTER_MAX_ROUTES_PER_CALL,
+                 affinity_slack: float = ROUTER_AFFINITY_SLACK,
+                 affinity_max_sessions: int = ROUTER_AFFINITY_MAX_SESSIONS,
+                 provider_limits: Optional[Dict[str, int]] = None):
+        if not routes:
+            raise ValueError("LLMRouter needs at least one route")
+        self.routes = routes
+        self.explore_rate = explore_rate
+        self.max_routes_per_call = max(1, max_routes_per_call)
+        self.affinity_slack = affinity_slack
+        self.affinity_max_sessions = affinity_max_sessions
+        self.provider_limits = parse_limits(PROVIDER_MAX_CONCURRENT) if provider_limits is None else provider_limits
+        self._affinity: "OrderedDict[str, Route]" = OrderedDict()
+        self._failovers = 0
+
+    @property
+    def model(self) -> str:
+        """Model of the primary route"""
+        return self.routes[0].client.model
+
+    async def start(self) -> None:
+        await asyncio.gather(*(route.client.start() for route in self.routes))
+
+    async def close(self) -> None:
+        await asyncio.gather(*(route.client.close() for route in self.routes))
+
+    def forget(self, session_id: str) -> None:
+        """Drop a finished session's route affinity"""
+        self._affinity.pop(session_id, None)
+
+    def _provider_in_flight(self, provider: str) -> int:
+        return sum(route.in_flight for route in self.routes if route.client.provider == provider)
+
+    def _has_room(self, provider: str) -> bool:
+        limit = self.provider_limits.get(provider)
+        return limit is None or self._provider_in_flight(provider) < limit
+
+    def has_capacity(self, pending: int = 0) -> bool:
+        """Whether some provider can take `pending` + 1 more calls without passing its cap"""
+        free = 0
+        for provider in {route.client.provider for route in self.routes}:
+            limit = self.provider_limits.get(provider)
+            if limit is None:
+                return True
+            free += max(0, limit - self._provider_in_flight(provider))
+        return free > pending
+
+    def _remember(self, session_id: Optional[str], route: Route) -> None:
+        if session_id is None or len(self.routes) == 1:
+            return
+        self._affinity[session_id] = route
+        self._affinity.move_to_end(session_id)
+        while len(self._affinity) > self.affinity_max_sessions:
+            self._affinity.popitem(last=False)
+
+    def _ranked(self, session_id: Optional[str] = None) -> List[Route]:
+        """Routes to try for one call, best first"""
+        candidates = [route for route in self.routes if route.available()]
+        if not candidates:
+            # Every breaker is open: let the clients fail fast (and probe when due)
+            candidates = list(self.routes)
+        candidates = [route for route in candidates if self._has_room(route.client.provider)] or candidates
+
+        measured = [route.latency for route in candidates if route.latency is not None]
+        # Unmeasured routes look as good as the best one, so they get tried early
+        unmeasured_latency = min(measured) if measured else 0.0
+        scores = {route.name: route.score(unmeasured_latency) for route in candidates}
+        ranked = sorted(candidates, key=lambda route: scores[route.name])
+
+        preferred = self._affinity.get(session_id) if session_id is not None else None
+        if preferred in ranked and scores[preferred.name] <= scores[ranked[0].name] * self.affinity_slack:
+            ranked.remove(preferred)
+            ranked.insert(0, preferred)
+        elif len(ranked) > 1 and random.random() < self.explore_rate:
+            ranked.insert(0, ranked.pop(random.randrange(1, len(ranked))))
+        return ranked[:self.max_routes_per_call]
+
+    async def chat(self, messages: List[Dict[str, str]], temperature: float = 0.7,
+                   max_tokens: int = 250, deadline: Optional[float] = None,
+                   usage: Optional[Dict] = None, session_id: Optional[str] = None,
+                   json_mode: bool = False) -> Optional[str]:
+        """Send a chat completion request through the best route (None if every route failed)"""
+        give_up_at = time.monotonic() + (deadline or CALL_DEADLINE)
+        ranked = self._ranked(session_id)
+        for index, route in enumerate(ranked):
+            remaining = give_up_at - time.monotonic()
+            if remaining <= 0:
+                break
+            last = index == len(ranked) - 1
+            start = time.monotonic()
+            route.in_flight += 1
+            try:
+                content = await route.client.chat(messages, temperature, max_tokens, remaining, usage,
+                                                  attempts=None if last else 1, json_mode=json_mode)
+            finally:
+                route.in_flight -= 1
+            route.record(time.monotonic() - start, content is not None)
+            if content is not None:
+                self._remember(session_id, route)
+                return content
+            if not last:
+                self._failovers += 1
+                logger.warning(f"Route {route.name} failed, trying {ranked[index + 1].name}")
+        return None
+
+    async def chat_stream(self, messages: List[Dict[str, str]], temperature: float = 0.7,
+                          max_tokens: int = 250, usage: Optional[Dict] = None,
+                          session_id: Optional[str] = None, json_mode: bool = False) -> AsyncIterator[str]:
+        """Stream a chat completion through the best route.
+
+        A route that fails before its first delta hands the call to the next
+        one; once text has been forwarded the stream stays on its route.
+        """
+        ranked = self._ranked(session_id)
+        for index, route in enumerate(ranked):
+            last = index == len(ranked) - 1
+            started = False
+            start = time.monotonic()
+            route.in_flight += 1
+            try:
+                async for delta in route.client.chat_stream(messages, temperature, max_tokens, usage,
+                                                            attempts=None if last else 1, json_mode=json_mode):
+                    started = True
+                    yield delta
+            finally:
+                route.in_flight -= 1
+                route.record(time.monotonic() - start, started)
+            if started:
+                self._remember(session_id, route)
+                return
+            if not last:
+                self._failovers += 1
+                logger.warning(f"Route {route.name} failed, trying {ranked[index + 1].name}")
+
+    def pool_stats(self) -> Dict[str, int]:
+        """Connection pool usage summed over every route"""
+        totals = {"active": 0, "idle": 0, "waiting": 0, "limit": 0, "limit_per_host": 0}
+        for route in self.routes:
+            for key, value in route.client.pool_stats().items():
+                totals[key] += value
+        return totals
+
+    def resilience_stats(self) -> Dict:
+        """Call outcomes summed over every route, plus each route's health"""
+        stats = {"calls": 0, "failures": 0, "retries": 0, "deadline_exceeded": 0,
+                 "hedges": 0, "hedge_wins": 0, "breaker_rejected": 0}
+        states = set()
+        for route in self.routes:
+            upstream = route.client.resilience_stats()
+            for key in stats:
+                stats[key] += upstream[key]
+            states.add(upstream["breaker_state"])
+        # "open" only when no route can take calls
+        stats["breaker_state"] = states.pop() if len(states) == 1 else "degraded"
+        stats["failovers"] = self._failovers
+        stats["routes"] = [route.stats() for route in self.routes]
+        return stats
+
+
+def build_routes(providers: str = LLM_PROVIDERS) -> List[Route]:
+    """One route per configured provider and API key, in the order the providers are listed"""
+    routes = []
+    for provider in providers.split(","):
+        provider = provider.strip().lower()
+        if not provider:
+            continue
+        if provider not in PROVIDERS:
+            raise ValueError(f"Unknown LLM provider: {provider} (expected one of {', '.join(PROVIDERS)})")
+        client_class, key_variable = PROVIDERS[provider]
+        for index, key in enumerate(api_keys(key_variable), 1):
+            routes.append(Route(f"{provider}#{index}", client_class(key)))
+    return routes
@@ -0,0 +1,194 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Deque, Dict, Optional
+
+# ------------------------
+# Scheduler settings
+# ------------------------
+
+LLM_MAX_CONCURRENT = int(os.getenv("LLM_MAX_CONCURRENT", "32"))  # Upstream calls in flight, all providers
+LLM_INTERACTIVE_RESERVE = int(os.getenv("LLM_INTERACTIVE_RESERVE", "8"))  # Slots only /start and /choice may use
+LLM_QUEUE_LIMITS = os.getenv("LLM_QUEUE_LIMITS", "interactive=256,summary=128,background=64")  # Waiting calls
+LLM_QUEUE_MAX_WAIT = float(os.getenv("LLM_QUEUE_MAX_WAIT", "20"))  # Seconds a call may wait for a slot
+
+# Priority classes, highest first
+INTERACTIVE = "interactive"
+SUMMARY = "summary"
+BACKGROUND = "background"
+PRIORITIES = (INTERACTIVE, SUMMARY, BACKGROUND)
+
+# Call site (as passed to generate_ai_response) -> priority class
+CALL_PRIORITIES = {
+    "start": INTERACTIVE,
+    "choice": INTERACTIVE,
+    "stream": INTERACTIVE,
+    "summarize": SUMMARY,
+    "moral_choice": SUMMARY,
+    "conclude": SUMMARY,
+    "prefetch": BACKGROUND,
+    "opening": BACKGROUND,
+    "compaction": BACKGROUND,
+}
+
+
+def parse_limits(spec: str) -> Dict[str, int]:
+    """Parse "interactive=256,summary=128" into {name: limit}"""
+    limits = {}
+    for item in spec.split(","):
+        if "=" in item:
+            name, limit = item.split("=", 1)
+            limits[name.strip()] = int(limit)
+    return limits
+
+
+def call_priority(call: str) -> str:
+    """Priority class of a call site; a re-ask has the priority of the call it corrects"""
+    return CALL_PRIORITIES.get(call.removesuffix("_reask"), SUMMARY)
+
+
+class Overloaded(Exception):
+    """A call was turned away: its priority's queue was full, or it waited too long for a slot"""
+
+    def __init__(self, priority: str, reason: str):
+        super().__init__(f"LLM scheduler overloaded ({priority} {reason})")
+        self.priority = priority
+        self.reason = reason
+
+
+class LLMScheduler:
+    """Admission control for upstream LLM calls.
+
+    At most `max_concurrent` calls are in flight, and calls other than
+    interactive ones may not take the last `interactive_reserve` slots, so a
+    burst of summaries or prefetches never makes a player wait. A call that
+    finds no slot waits in the queue of its priority class; when a slot
+    frees up the highest class goes first, and within a class the sessions
+    take turns, so one game's prefetches cannot starve the others. A full
+    queue rejects new calls at once, and calls that wait longer than
+    `max_wait` give up, both with Overloaded.
+
+    `capacity` is an optional further check, e.g. per-provider caps; it is
+    passed the number of calls admitted but not started yet.
+    """
+
+    def __init__(self, max_concurrent: int = LLM_MAX_CONCURRENT, interactive_reserve: int = LLM_INTERACTIVE_RESERVE,
+                 queue_limits: Optional[Dict[str, int]] = None, max_wait: float = LLM_QUEUE_MAX_WAIT,
+                 capacity: Optional[Callable[[int], bool]] = None,
+                 on_admit: Optional[Callable[[str, float], None]] = None):
+        self.max_concurrent = max(1, max_concurrent)
+        self.interactive_reserve = min(max(0, interactive_reserve), self.max_concurrent - 1)
+        self.queue_limits = parse_limits(LLM_QUEUE_LIMITS) if queue_limits is None else queue_limits
+        self.max_wait = max_wait
+        self.capacity = capacity
+        self.on_admit = on_admit  # Called with (priority, seconds waited) for every admitted call
+        self.in_flight = 0
+        self._starting = 0  # Admitted from the queue, not yet resumed
+        self._queues: Dict[str, "OrderedDict[Optional[str], Deque[asyncio.Future]]"] = {
+            priority: OrderedDict() for priority in PRIORITIES}
+        self._depth = dict.fromkeys(PRIORITIES, 0)
+        self._stats = {priority: {"admitted": 0, "queued": 0, "rejected_full": 0, "rejected_wait": 0,
+                                  "wait_seconds": 0.0} for priority in PRIORITIES}
+
+    def _has_room(self, priority: str) -> bool:
+        limit = self.max_concurrent if priority == INTERACTIVE else self.max_concurrent - self.interactive_reserve
+        return self.in_flight < limit and (self.capacity is None or self.capacity(self._starting))
+
+    def admits(self, priority: str) -> bool:
+        """Whether a call of this priority would be queued rather than rejected right now"""
+        return self._depth[priority] < self.queue_limits.get(priority, self._depth[priority] + 1)
+
+    def _admit(self, priority: str, waited: float) -> None:
+        stats = self._stats[priority]
+        stats["admitted"] += 1
+        stats["wait_seconds"] += waited
+        if self.on_admit is not None:
+            self.on_admit(priority, waited)
+
+    async def acquire(self, priority: str, session_id: Optional[str] = None) -> None:
+        """Wait for a slot (call release() when done), or raise Overloaded"""
+        ahead = PRIORITIES[:PRIORITIES.index(priority) + 1]
+        if not any(self._depth[queued] for queued in ahead) and self._has_room(priority):
+            self.in_flight += 1
+            self._admit(priority, 0.0)
+            return
+        if not self.admits(priority):
+            self._stats[priority]["rejected_full"] += 1
+            raise Overloaded(priority, "queue full")
+
+        future = asyncio.get_running_loop().create_future()
+        self._queues[priority].setdefault(session_id, deque()).append(future)
+        self._depth[priority] += 1
+        self._stats[priority]["queued"] += 1
+        start = time.monotonic()
+        self._dispatch()
+        try:
+            await asyncio.wait_for(future, self.max_wait)
+        except asyncio.TimeoutError:
+            if not future.done() or future.cancelled():
+                self._remove(priority, session_id, future)
+                self._stats[priority]["rejected_wait"] += 1
+                raise Overloaded(priority, "wait timeout")
+            # Granted just as the wait ran out: use the slot
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted just as the caller gave up
+                self._starting -= 1
+                self.release()
+            else:
+                self._remove(priority, session_id, future)
+            raise
+        self._starting -= 1
+        self._admit(priority, time.monotonic() - start)
+
+    def _remove(self, priority: str, session_id: Optional[str], future: asyncio.Future) -> None:
+        waiters = self._queues[priority].get(session_id)
+        if waiters is not None and future in waiters:
+            waiters.remove(future)
+            self._depth[priority] -= 1
+            if not waiters:
+                del self._queues[priority][session_id]
+
+    def _next(self) -> Optional[asyncio.Future]:
+        """The next waiter to admit: highest class with room first, sessions round-robin"""
+        for priority in PRIORITIES:
+            sessions = self._queues[priority]
+            if not sessions or not self._has_room(priority):
+                continue
+            session_id, waiters = next(iter(sessions.items()))
+            future = waiters.popleft()
+            self._depth[priority] -= 1
+            if waiters:
+                sessions.move_to_end(session_id)
+            else:
+                del sessions[session_id]
+            return future
+        return None
+
+    def release(self) -> None:
+        """Free a slot and admit whoever is next"""
+        self.in_flight -= 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        while True:
+            future = self._next()
+            if future is None:
+                return
+            if future.done():
+                continue  # Gave up while queued
+            self.in_flight += 1
+            self._starting += 1
+            future.set_result(None)
+
+    def stats(self) -> Dict:
+        """Calls admitted, queued and rejected per priority, with queue depths and mean waits"""
+        classes = {}
+        for priority, counters in self._stats.items():
+            stats = dict(counters)
+            stats["depth"] = self._depth[priority]
+            stats["mean_wait_seconds"] = stats["wait_seconds"] / stats["admitted"] if stats["admitted"] else 0.0
+            classes[priority] = stats
+        return {"in_flight": self.in_flight, "max_concurrent": self.max_concurrent,
+                "interactive_reserve": self.interactive_reserve, "classes": classes}
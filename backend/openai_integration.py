@@ -1,56 +1,77 @@
+import asyncio
 import os
-import openai
+from typing import Dict, Optional
+
 from dotenv import load_dotenv
 
+from deepseek_async_integration import DeepSeekClient
+
 # Load environment variables from the .env file
 load_dotenv()
 
-# Set your OpenAI API key from the environment variable
-openai.api_key = os.getenv("OPENAI_API_KEY")
+# ------------------------
+# OpenAI-compatible provider settings
+# ------------------------
+
+OPENAI_API_URL = os.getenv("OPENAI_API_URL", "https://api.openai.com/v1/chat/completions")
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+
 
-def get_gpt35_response(prompt, model="gpt-3.5-turbo"):
+class OpenAIClient(DeepSeekClient):
+    """Async client for OpenAI or any other OpenAI-compatible chat completions API.
+
+    It shares DeepSeekClient's connection pool, deadlines, retries and
+    circuit breaker; only the defaults and the usage format differ.
     """
-    Sends a prompt to OpenAI's GPT-3.5-turbo model and returns the response.
-    
+
+    provider = "openai"
+
+    def __init__(self, api_key: str, url: str = OPENAI_API_URL, model: str = OPENAI_MODEL, **kwargs):
+        super().__init__(api_key, url, model, **kwargs)
+
+    def _normalize_usage(self, usage: Dict) -> Dict:
+        # OpenAI reports cached prompt tokens under prompt_tokens_details.cached_tokens
+        details = usage.get("prompt_tokens_details") or {}
+        if "cached_tokens" in details and "prompt_cache_hit_tokens" not in usage:
+            usage = dict(usage)
+            usage["prompt_cache_hit_tokens"] = details["cached_tokens"]
+            usage["prompt_cache_miss_tokens"] = usage.get("prompt_tokens", 0) - details["cached_tokens"]
+        return usage
+
+
+async def get_gpt35_response(prompt: str, model: str = "gpt-3.5-turbo") -> Optional[str]:
+    """
+    Sends a prompt to an OpenAI chat model and returns the response.
+
+    Opens a client for this one call; the game itself goes through the
+    shared, pooled clients of the LLM router instead.
+
     Args:
-        prompt (str): The text prompt to send to GPT-3.5-turbo.
+        prompt (str): The text prompt to send to the model.
         model (str): The model to use (default is 'gpt-3.5-turbo').
 
     Returns:
-        str: The response text from the model.
+        str: The response text from the model, or None on failure.
     """
+    client = OpenAIClient(os.getenv("OPENAI_API_KEY", ""), model=model)
+    await client.start()
     try:
-        print(f"Sending request to OpenAI with prompt: {prompt}")
-        
-        # Create a completion request with the OpenAI GPT-3.5 Turbo model
-        response = openai.ChatCompletion.create(
-            model=model,  # Model to be used (default: gpt-3.5-turbo)
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=300,  # Max token count for the response
-            temperature=0.7  # Adjust to control creativity level
-        )
-        
-        # Extract the generated text
-        return response['choices'][0]['message']['content'].strip()
-
-    except openai.error.InvalidRequestError as e:
-        print(f"InvalidRequestError: {e}")
-        return "An error occurred while processing your request."
-    except Exception as e:
-        print(f"Unexpected error: {e}")
-        return "An unexpected error occurred."
+        response = await client.chat([
+            {"role": "system", "content": "You are a helpful assistant."},
+            {"role": "user", "content": prompt}
+        ], max_tokens=300)
+        return response.strip() if response else None
+    finally:
+        await client.close()
 
 
 if __name__ == "__main__":
     # Integration test: Sample prompt to ensure the API is working
     test_prompt = "Describe a mysterious forest with two paths."
-    
+
     # Get response from the model
-    response = get_gpt35_response(test_prompt)
-    
+    response = asyncio.run(get_gpt35_response(test_prompt))
+
     if response:
         print(f"Response: {response}")
     else:
@@ -0,0 +1,267 @@
+"""Bulk playthroughs: simulated games played straight through app_async, without the HTTP routes.
+
+Each playthrough starts a game with create_new_game() and makes --turns
+choices with process_player_choice(), picking them with a choice policy.
+Every finished playthrough is appended to the output file as one JSON line
+(its turns with passage, latency, tokens and validation outcome), so an
+interrupted run resumes where it stopped when started again with the same
+output. The report lists latency, token usage, prompt size and
+parse-failure rates per depth (chapter 1 is the opening).
+
+Uses:
+- Seed the story-tree cache before a launch: run with --branch-cache, then
+  start the server with BRANCH_CACHE_ENABLED=true and BRANCH_CACHE_SEED set
+  to the output file.
+- Regression-test a prompt change: compare the reports of two runs for
+  re-ask/failure rates and prompt growth per depth.
+
+Usage:
+    python backend/playthroughs.py --playthroughs 2000 --turns 8 --concurrency 32 --output runs/seed.jsonl
+    python backend/playthroughs.py --mock --playthroughs 200 --malformed-rate 0.2   # offline, against the mock
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks"))
+
+import json_codec  # noqa: E402
+from llm_scheduler import Overloaded  # noqa: E402
+from mock_deepseek import add_mock_arguments, mock_url, settings_from_args, start_mock  # noqa: E402
+from prompts import new_game_messages  # noqa: E402
+from response_cache import cache_key  # noqa: E402
+
+OVERLOAD_BACKOFF = 2.0  # Seconds to wait when the scheduler turns a turn away, as a client would on 503
+OVERLOAD_RETRIES = 5  # Times a turn is retried before its playthrough is given up on (and left for a resumed run)
+
+# Choice policies: (rng, choices offered, most virtuous first) -> choice number
+POLICIES: Dict[str, Callable[[random.Random, List[str]], int]] = {
+    "random": lambda rng, choices: rng.randint(1, len(choices)),
+    "good": lambda rng, choices: 1,
+    "evil": lambda rng, choices: len(choices),
+}
+
+STORY_CALLS = ("start", "choice", "start_reask", "choice_reask")  # Calls made for the passage itself
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class DepthStats:
+    """Latency, tokens, prompt size and validation outcomes of the turns at each depth"""
+
+    COUNTERS = ("turns", "live", "llm_calls", "prompt_tokens", "completion_tokens", "prompt_chars",
+                "valid", "repaired", "reasked", "failed", "degraded")
+
+    def __init__(self):
+        self._depths: Dict[int, Dict] = {}
+
+    def add(self, record: Dict) -> None:
+        for turn in record["turns"]:
+            stats = self._depths.setdefault(turn["depth"], dict.fromkeys(self.COUNTERS, 0))
+            stats.setdefault("seconds", []).append(turn["seconds"])
+            stats["turns"] += 1
+            stats["live"] += 1 if turn["llm_calls"] else 0
+            for counter in ("llm_calls", "prompt_tokens", "completion_tokens", "prompt_chars"):
+                stats[counter] += turn[counter]
+            if turn["validation"] in stats:
+                stats[turn["validation"]] += 1
+            stats["degraded"] += 1 if turn["degraded"] else 0
+
+    def report(self) -> str:
+        lines = [f"{'depth':>5}{'turns':>7}{'live':>6}{'p50 ms':>8}{'p95 ms':>8}{'prompt tok':>11}"
+                 f"{'compl tok':>10}{'prompt ch':>10}{'repaired':>9}{'reasked':>8}{'failed':>7}{'degraded':>9}"]
+        for depth, stats in sorted(self._depths.items()):
+            turns, live = stats["turns"], stats["live"] or 1
+            lines.append(
+                f"{depth:>5}{turns:>7}{stats['live']:>6}"
+                f"{percentile(stats['seconds'], 0.5) * 1000:>8.0f}{percentile(stats['seconds'], 0.95) * 1000:>8.0f}"
+                f"{stats['prompt_tokens'] / live:>11.0f}{stats['completion_tokens'] / live:>10.0f}"
+                f"{stats['prompt_chars'] / turns:>10.0f}{stats['repaired'] / turns:>9.1%}"
+                f"{stats['reasked'] / turns:>8.1%}{stats['failed'] / turns:>7.1%}{stats['degraded'] / turns:>9.1%}")
+        return "\n".join(lines)
+
+
+def completed(path: str, stats: DepthStats) -> Set[int]:
+    """Indices of the playthroughs already in an output file, which are added to the stats.
+
+    A last line cut off by an interrupted run is removed, so new lines are
+    appended after complete ones.
+    """
+    done: Set[int] = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "r+b") as f:
+        end = 0
+        for line in f:
+            try:
+                record = json_codec.loads(line) if line.endswith(b"\n") else None
+            except json_codec.JSONDecodeError:
+                record = None
+            if record is None:
+                break
+            end += len(line)
+            done.add(record["index"])
+            stats.add(record)
+        f.truncate(end)
+    return done
+
+
+async def play_turn(app_async, work: Callable[[], Awaitable[Dict]], messages: List[Dict[str, str]], depth: int,
+                    choice: Optional[int]) -> Tuple[Dict, Dict]:
+    """Play one turn, returning its result and its record"""
+    report: Dict = {}
+    token = app_async.turn_report.set(report)
+    start = time.perf_counter()
+    try:
+        for attempt in range(OVERLOAD_RETRIES + 1):
+            try:
+                result = await work()
+                break
+            except Overloaded:
+                if attempt < OVERLOAD_RETRIES:
+                    await asyncio.sleep(OVERLOAD_BACKOFF)
+        else:
+            result = {"error": "The LLM scheduler kept turning the turn away"}
+    finally:
+        app_async.turn_report.reset(token)
+    calls = [stats for call, stats in report.get("calls", {}).items() if call in STORY_CALLS]
+    validation = report.get("validation", {}).get("start" if choice is None else "choice", {})
+    turn = {
+        "depth": depth,
+        "choice": choice,
+        "seconds": round(time.perf_counter() - start, 4),
+        "llm_calls": sum(stats["calls"] for stats in calls),
+        "prompt_tokens": sum(stats["prompt_tokens"] for stats in calls),
+        "completion_tokens": sum(stats["completion_tokens"] for stats in calls),
+        "prompt_chars": sum(len(message["content"]) for message in messages),
+        "validation": validation.get("outcome"),  # None when there was no response to validate
+        "repairs": validation.get("repairs", []),
+        "outcome": report.get("outcome", "error"),
+        "degraded": bool(result.get("degraded")),
+        "branch_key": cache_key(messages, app_async.branch_cache.params),
+    }
+    return result, turn
+
+
+async def play(app_async, index: int, policy: str, turns: int, seed: int) -> Dict:
+    """One playthrough from the opening through `turns` choices"""
+    rng = random.Random(f"{seed}:{index}")
+    record = {"index": index, "policy": policy, "turns": []}
+    start = time.perf_counter()
+
+    depth = 1
+    result, turn = await play_turn(app_async, app_async.create_new_game, new_game_messages(), depth, None)
+    session_id = result.get("session_id")
+    while True:
+        session = app_async.sessions.get(session_id) if session_id else None
+        if "error" in result or session is None:
+            record["error"] = result.get("error", "No session was created")
+            break
+        turn.update(story=result["story"], choices=result["choices"], response=session.context.last_turn.response)
+        record["turns"].append(turn)
+        if depth > turns:
+            break
+        choice = POLICIES[policy](rng, result["choices"])
+        prepared = app_async.prepare_player_choice(session_id, choice)
+        if "error" in prepared:
+            record["error"] = prepared["error"]
+            break
+        depth += 1
+        result, turn = await play_turn(app_async, lambda: app_async.process_player_choice(session_id, choice),
+                                       prepared["messages"], depth, choice)
+
+    record["moral_alignment"] = result.get("moral_alignment", "neutral")
+    if session_id:
+        await app_async.sessions.load(session_id)
+        app_async.sessions.pop(session_id)
+    record["seconds"] = round(time.perf_counter() - start, 4)
+    return record
+
+
+async def run(args: argparse.Namespace) -> None:
+    # Settings read when app_async is imported: no speculative calls and (unless asked for) no
+    # shared passages or pre-generated openings, so every turn is generated as it is played
+    os.environ.setdefault("PREFETCH_ENABLED", "false")
+    os.environ.setdefault("OPENING_POOL_SIZE", "0")
+    os.environ.setdefault("TURN_DEADLINE", str(args.turn_deadline))
+    os.environ.setdefault("LOG_LEVEL", "WARNING")  # Keep app logs out of the report
+    if args.branch_cache:
+        os.environ["BRANCH_CACHE_ENABLED"] = "true"
+        if os.path.exists(args.output):
+            os.environ.setdefault("BRANCH_CACHE_SEED", args.output)  # Resume with the passages already played
+
+    mock_runner = None
+    if args.mock:
+        mock_runner = await start_mock(settings_from_args(args))
+        os.environ["DEEPSEEK_API_URL"] = mock_url(mock_runner)
+        os.environ.setdefault("DEEPSEEK_API_KEY", "playthroughs")
+    import app_async
+
+    stats = DepthStats()
+    done = completed(args.output, stats)
+    policies = [policy.strip() for policy in args.policy.split(",")]
+    pending = (index for index in range(args.playthroughs) if index not in done)
+    finished = errors = 0
+    start = time.perf_counter()
+
+    with open(args.output, "ab") as output:
+        async def worker() -> None:
+            nonlocal finished, errors
+            for index in pending:
+                try:
+                    record = await play(app_async, index, policies[index % len(policies)], args.turns, args.seed)
+                except Exception as e:
+                    record = {"error": str(e)}
+                if "error" in record:
+                    print(f"Playthrough {index} failed: {record['error']}", file=sys.stderr)
+                    errors += 1
+                    continue  # Not written, so a resumed run plays it again
+                output.write(json_codec.dumps(record) + b"\n")
+                output.flush()
+                stats.add(record)
+                finished += 1
+                if finished % args.progress_every == 0:
+                    print(f"{finished} playthroughs in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+        async with app_async.app.test_app():
+            await asyncio.gather(*(worker() for _ in range(max(1, args.concurrency))))
+
+    if mock_runner is not None:
+        await mock_runner.cleanup()
+
+    elapsed = time.perf_counter() - start
+    print(f"\n{finished} playthroughs in {elapsed:.1f}s ({len(done)} already in {args.output}, {errors} failed)\n")
+    print(stats.report())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", default="playthroughs.jsonl", help="JSONL file to append to (and resume from)")
+    parser.add_argument("--playthroughs", type=int, default=100)
+    parser.add_argument("--turns", type=int, default=8, help="Choices per playthrough, after the opening")
+    parser.add_argument("--concurrency", type=int, default=16, help="Playthroughs in progress at once")
+    parser.add_argument("--policy", default="random",
+                        help=f"Choice policy, or a comma-separated list to alternate ({', '.join(POLICIES)})")
+    parser.add_argument("--branch-cache", action="store_true",
+                        help="Share passages between playthroughs on the same path, as the server would")
+    parser.add_argument("--turn-deadline", type=float, default=0,
+                        help="Seconds before a turn is told locally (0 = wait for the AI)")
+    parser.add_argument("--progress-every", type=int, default=100)
+    parser.add_argument("--mock", action="store_true", help="Play against a local mock instead of the real API")
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+    unknown = [policy for policy in args.policy.split(",") if policy.strip() not in POLICIES]
+    if unknown:
+        parser.error(f"unknown policy {', '.join(unknown)} (choose from {', '.join(POLICIES)})")
+    if args.seed is None:
+        args.seed = 1
+    asyncio.run(run(args))
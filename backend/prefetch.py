@@ -0,0 +1,148 @@
+import asyncio
+import os
+from typing import Awaitable, Callable, Dict, List, Optional
+
+# ------------------------
+# Prefetch settings
+# ------------------------
+
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "true").lower() == "true"
+PREFETCH_MAX_CONCURRENT = int(os.getenv("PREFETCH_MAX_CONCURRENT", "16"))  # Speculative calls in flight, all sessions
+PREFETCH_SESSION_BUDGET = int(os.getenv("PREFETCH_SESSION_BUDGET", "40"))  # Speculative calls per session
+
+
+class Branch:
+    """One speculative continuation: the prompt it was generated for and its task"""
+
+    __slots__ = ("messages", "task", "started")
+
+    def __init__(self, messages: List[Dict[str, str]]):
+        self.messages = messages
+        self.task: Optional[asyncio.Task] = None
+        self.started = False  # False while still queued behind the concurrency cap
+
+
+class BranchPrefetcher:
+    """Generates the continuation of every choice while the player is still reading.
+
+    After each turn, schedule() starts one background task per choice. When
+    the player picks an option, claim() hands over that branch's task (ready
+    or still in flight) and cancels the others. A branch is only served if it
+    was generated from exactly the prompt the live turn would send.
+    """
+
+    def __init__(self, generate: Callable[[List[Dict[str, str]], str], Awaitable[Optional[str]]],
+                 enabled: bool = PREFETCH_ENABLED, max_concurrent: int = PREFETCH_MAX_CONCURRENT,
+                 session_budget: int = PREFETCH_SESSION_BUDGET):
+        self.generate = generate  # Called with (messages, session_id)
+        self.enabled = enabled
+        self.session_budget = session_budget
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._branches: Dict[str, Dict[int, Branch]] = {}  # session_id -> choice -> branch
+        self._session_stats: Dict[str, Dict[str, int]] = {}
+        self._totals = {"scheduled": 0, "hits": 0, "misses": 0, "cancelled": 0}
+
+    def _stats_for(self, session_id: str) -> Dict[str, int]:
+        if session_id not in self._session_stats:
+            self._session_stats[session_id] = {"budget_left": self.session_budget,
+                                               "scheduled": 0, "hits": 0, "misses": 0}
+        return self._session_stats[session_id]
+
+    def schedule(self, session_id: str, branches: Dict[int, List[Dict[str, str]]]) -> None:
+        """Start generating the continuation for each choice (choice number -> messages)"""
+        self._cancel(session_id)
+        if not self.enabled:
+            return
+
+        stats = self._stats_for(session_id)
+        pending = {}
+        for choice, messages in branches.items():
+            if stats["budget_left"] <= 0:
+                break
+            stats["budget_left"] -= 1
+            stats["scheduled"] += 1
+            self._totals["scheduled"] += 1
+
+            branch = Branch(messages)
+            branch.task = asyncio.create_task(self._run(session_id, branch))
+            pending[choice] = branch
+
+        if pending:
+            self._branches[session_id] = pending
+
+    async def _run(self, session_id: str, branch: Branch) -> Optional[str]:
+        async with self._semaphore:
+            branch.started = True
+            return await self.generate(branch.messages, session_id)
+
+    def claim(self, session_id: str, choice: int,
+              messages: List[Dict[str, str]]) -> Optional[asyncio.Task]:
+        """Take the task for the chosen branch and cancel the rest.
+
+        Returns None (a miss) if the branch was never scheduled, was built from
+        a different prompt, or is still waiting for a free slot - in that case
+        the caller should generate the turn live.
+        """
+        branches = self._branches.pop(session_id, {})
+        branch = branches.pop(choice, None)
+        for other in branches.values():
+            self._discard(other)
+
+        stats = self._stats_for(session_id)
+        if branch is None or not branch.started or branch.messages != messages:
+            if branch is not None:
+                self._discard(branch)
+            if self.enabled:
+                stats["misses"] += 1
+                self._totals["misses"] += 1
+            return None
+
+        stats["hits"] += 1
+        self._totals["hits"] += 1
+        return branch.task
+
+    async def take(self, session_id: str, choice: int,
+                   messages: List[Dict[str, str]]) -> Optional[str]:
+        """Return the prefetched response for a choice, waiting for it if still in flight"""
+        task = self.claim(session_id, choice, messages)
+        if task is None:
+            return None
+        return await self.wait(task)
+
+    @staticmethod
+    async def wait(task: asyncio.Task) -> Optional[str]:
+        """Wait for a claimed branch, treating a cancelled branch as a failed one"""
+        try:
+            return await task
+        except asyncio.CancelledError:
+            # The branch was cancelled, unless it is the waiter (e.g. past a deadline) that was
+            if task.cancelled() and not asyncio.current_task().cancelling():
+                return None
+            raise
+
+    def _discard(self, branch: Branch) -> None:
+        if branch.task is not None and not branch.task.done():
+            branch.task.cancel()
+            self._totals["cancelled"] += 1
+
+    def _cancel(self, session_id: str) -> None:
+        for branch in self._branches.pop(session_id, {}).values():
+            self._discard(branch)
+
+    def discard(self, session_id: str) -> None:
+        """Drop every branch and counter for a session that has ended"""
+        self._cancel(session_id)
+        self._session_stats.pop(session_id, None)
+
+    def stats(self, session_id: Optional[str] = None) -> Dict:
+        """Report prefetch counters, for one session or across all sessions"""
+        if session_id is not None:
+            stats = dict(self._session_stats.get(session_id) or
+                         {"budget_left": self.session_budget, "scheduled": 0, "hits": 0, "misses": 0})
+        else:
+            stats = dict(self._totals)
+            stats["in_flight"] = sum(1 for branches in self._branches.values()
+                                     for branch in branches.values() if not branch.task.done())
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,197 @@
+import os
+import random
+import re
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+# ------------------------
+# Degradation settings
+# ------------------------
+
+TURN_DEADLINE = float(os.getenv("TURN_DEADLINE", "8"))  # Seconds a turn waits for the AI before it is told locally
+PROCEDURAL_CORPUS_SIZE = int(os.getenv("PROCEDURAL_CORPUS_SIZE", "500"))  # Recent passages the Markov model learns from
+PROCEDURAL_MARKOV_ORDER = int(os.getenv("PROCEDURAL_MARKOV_ORDER", "2"))  # Words of context per step
+PROCEDURAL_MIN_SENTENCES = int(os.getenv("PROCEDURAL_MIN_SENTENCES", "50"))  # Learned before the model replaces templates
+
+_SENTENCE = re.compile(r"[^.!?]+[.!?]+[\"'”]?")
+_END = None  # Follows the last word of a sentence in the chain
+
+# ------------------------
+# Templates
+# ------------------------
+
+PLACES = ["the old mill", "a ruined chapel", "the river ford", "a crowded market square", "the edge of the forest",
+          "a burned-out farmstead", "the mountain pass", "a quiet harbour", "the crossroads shrine", "a border fort"]
+TIMES = ["the evening mist", "the falling rain", "the last light of day", "the smoke of a distant fire",
+         "the first frost of winter", "a gathering storm"]
+FIGURES = ["wounded soldier", "frightened child", "old beggar", "travelling merchant", "masked stranger",
+           "weary healer", "runaway servant", "village elder", "young thief", "exiled knight"]
+OBJECTS = ["sealed letter", "purse of silver", "bundle of medicine", "stolen relic", "map marked in red",
+           "ring of iron keys", "sack of grain", "jewelled dagger"]
+
+OPENINGS = [
+    "You arrive at {place} as {time} settles over the land.",
+    "Your journey brings you to {place}, where {time} hides the road behind you.",
+    "You wake at {place} with {time} all around and no memory of how you got there.",
+]
+# What the player's choice led to, from most virtuous to most selfish/evil
+CONSEQUENCES = [
+    ["You chose to {action}, and a quiet warmth settles over you.",
+     "You chose to {action}; it costs you, but it feels right."],
+    ["You chose to {action}, and things turn out mostly for the better.",
+     "You chose to {action}, and most of those around you are grateful."],
+    ["You chose to {action}, and you come away with more than you had, though not everyone does.",
+     "You chose to {action}, and a few people watch you leave with narrowed eyes."],
+    ["You chose to {action}, and the power of it leaves a bitter taste.",
+     "You chose to {action}, and whispers of what you did follow you down the road."],
+]
+SCENES = [
+    "At {place}, the air is heavy with rumours of trouble on the road ahead.",
+    "Few people linger at {place}, and those who do keep their eyes down.",
+    "Somewhere beyond {place}, a bell rings out and falls silent.",
+    "The path leads on to {place}, where the locals speak of a debt that was never paid.",
+]
+HOOKS = [
+    "Out of {time}, {a_figure} approaches you, clutching {a_object}.",
+    "There you meet {a_figure}, who is guarding {a_object} and begs for your help.",
+    "Before you can rest, {a_figure} stumbles toward you with {a_object} and a desperate look.",
+]
+CHOICES = [
+    ["Help the {figure} and ask for nothing in return", "Protect the {figure}, even at a cost to yourself",
+     "Share your own supplies with the {figure}"],
+    ["Help the {figure}, but keep a careful eye on the {object}", "Agree to help the {figure} for a fair share",
+     "Send the {figure} to someone better able to help"],
+    ["Demand payment before you lift a finger", "Keep your distance and look after yourself",
+     "Bargain for the {object} while the {figure} is desperate"],
+    ["Take the {object} from the {figure} by force", "Lie to the {figure} and slip away with the {object}",
+     "Sell the {figure} out to whoever is hunting them"],
+]
+
+
+def with_article(noun: str) -> str:
+    return f"{'an' if noun[0] in 'aeiou' else 'a'} {noun}"
+
+
+def action_phrase(option: str) -> str:
+    """A chosen option as it reads after "You chose to", e.g. "help the stranger" for "Help the stranger." """
+    option = option.strip().rstrip(".!?")
+    return option[:1].lower() + option[1:]
+
+
+def sentences(text: str) -> List[str]:
+    return [sentence.strip() for sentence in _SENTENCE.findall(text) if sentence.strip()]
+
+
+class ProceduralStoryteller:
+    """Tells a turn without the AI, on the CPU, when the AI is slow or failing.
+
+    A passage is three sentences: what the player's choice led to (or, for
+    an opening, where the story begins), a scene sentence and a hook that
+    brings in a figure and an object, followed by four choices about them
+    from most virtuous to most evil, so it has the shape of an AI passage.
+    The scene sentence comes from a word-level Markov model of the last
+    `corpus_size` passages the AI wrote (see learn()) once it knows
+    `min_sentences` sentences, else from a template; sentences the model
+    would copy verbatim are not used. A passage depends only on its seed,
+    so a repeated turn is told the same way.
+    """
+
+    def __init__(self, corpus_size: int = PROCEDURAL_CORPUS_SIZE, order: int = PROCEDURAL_MARKOV_ORDER,
+                 min_sentences: int = PROCEDURAL_MIN_SENTENCES):
+        self.order = max(1, order)
+        self.min_sentences = min_sentences
+        self._corpus: Deque[List[List[str]]] = deque(maxlen=max(1, corpus_size))
+        self._starts: Dict[Tuple[str, ...], int] = {}
+        self._chain: Dict[Tuple[str, ...], Dict[Optional[str], int]] = {}
+        self._known: Dict[str, int] = {}  # Learned sentences, so they are not repeated verbatim
+        self._stats = {"told": 0, "markov_sentences": 0, "template_sentences": 0, "seconds": 0.0}
+
+    def _update(self, passage: List[List[str]], delta: int) -> None:
+        for words in passage:
+            sentence = " ".join(words)
+            self._known[sentence] = self._known.get(sentence, 0) + delta
+            if not self._known[sentence]:
+                del self._known[sentence]
+            start = tuple(words[:self.order])
+            self._starts[start] = self._starts.get(start, 0) + delta
+            if not self._starts[start]:
+                del self._starts[start]
+            for i in range(len(words) - self.order + 1):
+                state = tuple(words[i:i + self.order])
+                following = words[i + self.order] if i + self.order < len(words) else _END
+                followers = self._chain.setdefault(state, {})
+                followers[following] = followers.get(following, 0) + delta
+                if not followers[following]:
+                    del followers[following]
+                    if not followers:
+                        del self._chain[state]
+
+    def learn(self, story: str) -> None:
+        """Add a passage the AI wrote to the model, forgetting the oldest beyond the corpus size"""
+        passage = [words for words in (sentence.split() for sentence in sentences(story))
+                   if len(words) > self.order + 2]
+        if not passage:
+            return
+        if len(self._corpus) == self._corpus.maxlen:
+            self._update(self._corpus[0], -1)
+        self._corpus.append(passage)
+        self._update(passage, 1)
+
+    def _markov_sentence(self, rng: random.Random) -> Optional[str]:
+        if len(self._known) < self.min_sentences:
+            return None
+        for _ in range(8):
+            state = rng.choices(list(self._starts), weights=list(self._starts.values()))[0]
+            words = list(state)
+            while len(words) < 40:
+                followers = self._chain.get(state)
+                if not followers:
+                    break
+                following = rng.choices(list(followers), weights=list(followers.values()))[0]
+                if following is _END:
+                    sentence = " ".join(words)
+                    if len(words) >= 6 and sentence not in self._known:
+                        return sentence
+                    break
+                words.append(following)
+                state = tuple(words[-self.order:])
+        return None
+
+    def tell(self, seed: Optional[str] = None, option: Optional[str] = None, choice: Optional[int] = None) -> Dict:
+        """A passage and four choices (most virtuous first), as {"story": ..., "choices": [...]}.
+
+        Pass the option the player chose and its number (1-4) for a turn,
+        neither for an opening.
+        """
+        start = time.perf_counter()
+        rng = random.Random(seed)
+        figure, item = rng.choice(FIGURES), rng.choice(OBJECTS)
+        slots = {"place": rng.choice(PLACES), "time": rng.choice(TIMES), "figure": figure, "object": item,
+                 "a_figure": with_article(figure), "a_object": with_article(item)}
+        if option:
+            level = min(max(choice or 1, 1), len(CONSEQUENCES)) - 1
+            first = rng.choice(CONSEQUENCES[level]).format(action=action_phrase(option))
+        else:
+            first = rng.choice(OPENINGS).format(**slots)
+        scene = self._markov_sentence(rng)
+        if scene is None:
+            scene = rng.choice(SCENES).format(**slots)
+            self._stats["template_sentences"] += 1
+        else:
+            self._stats["markov_sentences"] += 1
+        hook = rng.choice(HOOKS).format(**slots)
+        choices = [rng.choice(options).format(**slots) for options in CHOICES]
+        self._stats["told"] += 1
+        self._stats["seconds"] += time.perf_counter() - start
+        return {"story": " ".join((first, scene, hook)), "choices": choices}
+
+    def stats(self) -> Dict:
+        """Passages told (and how their scene sentence was made) and the size of the model"""
+        stats = dict(self._stats)
+        seconds = stats.pop("seconds")
+        stats["mean_seconds"] = seconds / stats["told"] if stats["told"] else 0.0
+        stats["corpus_passages"] = len(self._corpus)
+        stats["sentences"] = len(self._known)
+        stats["states"] = len(self._chain)
+        return stats
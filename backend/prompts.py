@@ -0,0 +1,200 @@
+from typing import Dict, List, Optional
+
+# ------------------------
+# Prompt construction
+# ------------------------
+#
+# DeepSeek caches prompt prefixes: tokens that repeat, byte for byte, from the
+# start of an earlier request are billed and served faster. Every builder here
+# therefore puts fixed instructions first and the varying content (player
+# choice, story text) at the very end, and nothing here embeds text that is
+# already elsewhere in the conversation.
+
+STORY_SYSTEM_PROMPT = """You are creating an interactive story game with moral choices.
+IMPORTANT: Always respond with valid JSON in EXACTLY this format, with no additional text before or after:
+{
+  "story": "The story text goes here",
+  "choices": ["Virtuous choice", "Good choice", "Selfish choice", "Evil choice"]
+}
+The choices should represent a moral spectrum from good to evil.
+Use escaped quotes (\") within the text if needed. Do not include backticks, code blocks, or any other formatting.
+Your responses should be creative and engaging."""
+
+OPENING_PROMPT = """Create the beginning of an interactive story with moral choices.
+The player is standing at a crossroads, both literal and metaphorical.
+Write exactly 3 sentences that describe what happens next.
+After the story, provide exactly 4 choices for the player, arranged from most virtuous/moral to most selfish/evil."""
+
+MORAL_DESCRIPTORS = ["virtuous", "good", "selfish", "dark"]
+
+
+def messages(system_prompt: str, user_prompt: str) -> List[Dict[str, str]]:
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+
+
+def new_game_messages() -> List[Dict[str, str]]:
+    """The fixed prompt that opens every new story (identical for every game)"""
+    return messages(STORY_SYSTEM_PROMPT, OPENING_PROMPT)
+
+
+def choice_prompt(chosen_option: str, choice: int) -> str:
+    """The user message of a turn: fixed instructions, then the player's choice.
+
+    Earlier chapters are already in the conversation (as a synopsis and
+    verbatim turns), so they are not repeated here.
+    """
+    descriptor = MORAL_DESCRIPTORS[min(choice - 1, 3)]
+    return f"""Continue the story based on the player's choice below. The consequences should subtly reflect the moral nature of their decision.
+Write exactly 3 sentences that describe what happens next.
+After the story, provide exactly 4 new choices for the player, arranged from most virtuous/moral to most selfish/evil.
+Remember to structure your response as valid JSON with "story" and "choices" fields.
+
+The player chose: "{chosen_option}" (a {descriptor} choice)"""
+
+
+def synopsis_message(synopsis: str) -> Dict[str, str]:
+    return {"role": "system", "content": f"Story so far (earlier chapters): {synopsis}"}
+
+
+def summary_messages(story: str, choice: str = "") -> List[Dict[str, str]]:
+    """Prompt for /summarize"""
+    system_prompt = """You are a storytelling assistant that creates concise narrative summaries.
+Always respond with a JSON object containing only a single 'summary' field with your summary text.
+Keep summaries poetic and under 100 characters while capturing both events and decisions."""
+
+    # Modify prompt based on whether choice is available
+    if choice:
+        user_prompt = f"""Summarize this story excerpt AND the player's choice as a single narrative.
+Create a cohesive dramatic summary that weaves together what happened and what choice was made.
+Be poetic but concise - like a line from a novel that captures both the event and decision.
+
+Story: {story}
+Player chose: {choice}"""
+    else:
+        user_prompt = f"""Summarize this story excerpt in one short sentence, capturing its essence.
+Be poetic but concise.
+
+{story}"""
+
+    return messages(system_prompt, user_prompt)
+
+
+def moral_choice_messages(story_context: str, current_situation: str = "") -> List[Dict[str, str]]:
+    """Prompt for /moral_choice"""
+    system_prompt = """You are a storytelling assistant that creates morally diverse choices.
+Always respond with a JSON object containing a 'choices' array with exactly 4 choices.
+Structure the choices in a spectrum from most virtuous/good (first) to most selfish/evil (last).
+Each choice should be morally distinct but realistic for the character and situation."""
+
+    user_prompt = f"""Given the story context and current situation below, generate 4 choices across a moral spectrum.
+
+Create 4 choices where:
+1. First choice is clearly good/virtuous/selfless
+2. Second choice is moderately good/positive
+3. Third choice is morally ambiguous/selfish
+4. Fourth choice is clearly evil/malicious/harmful
+
+Ensure all choices make sense in context and represent realistic options a character might consider.
+Avoid obvious tropes or cartoonish evil. Make choices subtle and interesting.
+
+Story so far: {story_context}
+Current situation: {current_situation}"""
+
+    return messages(system_prompt, user_prompt)
+
+
+def conclusion_messages(chapters, choices, moral_alignment: str) -> List[Dict[str, str]]:
+    """Prompt for /conclude"""
+    system_prompt = """You are a master storyteller creating epic conclusions to interactive adventures.
+Your task is to write a satisfying conclusion to a player's journey based on their choices and moral path.
+Always respond with a JSON object containing a 'conclusion' field with your finale text.
+The conclusion should be 3-5 sentences long, dramatic, and reflect the character's journey and moral choices."""
+
+    user_prompt = f"""Write a satisfying conclusion to the adventure below based on the player's journey.
+
+Create a conclusion that:
+1. Directly references at least one key choice the player made
+2. Reflects the player's moral alignment
+3. Provides narrative closure but hints at future possibilities
+4. Has an appropriate tone (triumphant for good characters, darker for evil ones)
+5. Is 3-5 sentences long and dramatically satisfying
+
+The conclusion should feel earned based on the player's choices and serve as a fitting end to their unique journey.
+
+Story chapters: {chapters}
+Player choices: {choices}
+Player's moral alignment: {moral_alignment}"""
+
+    return messages(system_prompt, user_prompt)
+
+
+def compaction_messages(synopsis: str, chapters: List[str], max_words: int) -> List[Dict[str, str]]:
+    """Prompt that folds older chapters into the running synopsis"""
+    system_prompt = f"""You are a storytelling assistant that maintains the running synopsis of an interactive story.
+Always respond with a JSON object containing only a single 'synopsis' field.
+Keep the synopsis under {max_words} words and in the past tense.
+Preserve every character, promise, possession and consequence that could matter later, and the player's moral choices."""
+
+    numbered = "\n".join(f"{i}. {chapter}" for i, chapter in enumerate(chapters, 1))
+    user_prompt = f"""Rewrite the synopsis so it covers the current synopsis and every new chapter below.
+
+Current synopsis: {synopsis or "(none yet)"}
+
+New chapters, in order:
+{numbered}"""
+
+    return messages(system_prompt, user_prompt)
+
+
+CORRECTION_SYSTEM_PROMPT = """You repair malformed JSON replies.
+Reply with only the corrected JSON object, keeping the original text wherever possible."""
+
+
+def correction_messages(example: str, problem: str, broken: str) -> List[Dict[str, str]]:
+    """Short re-ask for a reply that failed validation.
+
+    Only the broken reply is sent back, not the prompt that produced it, so
+    the correction costs a fraction of the original call.
+    """
+    user_prompt = f"""The reply below {problem}. Rewrite it as a JSON object in exactly this format:
+{example}
+
+Reply: {broken}"""
+
+    return messages(CORRECTION_SYSTEM_PROMPT, user_prompt)
+
+
+class PromptCacheTracker:
+    """Prompt-cache hit and miss tokens reported by the API, overall and per session"""
+
+    def __init__(self):
+        self._totals = {"calls": 0, "hit_tokens": 0, "miss_tokens": 0}
+        self._sessions: Dict[str, Dict[str, int]] = {}
+
+    def record(self, usage: Dict, session_id: Optional[str] = None) -> None:
+        """Add the prompt_cache_hit_tokens/prompt_cache_miss_tokens of one response"""
+        if "prompt_cache_hit_tokens" not in usage and "prompt_cache_miss_tokens" not in usage:
+            return
+        counters = [self._totals]
+        if session_id is not None:
+            counters.append(self._sessions.setdefault(session_id, {"calls": 0, "hit_tokens": 0, "miss_tokens": 0}))
+        for stats in counters:
+            stats["calls"] += 1
+            stats["hit_tokens"] += usage.get("prompt_cache_hit_tokens", 0)
+            stats["miss_tokens"] += usage.get("prompt_cache_miss_tokens", 0)
+
+    def discard(self, session_id: str) -> None:
+        self._sessions.pop(session_id, None)
+
+    def stats(self, session_id: Optional[str] = None) -> Dict:
+        """Report hit/miss tokens and the hit rate, for one session or overall"""
+        if session_id is not None:
+            stats = dict(self._sessions.get(session_id) or {"calls": 0, "hit_tokens": 0, "miss_tokens": 0})
+        else:
+            stats = dict(self._totals)
+        tokens = stats["hit_tokens"] + stats["miss_tokens"]
+        stats["hit_rate"] = stats["hit_tokens"] / tokens if tokens else 0.0
+        return stats
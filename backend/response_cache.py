@@ -0,0 +1,161 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import json_codec
+
+# ------------------------
+# Response cache settings
+# ------------------------
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "2048"))  # In-memory tier
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "86400"))               # Seconds
+RESPONSE_CACHE_DB = os.getenv("RESPONSE_CACHE_DB", "")  # SQLite file for the on-disk tier (empty = off)
+
+
+def cache_key(messages: List[Dict[str, str]], params: Dict) -> str:
+    """Hash the normalized messages and sampling parameters of a request"""
+    normalized = [
+        # Collapse whitespace so indentation changes in prompt templates share entries
+        {"role": message["role"], "content": " ".join(message["content"].split())}
+        for message in messages
+    ]
+    body = json_codec.dumps({"messages": normalized, "params": params}, sort_keys=True)
+    return hashlib.sha256(body).hexdigest()
+
+
+class DiskTier:
+    """SQLite-backed second cache tier; all calls run in a worker thread"""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(key TEXT PRIMARY KEY, response TEXT NOT NULL, created REAL NOT NULL)"
+            )
+            self._db.commit()
+
+    def _get(self, key: str, min_created: float) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT response FROM responses WHERE key = ? AND created >= ?", (key, min_created)
+            ).fetchone()
+        return row[0] if row else None
+
+    def _put(self, key: str, response: str) -> None:
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created) VALUES (?, ?, ?)",
+                (key, response, time.time())
+            )
+            self._db.commit()
+
+    async def get(self, key: str, ttl: float) -> Optional[str]:
+        return await asyncio.to_thread(self._get, key, time.time() - ttl)
+
+    async def put(self, key: str, response: str) -> None:
+        await asyncio.to_thread(self._put, key, response)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class ResponseCache:
+    """Content-addressed cache for stateless LLM calls, with single-flight deduplication.
+
+    Entries are keyed on a hash of the normalized messages and sampling
+    parameters and live in an in-memory LRU tier, optionally backed by an
+    SQLite tier that survives restarts. Concurrent identical requests share
+    one upstream call. Failed calls (None) and responses rejected by the
+    caller's cacheable() check are never stored.
+    """
+
+    def __init__(self, enabled: bool = RESPONSE_CACHE_ENABLED, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+                 ttl: float = RESPONSE_CACHE_TTL, db_path: str = RESPONSE_CACHE_DB):
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk = DiskTier(db_path) if enabled and db_path else None
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (created, response)
+        self._in_flight: Dict[str, asyncio.Task] = {}
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "coalesced": 0}
+
+    async def get_or_generate(self, messages: List[Dict[str, str]],
+                              generate: Callable[[List[Dict[str, str]]], Awaitable[Optional[str]]],
+                              params: Optional[Dict] = None,
+                              cacheable: Optional[Callable[[str], bool]] = None) -> Optional[str]:
+        """Return a cached response for these messages, or generate (once) and cache it"""
+        if not self.enabled:
+            return await generate(messages)
+
+        key = cache_key(messages, params or {})
+
+        entry = self._memory.get(key)
+        if entry is not None:
+            if time.time() - entry[0] <= self.ttl:
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return entry[1]
+            del self._memory[key]
+
+        task = self._in_flight.get(key)
+        if task is not None:
+            self._stats["coalesced"] += 1
+        else:
+            task = asyncio.create_task(self._fill(key, messages, generate, cacheable))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+
+        # Shield the shared call so one impatient caller cannot cancel it for everyone
+        return await asyncio.shield(task)
+
+    async def _fill(self, key: str, messages: List[Dict[str, str]],
+                    generate: Callable[[List[Dict[str, str]]], Awaitable[Optional[str]]],
+                    cacheable: Optional[Callable[[str], bool]]) -> Optional[str]:
+        if self.disk is not None:
+            response = await self.disk.get(key, self.ttl)
+            if response is not None:
+                self._stats["disk_hits"] += 1
+                self._remember(key, response)
+                return response
+
+        self._stats["misses"] += 1
+        response = await generate(messages)
+        if response is None or (cacheable is not None and not cacheable(response)):
+            return response
+
+        self._remember(key, response)
+        if self.disk is not None:
+            await self.disk.put(key, response)
+        return response
+
+    def _remember(self, key: str, response: str) -> None:
+        self._memory[key] = (time.time(), response)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def close(self) -> None:
+        """Close the on-disk tier"""
+        if self.disk is not None:
+            self.disk.close()
+            self.disk = None
+
+    def stats(self) -> Dict:
+        """Report hit/miss counters for both tiers"""
+        stats = dict(self._stats)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["entries"] = len(self._memory)
+        stats["in_flight"] = len(self._in_flight)
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,230 @@
+import logging
+import os
+from typing import Annotated, Awaitable, Callable, ClassVar, Dict, List, Optional, Tuple, Type
+
+from pydantic import BaseModel, Field, StringConstraints, ValidationError
+
+import json_codec
+from json_parsing import extract_json
+from prompts import correction_messages
+
+logger = logging.getLogger("game.json")
+
+# ------------------------
+# Response validation settings
+# ------------------------
+
+JSON_REASK_ATTEMPTS = int(os.getenv("JSON_REASK_ATTEMPTS", "1"))  # Correction calls per response (0 = never)
+JSON_REASK_MAX_TOKENS = int(os.getenv("JSON_REASK_MAX_TOKENS", "400"))
+JSON_REASK_DEADLINE = float(os.getenv("JSON_REASK_DEADLINE", "10"))  # Seconds per correction call
+
+Text = Annotated[str, StringConstraints(strip_whitespace=True, min_length=1)]
+
+# Stand-ins for missing options, from most virtuous to most selfish/evil
+FILLER_CHOICES = ["Do the selfless thing and help others", "Take a balanced approach that's mostly good",
+                  "Look out for your own interests first", "Take advantage of the situation for your gain"]
+
+
+# ------------------------
+# Schemas
+# ------------------------
+
+class StoryResponse(BaseModel):
+    """/start and /choice: a passage and four options, most virtuous first"""
+    example: ClassVar[str] = '{"story": "The story text", "choices": ["Virtuous", "Good", "Selfish", "Evil"]}'
+    story: Text
+    choices: List[Text] = Field(min_length=4, max_length=4)
+
+
+class ChoicesResponse(BaseModel):
+    """/moral_choice"""
+    example: ClassVar[str] = '{"choices": ["Virtuous", "Good", "Selfish", "Evil"]}'
+    choices: List[Text] = Field(min_length=4, max_length=4)
+
+
+class SummaryResponse(BaseModel):
+    """/summarize"""
+    example: ClassVar[str] = '{"summary": "One poetic sentence"}'
+    summary: Text
+
+
+class ConclusionResponse(BaseModel):
+    """/conclude"""
+    example: ClassVar[str] = '{"conclusion": "The 3-5 sentence finale"}'
+    conclusion: Text
+
+
+# ------------------------
+# Local repair
+# ------------------------
+
+def close_truncated(text: str) -> Optional[Dict]:
+    """Parse a JSON object cut off mid-way, by closing its open string, arrays and objects.
+
+    If that is not enough (e.g. it stops inside a key), everything after
+    the last complete member is dropped instead.
+    """
+    start = text.find("{")
+    if start == -1:
+        return None
+    closers: List[str] = []
+    in_string = escape = False
+    last_comma: Optional[Tuple[int, List[str]]] = None
+    for i in range(start, len(text)):
+        char = text[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            closers.append("}" if char == "{" else "]")
+        elif char in "}]":
+            if not closers or closers.pop() != char or not closers:
+                return None  # Mismatched, or complete: not a truncation
+        elif char == ",":
+            last_comma = (i, list(closers))
+
+    body = text[start:-1] if escape else text[start:]
+    candidates = [body.rstrip().rstrip(",:") + ('"' if in_string else "") + "".join(reversed(closers))]
+    if last_comma is not None:
+        candidates.append(text[start:last_comma[0]] + "".join(reversed(last_comma[1])))
+    for candidate in candidates:
+        try:
+            data = json_codec.loads(candidate)
+        except json_codec.JSONDecodeError:
+            continue
+        if isinstance(data, dict):
+            return data
+    return None
+
+
+def fit_choices(choices: List) -> Optional[List[str]]:
+    """Make a list of options exactly four long, keeping both ends of the moral spectrum"""
+    choices = [choice.strip() for choice in choices if isinstance(choice, str) and choice.strip()]
+    if len(choices) == 3:
+        # The missing option is most often the selfish one between "good" and "evil"
+        return choices[:2] + [FILLER_CHOICES[2]] + choices[2:]
+    if len(choices) > 4:
+        return choices[:2] + choices[-2:]
+    return choices if len(choices) == 4 else None
+
+
+def parse_response(text: Optional[str], schema: Type[BaseModel]) -> Tuple[Optional[BaseModel], List[str], str]:
+    """Validate a response against a schema, repairing common defects locally.
+
+    Returns the model (None if it could not be repaired), the repairs that
+    were needed and, on failure, a description of the problem for a re-ask.
+    """
+    if not text or not text.strip():
+        return None, [], "was empty"
+    repairs = []
+    try:
+        data = json_codec.loads(text)
+    except json_codec.JSONDecodeError:
+        data = close_truncated(text)
+        if data is not None:
+            repairs.append("truncated")
+        else:
+            # Surrounding text, code fences or single quotes
+            data = extract_json(text)
+            if data is None:
+                return None, [], "is not a valid JSON object"
+            repairs.append("extracted")
+    if not isinstance(data, dict):
+        return None, [], "is not a JSON object"
+
+    if any(isinstance(key, str) and key != key.lower() for key in data):
+        data = {key.lower() if isinstance(key, str) else key: value for key, value in data.items()}
+        repairs.append("keys")
+    if "choices" in schema.model_fields and isinstance(data.get("choices"), list) and len(data["choices"]) != 4:
+        choices = fit_choices(data["choices"])
+        if choices is not None:
+            data["choices"] = choices
+            repairs.append("choices")
+
+    try:
+        return schema.model_validate(data), repairs, ""
+    except ValidationError as e:
+        problems = "; ".join(f"{'.'.join(str(part) for part in error['loc']) or 'object'}: {error['msg']}"
+                             for error in e.errors()[:3])
+        return None, repairs, f"does not match the required format ({problems})"
+
+
+def conforms(schema: Type[BaseModel]) -> Callable[[str], bool]:
+    """Build a check that a response is valid (possibly after local repair), e.g. before caching it"""
+    def check(response: str) -> bool:
+        return parse_response(response, schema)[0] is not None
+    return check
+
+
+class ResponseValidator:
+    """Turns raw AI responses into validated schema objects.
+
+    A response is parsed and validated first. Common defects are repaired
+    locally at no cost: text around the object, single quotes, output cut off
+    mid-way, capitalized keys, three or five choices. Only when that fails is
+    the model re-asked, with a short correction prompt holding just the
+    broken reply and the expected format (not the original prompt), at most
+    `attempts` times per response.
+    """
+
+    OUTCOMES = ("valid", "repaired", "reasked", "failed")
+
+    def __init__(self, reask: Callable[[List[Dict[str, str]], str, Optional[str]], Awaitable[Optional[str]]],
+                 attempts: int = JSON_REASK_ATTEMPTS,
+                 on_outcome: Optional[Callable[[str, str, List[str]], None]] = None):
+        self.reask = reask  # Called with (messages, call, session_id)
+        self.attempts = attempts
+        self.on_outcome = on_outcome  # Called with (call, outcome, repairs) for every response checked
+        self._outcomes: Dict[str, Dict[str, int]] = {}
+        self._repairs: Dict[str, int] = {}
+
+    def _count(self, call: str, outcome: str, repairs: List[str]) -> None:
+        stats = self._outcomes.setdefault(call, dict.fromkeys(self.OUTCOMES, 0))
+        stats[outcome] += 1
+        for repair in repairs:
+            self._repairs[repair] = self._repairs.get(repair, 0) + 1
+        if self.on_outcome is not None:
+            self.on_outcome(call, outcome, repairs)
+
+    async def validate(self, response: Optional[str], schema: Type[BaseModel], call: str,
+                       session_id: Optional[str] = None) -> Tuple[Optional[str], Optional[BaseModel]]:
+        """The validated response as text and as a model, or (None, None).
+
+        The text is the response itself when it was valid as sent, else the
+        repaired object re-encoded, so it can be stored and resent as history.
+        """
+        if response is None:
+            return None, None  # Upstream failure: nothing to validate
+        model, repairs, problem = parse_response(response, schema)
+        if model is not None:
+            self._count(call, "repaired" if repairs else "valid", repairs)
+            return (json_codec.dumps_str(model.model_dump()) if repairs else response), model
+
+        broken = response
+        for _ in range(self.attempts):
+            logger.info(f"Re-asking for a valid {call} response: it {problem}")
+            corrected = await self.reask(correction_messages(schema.example, problem, broken), call, session_id)
+            model, more_repairs, problem = parse_response(corrected, schema)
+            if model is not None:
+                self._count(call, "reasked", repairs + more_repairs)
+                return json_codec.dumps_str(model.model_dump()), model
+            broken = corrected or broken
+        logger.warning(f"Invalid {call} response: it {problem}", extra={"response_chars": len(response)})
+        self._count(call, "failed", repairs)
+        return None, None
+
+    def stats(self) -> Dict:
+        """Outcomes per call site, how often each local repair was needed, and the repair/re-ask rates"""
+        checked = sum(sum(stats.values()) for stats in self._outcomes.values())
+        repaired = sum(stats["repaired"] for stats in self._outcomes.values())
+        reasked = sum(stats["reasked"] for stats in self._outcomes.values())
+        return {"outcomes": {call: dict(stats) for call, stats in self._outcomes.items()},
+                "repairs": dict(self._repairs),
+                "repair_rate": repaired / checked if checked else 0.0,
+                "reask_rate": reasked / checked if checked else 0.0}
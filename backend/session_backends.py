@@ -0,0 +1,471 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import unquote, urlsplit
+
+import json_codec
+from context_window import StoryContext
+from session_store import GameSession, Turn
+
+# ------------------------
+# Session backend settings
+# ------------------------
+
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory").lower()  # memory (this process only), sqlite or redis
+SESSION_SQLITE_PATH = os.getenv("SESSION_SQLITE_PATH", "sessions.db")
+SESSION_REDIS_URL = os.getenv("SESSION_REDIS_URL", "redis://127.0.0.1:6379/0")
+SESSION_REDIS_PREFIX = os.getenv("SESSION_REDIS_PREFIX", "game:session:")
+SESSION_RECORD_COMPRESSION = int(os.getenv("SESSION_RECORD_COMPRESSION", "6"))  # zlib level, 0 = store plain JSON
+
+# ------------------------
+# Session records
+# ------------------------
+#
+# A record is a JSON array rather than an object (no repeated field names),
+# zlib-compressed: a game's turns repeat the same instructions and each raw
+# response contains its parsed story and choices verbatim, so the record
+# shrinks to a fraction of the session's in-memory size. The first byte says
+# how the rest is stored.
+
+RECORD_FORMAT = 3  # 2 added the chapter digest, 3 the degraded flag of turns
+
+
+def session_snapshot(session: GameSession) -> List:
+    """A session's game state as plain data (not its lock, pending requests or background work)"""
+    context = session.context
+    return [
+        RECORD_FORMAT, session.moral_score, context.system_prompt, context.synopsis, context.folded_turns,
+        [[turn.prompt, turn.response, turn.story, turn.choices, turn.choice, turn.degraded] for turn in context.turns],
+        [list(entry) for entry in session.digest]
+    ]
+
+
+def encode_snapshot(snapshot: List, level: int = SESSION_RECORD_COMPRESSION) -> bytes:
+    """Serialize a session_snapshot() into a record (safe to call from any thread)"""
+    data = json_codec.dumps(snapshot)
+    if level > 0:
+        return b"z" + zlib.compress(data, level)
+    return b"j" + data
+
+
+def restore_session(session: GameSession, record: bytes) -> None:
+    """Replace a session's game state with the one in a record"""
+    data = zlib.decompress(record[1:]) if record[:1] == b"z" else record[1:]
+    fields = json_codec.loads(data)
+    if fields[0] not in (1, 2, RECORD_FORMAT):
+        raise ValueError(f"Unknown session record format {fields[0]}")
+    moral_score, system_prompt, synopsis, folded_turns, turns = fields[1:6]
+    context = StoryContext(system_prompt)
+    context.synopsis = synopsis
+    context.folded_turns = folded_turns
+    context.turns = [Turn(*turn) for turn in turns]
+    session.context = context
+    session.moral_score = moral_score
+    session.digest = fields[6] if len(fields) > 6 else []
+
+
+class SessionBackend:
+    """Shared storage for game sessions, so any worker process can serve any game.
+
+    Records are versioned for optimistic concurrency: a record is only
+    replaced by a writer that read the version currently stored, and
+    version 0 means "no record". Subclasses implement fetch, save_many,
+    delete_many and (where the storage does not expire records itself)
+    purge_expired.
+    """
+
+    name = "backend"
+
+    def __init__(self):
+        self._stats = {"fetches": 0, "fetched": 0, "writes": 0, "conflicts": 0, "deletes": 0,
+                       "bytes_written": 0}
+
+    def snapshot(self, session: GameSession) -> List:
+        return session_snapshot(session)
+
+    def encode(self, snapshot: List) -> bytes:
+        return encode_snapshot(snapshot)
+
+    def restore(self, session: GameSession, record: bytes) -> None:
+        restore_session(session, record)
+
+    async def start(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    async def fetch(self, session_id: str, known_version: int) -> Tuple[int, Optional[bytes]]:
+        """The stored version of a session, and its record unless that version is known_version"""
+        raise NotImplementedError
+
+    async def save_many(self, records: List[Tuple[str, int, bytes]], ttl: float) -> List[bool]:
+        """Write (session_id, expected_version, record) entries in one batch.
+
+        Each record is stored as expected_version + 1 only if the stored version
+        is still expected_version; the result says which writes were applied.
+        """
+        raise NotImplementedError
+
+    async def delete_many(self, session_ids: List[str]) -> None:
+        raise NotImplementedError
+
+    async def purge_expired(self) -> int:
+        """Delete records past their TTL (returns how many)"""
+        return 0
+
+    def _count_fetch(self, record: Optional[bytes]) -> None:
+        self._stats["fetches"] += 1
+        if record is not None:
+            self._stats["fetched"] += 1
+
+    def _count_writes(self, records: List[Tuple[str, int, bytes]], applied: List[bool]) -> None:
+        for (_, _, record), ok in zip(records, applied):
+            if ok:
+                self._stats["writes"] += 1
+                self._stats["bytes_written"] += len(record)
+            else:
+                self._stats["conflicts"] += 1
+
+    def stats(self) -> Dict:
+        stats = {"backend": self.name, **self._stats}
+        stats["mean_record_bytes"] = (self._stats["bytes_written"] // self._stats["writes"]
+                                      if self._stats["writes"] else 0)
+        return stats
+
+
+# ------------------------
+# SQLite
+# ------------------------
+
+class SQLiteSessionBackend(SessionBackend):
+    """Sessions in an SQLite database in WAL mode, shared by the worker processes of one host.
+
+    WAL lets every process read while one writes. All database calls of a
+    process run on one dedicated thread, so the event loop never blocks on
+    disk I/O, and a batch of writes is a single transaction.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str = SESSION_SQLITE_PATH):
+        super().__init__()
+        self.path = path
+        self._db: Optional[sqlite3.Connection] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-db")
+
+    async def _run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")  # Durable across process crashes; WAL is synced at checkpoints
+        db.execute("""CREATE TABLE IF NOT EXISTS sessions (
+            id TEXT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            expires REAL NOT NULL,
+            record BLOB NOT NULL
+        ) WITHOUT ROWID""")
+        return db
+
+    async def start(self) -> None:
+        if self._db is None:
+            self._db = await self._run(self._connect)
+
+    async def close(self) -> None:
+        if self._db is not None:
+            await self._run(self._db.close)
+            self._db = None
+        self._executor.shutdown(wait=False)
+
+    def _fetch(self, session_id: str, known_version: int) -> Tuple[int, Optional[bytes]]:
+        row = self._db.execute(
+            "SELECT version, CASE WHEN version != ? THEN record END FROM sessions WHERE id = ? AND expires > ?",
+            (known_version, session_id, time.time())).fetchone()
+        return (row[0], row[1]) if row else (0, None)
+
+    async def fetch(self, session_id: str, known_version: int) -> Tuple[int, Optional[bytes]]:
+        version, record = await self._run(self._fetch, session_id, known_version)
+        self._count_fetch(record)
+        return version, record
+
+    def _save_many(self, records: List[Tuple[str, int, bytes]], ttl: float) -> List[bool]:
+        now = time.time()
+        applied = []
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            for session_id, version, record in records:
+                if version == 0:
+                    # New (or re-created) record; an expired one not yet purged may be replaced
+                    cursor = self._db.execute(
+                        "INSERT INTO sessions VALUES (?, 1, ?, ?) ON CONFLICT(id) DO UPDATE SET "
+                        "version = 1, expires = excluded.expires, record = excluded.record "
+                        "WHERE sessions.expires <= ?",
+                        (session_id, now + ttl, record, now))
+                else:
+                    cursor = self._db.execute(
+                        "UPDATE sessions SET version = version + 1, expires = ?, record = ? "
+                        "WHERE id = ? AND version = ?",
+                        (now + ttl, record, session_id, version))
+                applied.append(cursor.rowcount == 1)
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        return applied
+
+    async def save_many(self, records: List[Tuple[str, int, bytes]], ttl: float) -> List[bool]:
+        applied = await self._run(self._save_many, records, ttl)
+        self._count_writes(records, applied)
+        return applied
+
+    def _delete_many(self, session_ids: List[str]) -> None:
+        self._db.executemany("DELETE FROM sessions WHERE id = ?", [(session_id,) for session_id in session_ids])
+
+    async def delete_many(self, session_ids: List[str]) -> None:
+        await self._run(self._delete_many, session_ids)
+        self._stats["deletes"] += len(session_ids)
+
+    def _purge_expired(self) -> int:
+        return self._db.execute("DELETE FROM sessions WHERE expires <= ?", (time.time(),)).rowcount
+
+    async def purge_expired(self) -> int:
+        return await self._run(self._purge_expired)
+
+    def stats(self) -> Dict:
+        stats = super().stats()
+        stats["path"] = self.path
+        return stats
+
+
+# ------------------------
+# Redis
+# ------------------------
+
+class RedisError(Exception):
+    """Error reply from the Redis server"""
+
+
+class RedisConnection:
+    """Minimal pipelined client for the Redis protocol (RESP2) on one connection.
+
+    Commands are written in order and their replies come back in the same
+    order, so any number of coroutines share the connection without waiting
+    for each other's round trips. It reconnects on the next command after the
+    connection is lost.
+    """
+
+    def __init__(self, url: str = SESSION_REDIS_URL):
+        parts = urlsplit(url)
+        if parts.scheme != "redis":
+            raise ValueError(f"Unsupported Redis URL scheme: {parts.scheme} (expected redis://)")
+        self.host = parts.hostname or "127.0.0.1"
+        self.port = parts.port or 6379
+        self.username = unquote(parts.username) if parts.username else None
+        self.password = unquote(parts.password) if parts.password else None
+        self.db = int(parts.path.strip("/") or 0)
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._replies: Optional[asyncio.Task] = None
+        self._pending: "deque[asyncio.Future]" = deque()
+        self._connecting = asyncio.Lock()
+
+    @staticmethod
+    def _encode(command: Tuple) -> bytes:
+        parts = [b"*%d\r\n" % len(command)]
+        for arg in command:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        return b"".join(parts)
+
+    async def _read_reply(self):
+        line = await self._reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("Redis connection closed")
+        kind, value = line[:1], line[1:-2]
+        if kind == b"+":
+            return value.decode("utf-8")
+        if kind == b"-":
+            return RedisError(value.decode("utf-8"))
+        if kind == b":":
+            return int(value)
+        if kind == b"$":
+            length = int(value)
+            return None if length < 0 else (await self._reader.readexactly(length + 2))[:-2]
+        if kind == b"*":
+            length = int(value)
+            return None if length < 0 else [await self._read_reply() for _ in range(length)]
+        raise ConnectionError(f"Unexpected Redis reply: {line[:40]!r}")
+
+    async def _read_replies(self) -> None:
+        try:
+            while True:
+                reply = await self._read_reply()
+                future = self._pending.popleft()
+                if future.done():
+                    continue
+                if isinstance(reply, RedisError):
+                    future.set_exception(reply)
+                else:
+                    future.set_result(reply)
+        except (ConnectionError, OSError, asyncio.IncompleteReadError, ValueError) as e:
+            self._disconnect(e)
+
+    def _disconnect(self, error: Exception) -> None:
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+        while self._pending:
+            future = self._pending.popleft()
+            if not future.done():
+                future.set_exception(ConnectionError(f"Redis connection lost: {error}"))
+
+    async def _connect(self) -> None:
+        async with self._connecting:
+            if self._writer is not None:
+                return
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+            self._replies = asyncio.create_task(self._read_replies())
+            handshake = []
+            if self.password:
+                handshake.append(("AUTH", self.username, self.password) if self.username
+                                 else ("AUTH", self.password))
+            if self.db:
+                handshake.append(("SELECT", self.db))
+            if handshake:
+                await self._send(handshake)
+
+    async def _send(self, commands: List[Tuple]) -> List:
+        if self._writer is None:
+            raise ConnectionError("Redis connection lost")
+        loop = asyncio.get_running_loop()
+        futures = [loop.create_future() for _ in commands]
+        self._pending.extend(futures)
+        self._writer.write(b"".join(self._encode(command) for command in commands))
+        await self._writer.drain()
+        replies = await asyncio.gather(*futures, return_exceptions=True)
+        for reply in replies:
+            if isinstance(reply, Exception):
+                raise reply
+        return replies
+
+    async def pipeline(self, commands: List[Tuple]) -> List:
+        """Send several commands in one write and return their replies"""
+        if self._writer is None:
+            await self._connect()
+        return await self._send(commands)
+
+    async def execute(self, *command):
+        return (await self.pipeline([command]))[0]
+
+    async def close(self) -> None:
+        if self._replies is not None:
+            self._replies.cancel()
+            try:
+                await self._replies
+            except asyncio.CancelledError:
+                pass
+            self._replies = None
+        self._disconnect(ConnectionError("closed"))
+
+
+# Returns {version} if the caller already has that version, else {version, record}; {0} if missing
+FETCH_SCRIPT = """
+local version = redis.call('HGET', KEYS[1], 'v')
+if not version then return {0} end
+if version == ARGV[1] then return {tonumber(version)} end
+return {tonumber(version), redis.call('HGET', KEYS[1], 'r')}
+"""
+
+# Compare-and-set: store the record as version ARGV[1] + 1 only if ARGV[1] is the stored version
+SAVE_SCRIPT = """
+local version = tonumber(redis.call('HGET', KEYS[1], 'v') or '0')
+if version ~= tonumber(ARGV[1]) then return 0 end
+redis.call('HSET', KEYS[1], 'v', version + 1, 'r', ARGV[2])
+redis.call('PEXPIRE', KEYS[1], ARGV[3])
+return 1
+"""
+
+
+def script_sha(script: str) -> str:
+    return hashlib.sha1(script.encode("utf-8")).hexdigest()
+
+
+class RedisSessionBackend(SessionBackend):
+    """Sessions in Redis (or anything speaking its protocol), shared by any number of hosts.
+
+    Each session is a hash holding its version and record, expired by Redis
+    after the idle TTL. Reads and compare-and-set writes are Lua scripts, so
+    each is atomic and one round trip, and a batch of writes is pipelined.
+    """
+
+    name = "redis"
+
+    def __init__(self, url: str = SESSION_REDIS_URL, prefix: str = SESSION_REDIS_PREFIX):
+        super().__init__()
+        self.url = url
+        self.prefix = prefix
+        self.redis = RedisConnection(url)
+
+    def _key(self, session_id: str) -> str:
+        return self.prefix + session_id
+
+    async def _eval(self, commands: List[Tuple[str, Tuple]]) -> List:
+        """Run (script, args) pairs by hash, loading the scripts if the server does not have them"""
+        try:
+            return await self.redis.pipeline([("EVALSHA", script_sha(script), 1) + args
+                                              for script, args in commands])
+        except RedisError as e:
+            if not str(e).startswith("NOSCRIPT"):
+                raise
+            await self.redis.pipeline([("SCRIPT", "LOAD", script) for script in (FETCH_SCRIPT, SAVE_SCRIPT)])
+            return await self.redis.pipeline([("EVALSHA", script_sha(script), 1) + args
+                                              for script, args in commands])
+
+    async def start(self) -> None:
+        await self.redis.pipeline([("SCRIPT", "LOAD", script) for script in (FETCH_SCRIPT, SAVE_SCRIPT)])
+
+    async def close(self) -> None:
+        await self.redis.close()
+
+    async def fetch(self, session_id: str, known_version: int) -> Tuple[int, Optional[bytes]]:
+        reply, = await self._eval([(FETCH_SCRIPT, (self._key(session_id), known_version))])
+        record = reply[1] if len(reply) > 1 else None
+        self._count_fetch(record)
+        return reply[0], record
+
+    async def save_many(self, records: List[Tuple[str, int, bytes]], ttl: float) -> List[bool]:
+        ttl_ms = max(1, int(ttl * 1000))
+        replies = await self._eval([(SAVE_SCRIPT, (self._key(session_id), version, record, ttl_ms))
+                                    for session_id, version, record in records])
+        applied = [reply == 1 for reply in replies]
+        self._count_writes(records, applied)
+        return applied
+
+    async def delete_many(self, session_ids: List[str]) -> None:
+        await self.redis.execute("DEL", *(self._key(session_id) for session_id in session_ids))
+        self._stats["deletes"] += len(session_ids)
+
+    def stats(self) -> Dict:
+        stats = super().stats()
+        stats["server"] = f"{self.redis.host}:{self.redis.port}/{self.redis.db}"
+        return stats
+
+
+def build_session_backend(name: str = SESSION_BACKEND) -> Optional[SessionBackend]:
+    """The configured shared backend, or None to keep sessions in this process only"""
+    if name == "memory":
+        return None
+    if name == "sqlite":
+        return SQLiteSessionBackend()
+    if name == "redis":
+        return RedisSessionBackend()
+    raise ValueError(f"Unknown SESSION_BACKEND: {name} (expected memory, sqlite or redis)")
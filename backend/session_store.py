@@ -0,0 +1,349 @@
+import asyncio
+import itertools
+import logging
+import os
+import sys
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger("game.sessions")
+
+# ------------------------
+# Session store settings
+# ------------------------
+
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", "3600"))           # Seconds without a request
+SESSION_MAX_ENTRIES = int(os.getenv("SESSION_MAX_ENTRIES", "10000"))
+SESSION_MAX_MEMORY_MB = float(os.getenv("SESSION_MAX_MEMORY_MB", "256"))
+SESSION_SWEEP_INTERVAL = float(os.getenv("SESSION_SWEEP_INTERVAL", "60"))  # Seconds between TTL sweeps
+SESSION_IDEMPOTENCY_KEYS = int(os.getenv("SESSION_IDEMPOTENCY_KEYS", "16"))  # Recent /choice keys kept per game
+SESSION_FLUSH_INTERVAL = float(os.getenv("SESSION_FLUSH_INTERVAL", "0.02"))  # Seconds a change waits to join a write batch
+SESSION_FLUSH_BATCH = int(os.getenv("SESSION_FLUSH_BATCH", "256"))  # Sessions written per backend round trip
+
+
+class Turn:
+    """One completed turn, kept with its response already parsed"""
+
+    __slots__ = ("prompt", "response", "story", "choices", "choice", "degraded")
+
+    def __init__(self, prompt: str, response: str, story: str, choices: List[str],
+                 choice: Optional[str] = None, degraded: bool = False):
+        self.prompt = prompt        # User message that produced this turn
+        self.response = response    # Raw assistant message, resent verbatim as history
+        self.story = story
+        self.choices = choices      # Options offered to the player after this turn
+        self.choice = choice        # Option the player picked to reach this turn
+        self.degraded = degraded    # Told by the local storyteller instead of the AI
+
+    def memory_size(self) -> int:
+        """Approximate bytes held by this turn"""
+        return (sys.getsizeof(self) + sys.getsizeof(self.prompt) + sys.getsizeof(self.response)
+                + sys.getsizeof(self.story) + sys.getsizeof(self.choices)
+                + sum(sys.getsizeof(choice) for choice in self.choices)
+                + (sys.getsizeof(self.choice) if self.choice else 0))
+
+
+class GameSession:
+    """State of one game"""
+
+    __slots__ = ("session_id", "context", "moral_score", "digest", "last_access", "size", "version", "lock",
+                 "requests")
+
+    def __init__(self, session_id: str, context):
+        self.session_id = session_id
+        self.context = context      # StoryContext holding the prompt state and turns
+        self.moral_score = 0        # 0 = neutral starting point
+        self.digest: List[List[Optional[str]]] = []  # [summary, choice] of each finished chapter
+        self.last_access = time.monotonic()
+        self.size = 0               # Approximate bytes, refreshed by SessionStore.touch()
+        self.version = 0            # Version of the shared backend's record this state is based on (0 = none)
+        self.lock = asyncio.Lock()  # Held while a turn is generated, so turns never interleave
+        # Idempotency key -> (choice, task producing the turn's result), oldest first
+        self.requests: "OrderedDict[str, Tuple[int, asyncio.Task]]" = OrderedDict()
+
+
+class SessionStore:
+    """In-memory session store with idle-TTL, LRU and memory-ceiling eviction.
+
+    Sessions are kept in least-recently-used order. A session is evicted when
+    it has been idle longer than the TTL, or when the store is over its entry
+    or memory limit (oldest first). on_evict is called for every session that
+    leaves the store, including ones removed with pop().
+
+    With a shared backend (see session_backends.py) the store is this
+    process's cache in front of it, so several worker processes can serve the
+    same games. load() brings a session up to date before a request uses it,
+    fetching the full record only when another process has written a newer
+    version. Changes are written behind: touch() marks a session dirty and a
+    background task writes every dirty session in one batch a few
+    milliseconds later. Writes are compare-and-set on the record's version;
+    when another process got there first the local copy is discarded and the
+    stored one wins.
+    """
+
+    def __init__(self, idle_ttl: float = SESSION_IDLE_TTL, max_entries: int = SESSION_MAX_ENTRIES,
+                 max_memory_mb: float = SESSION_MAX_MEMORY_MB,
+                 on_evict: Optional[Callable[[GameSession], None]] = None,
+                 backend=None, flush_interval: float = SESSION_FLUSH_INTERVAL,
+                 flush_batch: int = SESSION_FLUSH_BATCH):
+        self.idle_ttl = idle_ttl
+        self.max_entries = max_entries
+        self.max_memory = int(max_memory_mb * 1024 * 1024)
+        self.on_evict = on_evict
+        self.backend = backend  # A session_backends.SessionBackend, or None for this process only
+        self.flush_interval = flush_interval
+        self.flush_batch = max(1, flush_batch)
+        self._sessions: "OrderedDict[str, GameSession]" = OrderedDict()
+        self._memory = 0
+        self._ids = itertools.count(1)
+        self._sweeper: Optional[asyncio.Task] = None
+        self._evictions = {"ttl": 0, "lru": 0, "memory": 0}
+        # Write-behind state: sessions changed since their last write, and ended sessions to delete
+        self._dirty: "OrderedDict[str, GameSession]" = OrderedDict()
+        self._deleted: Set[str] = set()
+        self._wake = asyncio.Event()
+        self._writer: Optional[asyncio.Task] = None
+        self._flushing = asyncio.Lock()
+        self._backend_stats = {"loads": 0, "reloads": 0, "recreated": 0, "flushes": 0, "errors": 0}
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __contains__(self, session_id: str) -> bool:
+        return self.get(session_id) is not None
+
+    def create(self, context) -> GameSession:
+        """Add a new session with a unique id"""
+        # A monotonic counter plus randomness never collides, even after deletions or
+        # across the worker processes sharing a backend
+        session_id = f"game_{next(self._ids)}_{os.urandom(8).hex()}"
+        session = GameSession(session_id, context)
+        self._sessions[session_id] = session
+        self.touch(session)
+        return session
+
+    def get(self, session_id: str) -> Optional[GameSession]:
+        """Return a live session and mark it as recently used"""
+        session = self._sessions.get(session_id)
+        if session is None:
+            return None
+        now = time.monotonic()
+        if now - session.last_access > self.idle_ttl:
+            self._evict(session_id, "ttl")
+            return None
+        session.last_access = now
+        self._sessions.move_to_end(session_id)
+        return session
+
+    async def load(self, session_id: str) -> Optional[GameSession]:
+        """get(), after bringing this process's copy of the session up to date with the backend"""
+        session = self.get(session_id)
+        if self.backend is None:
+            return session
+        if session_id in self._dirty:
+            # Changes not written yet are the newest state there is
+            if session is None:
+                # Evicted before they were written: take the session back
+                session = self._dirty[session_id]
+                session.last_access = time.monotonic()
+                self._sessions[session_id] = session
+                self._account(session)
+            return session
+        try:
+            version, record = await self.backend.fetch(session_id, session.version if session else -1)
+            loaded = None
+            if record is not None:
+                loaded = GameSession(session_id, None)
+                self.backend.restore(loaded, record)
+        except Exception as e:
+            self._backend_stats["errors"] += 1
+            logger.warning(f"Could not load session {session_id} from the {self.backend.name} backend: {e}")
+            return session
+        # Another request may have loaded or changed the session meanwhile
+        session = self.get(session_id)
+        if version == 0:
+            if session is not None:
+                # The record expired or was lost while this process still holds the game: write it again
+                self._backend_stats["recreated"] += 1
+                session.version = 0
+                self._mark_dirty(session)
+            return session
+        if loaded is None or (session is not None and (session.version >= version or session_id in self._dirty)):
+            return session
+
+        if session is None:
+            session = loaded
+            self._sessions[session_id] = session
+            self._backend_stats["loads"] += 1
+        else:
+            # Update in place, so requests already holding the session share its lock
+            session.context = loaded.context
+            session.moral_score = loaded.moral_score
+            session.digest = loaded.digest
+            self._backend_stats["reloads"] += 1
+        session.version = version
+        self._account(session)
+        return session
+
+    def touch(self, session: GameSession) -> None:
+        """Refresh a session's memory accounting after it changed, then enforce the limits"""
+        if session.session_id not in self._sessions:
+            return
+        self._mark_dirty(session)
+        self._account(session)
+
+    def _account(self, session: GameSession) -> None:
+        size = (sys.getsizeof(session) + session.context.memory_size() + sys.getsizeof(session.digest)
+                + sum(sys.getsizeof(summary or "") + sys.getsizeof(choice or "") for summary, choice in session.digest))
+        self._memory += size - session.size
+        session.size = size
+        self._enforce_limits()
+
+    def _mark_dirty(self, session: GameSession) -> None:
+        if self.backend is not None:
+            # An evicted dirty session stays referenced here until it has been written
+            self._dirty[session.session_id] = session
+            self._wake.set()
+
+    def pop(self, session_id: str) -> Optional[GameSession]:
+        """Remove a session (e.g. the game ended), deleting it from the backend too"""
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self._release(session)
+            if self.backend is not None:
+                self._dirty.pop(session_id, None)
+                self._deleted.add(session_id)
+                self._wake.set()
+        return session
+
+    def _evict(self, session_id: str, reason: str) -> None:
+        session = self._sessions.pop(session_id)
+        self._evictions[reason] += 1
+        self._release(session)
+
+    def _release(self, session: GameSession) -> None:
+        self._memory -= session.size
+        session.size = 0
+        if self.on_evict is not None:
+            self.on_evict(session)
+
+    def _enforce_limits(self) -> None:
+        while len(self._sessions) > self.max_entries:
+            self._evict(next(iter(self._sessions)), "lru")
+        # Never evict the session that was just used
+        while self._memory > self.max_memory and len(self._sessions) > 1:
+            self._evict(next(iter(self._sessions)), "memory")
+
+    def evict_expired(self) -> int:
+        """Evict every session idle for longer than the TTL"""
+        cutoff = time.monotonic() - self.idle_ttl
+        expired = 0
+        # Oldest first, so stop at the first session still in use
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if session.last_access > cutoff:
+                break
+            self._evict(session_id, "ttl")
+            expired += 1
+        return expired
+
+    async def _sweep(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            self.evict_expired()
+            if self.backend is not None:
+                try:
+                    await self.backend.purge_expired()
+                except Exception as e:
+                    self._backend_stats["errors"] += 1
+                    logger.warning(f"Could not purge expired sessions from the {self.backend.name} backend: {e}")
+
+    async def flush(self) -> None:
+        """Write every dirty session to the backend and delete ended ones, in batches"""
+        async with self._flushing:
+            while self._dirty or self._deleted:
+                batch = []
+                while self._dirty and len(batch) < self.flush_batch:
+                    batch.append(self._dirty.popitem(last=False)[1])
+                deleted, self._deleted = self._deleted, set()
+                try:
+                    # State is captured now (changes made meanwhile mark the session dirty again)
+                    # and serialized off the event loop
+                    snapshots = [self.backend.snapshot(session) for session in batch]
+                    encoded = await asyncio.to_thread(
+                        lambda: [self.backend.encode(snapshot) for snapshot in snapshots])
+                    records = [(session.session_id, session.version, record)
+                               for session, record in zip(batch, encoded)]
+                    applied = await self.backend.save_many(records, self.idle_ttl) if records else []
+                    if deleted:
+                        await self.backend.delete_many(list(deleted))
+                except BaseException:
+                    # Keep the changes for the next attempt (or the final flush when cancelled), unless the game ended meanwhile
+                    for session in batch:
+                        if session.session_id not in self._deleted:
+                            self._dirty.setdefault(session.session_id, session)
+                    self._deleted |= deleted
+                    raise
+                self._backend_stats["flushes"] += 1
+                for session, (_, version, _), ok in zip(batch, records, applied):
+                    if ok:
+                        session.version = version + 1
+                    else:
+                        # Another process wrote first: drop our changes, the next load() takes its version
+                        self._dirty.pop(session.session_id, None)
+                        session.version = -1
+                        logger.warning(f"Session {session.session_id} was changed by another process; "
+                                       f"discarding this process's copy")
+
+    async def _write_behind(self) -> None:
+        while True:
+            await self._wake.wait()
+            # Let the changes of concurrent requests join the same batch
+            await asyncio.sleep(self.flush_interval)
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                self._backend_stats["errors"] += 1
+                logger.warning(f"Could not write sessions to the {self.backend.name} backend: {e}")
+                await asyncio.sleep(1.0)
+                self._wake.set()
+
+    async def start(self, interval: float = SESSION_SWEEP_INTERVAL) -> None:
+        """Connect the backend, then start evicting idle sessions and writing changes in the background"""
+        if self.backend is not None and self._writer is None:
+            await self.backend.start()
+            self._writer = asyncio.create_task(self._write_behind())
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep(interval))
+
+    async def close(self) -> None:
+        """Stop the background tasks, writing any changes still pending"""
+        for task in (self._sweeper, self._writer):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._sweeper = self._writer = None
+        if self.backend is not None:
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Lost unsaved changes of {len(self._dirty)} sessions: {e}")
+            await self.backend.close()
+
+    def stats(self) -> Dict:
+        """Report store size, memory use and evictions, and backend traffic"""
+        stats = {
+            "active": len(self._sessions),
+            "memory_bytes": self._memory,
+            "max_entries": self.max_entries,
+            "max_memory_bytes": self.max_memory,
+            "evictions": dict(self._evictions),
+        }
+        if self.backend is not None:
+            stats["backend"] = {**self.backend.stats(), **self._backend_stats, "dirty": len(self._dirty)}
+        return stats
@@ -0,0 +1,221 @@
+"""Serve the built frontend (frontend/build) with precompressed variants and long-lived caching.
+
+Run as a script after `npm run build` to write the .gz (and .br) files at
+build time, so the server does not compress anything at startup:
+    python backend/static_assets.py frontend/build
+"""
+import argparse
+import asyncio
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:  # Optional dependency; without it only gzip variants are served
+    brotli = None
+
+logger = logging.getLogger("game.frontend")
+
+# ------------------------
+# Frontend settings
+# ------------------------
+
+FRONTEND_ENABLED = os.getenv("FRONTEND_ENABLED", "false").lower() == "true"
+FRONTEND_BUILD_DIR = os.getenv(
+    "FRONTEND_BUILD_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "frontend", "build"))
+FRONTEND_MIN_COMPRESS_BYTES = int(os.getenv("FRONTEND_MIN_COMPRESS_BYTES", "1024"))  # Smaller files sent as they are
+
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "application/manifest+json",
+                      "image/svg+xml", "image/x-icon", "image/vnd.microsoft.icon")
+
+# Content-hashed build output, e.g. static/js/main.1a2b3c4d.js or static/media/logo.6ce24c58023cc2f8fd88.svg
+_HASHED_NAME = re.compile(r"(^|/)static/.+\.[0-9a-f]{8,}\.")
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"  # Cached, but checked with If-None-Match on every use
+
+mimetypes.add_type("application/javascript", ".js")
+mimetypes.add_type("application/manifest+json", ".webmanifest")
+mimetypes.add_type("application/json", ".map")  # Source maps
+
+
+class Asset:
+    """One file of the build with its encoded variants (encoding -> bytes)"""
+
+    __slots__ = ("content_type", "cache_control", "etag", "variants")
+
+    def __init__(self, path: str, content: bytes, content_type: str):
+        self.content_type = content_type
+        self.cache_control = IMMUTABLE if _HASHED_NAME.search(path) else REVALIDATE
+        self.etag = hashlib.sha256(content).hexdigest()[:20]
+        self.variants: Dict[str, bytes] = {"identity": content}
+
+    def etag_for(self, encoding: str) -> str:
+        return f'"{self.etag}"' if encoding == "identity" else f'"{self.etag}-{encoding}"'
+
+    def matches(self, if_none_match: str) -> bool:
+        """Whether an If-None-Match header names any variant of this file"""
+        if if_none_match.strip() == "*":
+            return True
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return any(self.etag_for(encoding) in tags for encoding in self.variants)
+
+
+def compressible(content_type: str) -> bool:
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+def compress(content: bytes) -> Dict[str, bytes]:
+    """gzip (and brotli, when installed) variants of some content, at maximum compression"""
+    variants = {"gzip": gzip.compress(content, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants["br"] = brotli.compress(content, quality=11)
+    return variants
+
+
+def accepted_encodings(header: str) -> List[str]:
+    """Codings listed in an Accept-Encoding header, except those refused with q=0"""
+    encodings = []
+    for item in header.lower().split(","):
+        name, _, params = item.partition(";")
+        quality = params.strip()
+        if quality.startswith("q="):
+            try:
+                if float(quality[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        if name.strip():
+            encodings.append(name.strip())
+    return encodings
+
+
+class FrontendAssets:
+    """The files of the React build, held in memory with their compressed variants.
+
+    load() reads the build directory once, at startup. Text files of at
+    least `min_compress_bytes` get gzip (and brotli, if the package is
+    installed) variants: taken from .gz/.br files written at build time when
+    present, else compressed in a worker thread. A variant is only kept if it
+    is smaller than the file. Content-hashed files under static/ never
+    change and are cached for a year as immutable; the rest (index.html,
+    manifest.json, ...) are revalidated with their ETag on every load.
+    """
+
+    def __init__(self, build_dir: str = FRONTEND_BUILD_DIR, min_compress_bytes: int = FRONTEND_MIN_COMPRESS_BYTES):
+        self.build_dir = os.path.abspath(build_dir)
+        self.min_compress_bytes = min_compress_bytes
+        self._assets: Dict[str, Asset] = {}
+        self._stats = {"served": 0, "not_modified": 0, "not_found": 0}
+        self._served: Dict[str, int] = {}
+
+    def _read(self) -> Dict[str, Asset]:
+        assets = {}
+        for root, _, files in os.walk(self.build_dir):
+            for name in files:
+                if name.endswith((".gz", ".br")):
+                    continue
+                full_path = os.path.join(root, name)
+                path = os.path.relpath(full_path, self.build_dir).replace(os.sep, "/")
+                with open(full_path, "rb") as f:
+                    content = f.read()
+                content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+                if content_type.startswith("text/") or content_type == "application/javascript":
+                    content_type += "; charset=utf-8"
+                asset = Asset(path, content, content_type)
+                if compressible(content_type) and len(content) >= self.min_compress_bytes:
+                    variants = {}
+                    for encoding, extension in (("gzip", ".gz"), ("br", ".br")):
+                        if os.path.exists(full_path + extension):
+                            with open(full_path + extension, "rb") as f:
+                                variants[encoding] = f.read()
+                    if "gzip" not in variants:
+                        variants = dict(compress(content), **variants)
+                    asset.variants.update(
+                        (encoding, body) for encoding, body in variants.items() if len(body) < len(content))
+                assets[path] = asset
+        return assets
+
+    async def load(self) -> None:
+        """Read and compress the build (in a worker thread)"""
+        if not os.path.isfile(os.path.join(self.build_dir, "index.html")):
+            logger.warning(f"No frontend build at {self.build_dir}; run `npm run build` in frontend/")
+            return
+        self._assets = await asyncio.to_thread(self._read)
+        stats = self.stats()
+        logger.info(f"Serving {stats['files']} frontend files ({stats['bytes']} bytes, "
+                    f"{stats['gzip_bytes']} gzipped) from {self.build_dir}")
+
+    def lookup(self, path: str) -> Optional[Asset]:
+        """The asset for a URL path; paths without a file extension get index.html (client-side routes)"""
+        path = path.strip("/") or "index.html"
+        asset = self._assets.get(path)
+        if asset is None and "." not in path.rsplit("/", 1)[-1]:
+            asset = self._assets.get("index.html")
+        return asset
+
+    def respond(self, path: str, accept_encoding: str,
+                if_none_match: str) -> Tuple[int, Optional[bytes], Dict[str, str]]:
+        """Status, body and headers for a GET of a URL path (body None for 304 and 404)"""
+        asset = self.lookup(path)
+        if asset is None:
+            self._stats["not_found"] += 1
+            return 404, None, {}
+
+        accepted = accepted_encodings(accept_encoding)
+        encoding = next((encoding for encoding in ("br", "gzip") if encoding in asset.variants
+                         and encoding in accepted), "identity")
+        headers = {"ETag": asset.etag_for(encoding), "Cache-Control": asset.cache_control}
+        if len(asset.variants) > 1:
+            headers["Vary"] = "Accept-Encoding"
+        if if_none_match and asset.matches(if_none_match):
+            self._stats["not_modified"] += 1
+            return 304, None, headers
+
+        headers["Content-Type"] = asset.content_type
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        self._stats["served"] += 1
+        self._served[encoding] = self._served.get(encoding, 0) + 1
+        return 200, asset.variants[encoding], headers
+
+    def stats(self) -> Dict:
+        """Files and bytes held per encoding, and responses by outcome and encoding"""
+        stats = dict(self._stats)
+        stats["files"] = len(self._assets)
+        stats["bytes"] = sum(len(asset.variants["identity"]) for asset in self._assets.values())
+        for encoding in ("gzip", "br") if brotli is not None else ("gzip",):
+            stats[f"{encoding}_bytes"] = sum(len(asset.variants.get(encoding, asset.variants["identity"]))
+                                             for asset in self._assets.values())
+        stats["encodings"] = dict(self._served)
+        return stats
+
+
+def write_variants(build_dir: str, min_compress_bytes: int = FRONTEND_MIN_COMPRESS_BYTES) -> None:
+    """Write .gz (and .br) files next to every compressible file of a build"""
+    for root, _, files in os.walk(build_dir):
+        for name in files:
+            if name.endswith((".gz", ".br")):
+                continue
+            content_type = mimetypes.guess_type(name)[0] or ""
+            full_path = os.path.join(root, name)
+            if not compressible(content_type) or os.path.getsize(full_path) < min_compress_bytes:
+                continue
+            with open(full_path, "rb") as f:
+                content = f.read()
+            for encoding, body in compress(content).items():
+                if len(body) < len(content):
+                    with open(full_path + (".gz" if encoding == "gzip" else ".br"), "wb") as f:
+                        f.write(body)
+            print(f"{os.path.relpath(full_path, build_dir)}: {len(content)} bytes")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("build_dir", nargs="?", default=FRONTEND_BUILD_DIR)
+    write_variants(parser.parse_args().build_dir)
@@ -0,0 +1,139 @@
+import contextvars
+import logging
+import os
+import queue
+import random
+import sys
+import time
+import uuid
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+
+import json_codec
+
+# ------------------------
+# Logging settings
+# ------------------------
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")  # Per subsystem, e.g. "deepseek=DEBUG,json=WARNING"
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))  # Records buffered before dropping
+LOG_BODY_SAMPLE_RATE = float(os.getenv("LOG_BODY_SAMPLE_RATE", "0.01"))  # Share of AI responses logged in full
+LOG_BODY_MAX_CHARS = int(os.getenv("LOG_BODY_MAX_CHARS", "4000"))
+
+# Every logger of the app lives under this name: game.app, game.deepseek, game.json, ...
+ROOT_LOGGER = "game"
+
+# Correlation ID of the request being handled (inherited by tasks it starts)
+correlation_id: contextvars.ContextVar[str] = contextvars.ContextVar("correlation_id", default="-")
+
+# Attributes every LogRecord has; anything else was passed through extra= and is logged as a field
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "correlation_id"}
+
+
+def new_correlation_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, correlation ID and extra fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "correlation_id": getattr(record, "correlation_id", "-"),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json_codec.dumps_str(entry, default=str)
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Hands records to the listener thread; drops them rather than wait when the queue is full"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Capture what only this thread/context knows; JSON encoding and I/O happen in the listener
+        record.correlation_id = correlation_id.get()
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogPipeline:
+    """Queue-based logging: the event loop only enqueues, a background thread writes.
+
+    Records from every game.* logger go into a bounded queue. A listener
+    thread formats them as JSON lines and writes them to the stream, so a
+    slow or back-pressured log collector can only cause records to be
+    dropped (and counted), never stall request handling.
+    """
+
+    def __init__(self, stream=None, level: str = LOG_LEVEL, levels: str = LOG_LEVELS,
+                 queue_size: int = LOG_QUEUE_SIZE):
+        self.handler = NonBlockingQueueHandler(queue.Queue(maxsize=queue_size))
+        output = logging.StreamHandler(stream or sys.stdout)
+        output.setFormatter(JsonFormatter())
+        self.listener = QueueListener(self.handler.queue, output, respect_handler_level=False)
+        self._running = False
+
+        logger = logging.getLogger(ROOT_LOGGER)
+        logger.setLevel(level)
+        logger.propagate = False
+        logger.handlers = [self.handler]
+        for subsystem, subsystem_level in parse_levels(levels).items():
+            logging.getLogger(f"{ROOT_LOGGER}.{subsystem}").setLevel(subsystem_level)
+
+    @property
+    def dropped(self) -> int:
+        return self.handler.dropped
+
+    def start(self) -> None:
+        """Start the writer thread (idempotent)"""
+        if not self._running:
+            self.listener.start()
+            self._running = True
+
+    def stop(self) -> None:
+        """Write out everything still queued and stop the writer thread"""
+        if self._running:
+            self.listener.stop()
+            self._running = False
+
+
+def parse_levels(spec: str) -> Dict[str, str]:
+    """Parse "deepseek=DEBUG,json=WARNING" into {subsystem: level}"""
+    levels = {}
+    for item in spec.split(","):
+        if "=" in item:
+            subsystem, level = item.split("=", 1)
+            levels[subsystem.strip()] = level.strip().upper()
+    return levels
+
+
+def log_body(logger: logging.Logger, message: str, body: Optional[str],
+             sample_rate: float = LOG_BODY_SAMPLE_RATE, **fields) -> None:
+    """Log a full AI response for a sampled share of calls (every call at DEBUG)"""
+    if not body or not logger.isEnabledFor(logging.INFO):
+        return
+    if not logger.isEnabledFor(logging.DEBUG) and random.random() >= sample_rate:
+        return
+    logger.info(message, extra={**fields, "body": body[:LOG_BODY_MAX_CHARS], "body_chars": len(body)})
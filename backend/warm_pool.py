@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional
+
+logger = logging.getLogger("game.warm_pool")
+
+# ------------------------
+# Opening pool settings
+# ------------------------
+
+OPENING_POOL_SIZE = int(os.getenv("OPENING_POOL_SIZE", "10"))             # 0 disables the pool
+OPENING_POOL_LOW_WATER = int(os.getenv("OPENING_POOL_LOW_WATER", "5"))     # Refill below this depth
+OPENING_POOL_CONCURRENCY = int(os.getenv("OPENING_POOL_CONCURRENCY", "2"))  # Parallel refill calls
+OPENING_POOL_RETRY_DELAY = float(os.getenv("OPENING_POOL_RETRY_DELAY", "5"))  # Seconds after a failed batch
+
+
+class OpeningPool:
+    """Keeps a stock of pre-generated, validated story openings.
+
+    generate() must return a ready-to-serve opening or None if generation or
+    validation failed. pop() never waits: it returns None when the pool is
+    empty and the caller generates live. Whenever the depth drops below the
+    low-water mark a background refiller tops the pool back up with at most
+    `concurrency` calls in flight.
+    """
+
+    def __init__(self, generate: Callable[[], Awaitable[Optional[str]]], size: int = OPENING_POOL_SIZE,
+                 low_water: int = OPENING_POOL_LOW_WATER, concurrency: int = OPENING_POOL_CONCURRENCY,
+                 retry_delay: float = OPENING_POOL_RETRY_DELAY):
+        self.generate = generate
+        self.size = size
+        self.low_water = min(low_water, size)
+        self.concurrency = max(1, concurrency)
+        self.retry_delay = retry_delay
+        self._pool: Deque[str] = deque()
+        self._wake = asyncio.Event()
+        self._refiller: Optional[asyncio.Task] = None
+        self._stats = {"served": 0, "empty": 0, "generated": 0, "failed": 0}
+        self._refill_time = 0.0   # Total seconds spent in successful refill calls
+        self._last_refill = 0.0
+
+    def __len__(self) -> int:
+        return len(self._pool)
+
+    def pop(self) -> Optional[str]:
+        """Take an opening from the pool, or None if it is empty"""
+        if self.size <= 0:
+            return None
+        opening = self._pool.popleft() if self._pool else None
+        self._stats["served" if opening else "empty"] += 1
+        if len(self._pool) < self.low_water:
+            self._wake.set()
+        return opening
+
+    async def _generate_one(self) -> bool:
+        start = time.monotonic()
+        try:
+            opening = await self.generate()
+        except Exception as e:
+            logger.error(f"Error generating pooled opening: {str(e)}")
+            opening = None
+        if opening is None:
+            self._stats["failed"] += 1
+            return False
+
+        self._last_refill = time.monotonic() - start
+        self._refill_time += self._last_refill
+        self._stats["generated"] += 1
+        self._pool.append(opening)
+        return True
+
+    async def _refill_forever(self) -> None:
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            while len(self._pool) < self.size:
+                batch = min(self.size - len(self._pool), self.concurrency)
+                results = await asyncio.gather(*(self._generate_one() for _ in range(batch)))
+                if not any(results):
+                    # Upstream is failing; do not hammer it
+                    await asyncio.sleep(self.retry_delay)
+
+    def start(self) -> None:
+        """Start the background refiller and fill the pool"""
+        if self.size > 0 and self._refiller is None:
+            self._refiller = asyncio.create_task(self._refill_forever())
+            self._wake.set()
+
+    async def close(self) -> None:
+        """Stop the background refiller"""
+        if self._refiller is not None:
+            self._refiller.cancel()
+            try:
+                await self._refiller
+            except asyncio.CancelledError:
+                pass
+            self._refiller = None
+
+    def stats(self) -> Dict:
+        """Report pool depth and refill metrics"""
+        stats = dict(self._stats)
+        stats["depth"] = len(self._pool)
+        stats["target"] = self.size
+        stats["low_water"] = self.low_water
+        stats["last_refill_seconds"] = round(self._last_refill, 3)
+        stats["mean_refill_seconds"] = (round(self._refill_time / stats["generated"], 3)
+                                        if stats["generated"] else 0.0)
+        return stats
@@ -1,8 +1,9 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import './App.css';
 
 // API base URL - change this to your backend server URL
-const API_BASE_URL = 'http://localhost:5001';
+// Same origin by default (the backend serves the build; `npm start` proxies to it)
+const API_BASE_URL = process.env.REACT_APP_API_BASE_URL || '';
 
 function App() {
     const [story, setStory] = useState("");
@@ -18,6 +19,8 @@ function App() {
     const [showSetup, setShowSetup] = useState(true); // Show setup screen initially
     const [gameEnded, setGameEnded] = useState(false); // Track if the game has ended
     const [conclusion, setConclusion] = useState(""); // Story conclusion
+    const [illustration, setIllustration] = useState(null); // Image URL of the current scene
+    const illustrationJob = useRef(null); // Job being watched, so stale polls are ignored
     
     // Add custom chapter input
     const [customChapterInput, setCustomChapterInput] = useState("10");
@@ -45,12 +48,15 @@ function App() {
     };
 
     // Function to get AI-generated summary of a chapter and player's choice
-    const getSummaryForChapter = async (storyText, playerChoice) => {
+    // (the server writes it in the background after the turn; the story and choice are a fallback)
+    const getSummaryForChapter = async (storyText, playerChoice, chapter) => {
         try {
             const response = await fetch(`${API_BASE_URL}/summarize`, {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({
+                    session_id: sessionId,
+                    chapter: chapter,
                     story: storyText,
                     choice: playerChoice
                 })
@@ -71,13 +77,15 @@ function App() {
     // Function to get story conclusion
     const getStoryConclusion = async () => {
         try {
-            // Compile all chapter information
+            // The server builds the conclusion from its own digest of the game; the
+            // chapters are only used if it no longer has the session
             const chapters = chapterSummaries.concat(gameHistory[gameHistory.length - 1].story);
             
             const response = await fetch(`${API_BASE_URL}/conclude`, {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({
+                    session_id: sessionId,
                     chapters: chapters,
                     choices: choicesMade,
                     moral_alignment: moralAlignment
@@ -98,6 +106,29 @@ function App() {
         }
     };
 
+    // Wait for the current scene's illustration (the story never waits for it)
+    const watchIllustration = async (job) => {
+        illustrationJob.current = job ? job.job_id : null;
+        setIllustration(null);
+        if (!job) return;
+
+        let current = job;
+        try {
+            // Long-poll until the image is done or failed
+            for (let attempt = 0; attempt < 10 && current.status !== "done" && current.status !== "failed"; attempt++) {
+                const response = await fetch(`${API_BASE_URL}${current.status_url}?wait=25`);
+                if (!response.ok) return;
+                current = await response.json();
+                if (illustrationJob.current !== job.job_id) return; // A newer scene replaced this one
+            }
+            if (current.image_url && illustrationJob.current === job.job_id) {
+                setIllustration(`${API_BASE_URL}${current.image_url}?width=512`);
+            }
+        } catch (error) {
+            console.error("Failed to fetch the illustration:", error);
+        }
+    };
+
     // Start game with selected chapter limit
     const startGame = () => {
         setShowSetup(false);
@@ -117,6 +148,7 @@ function App() {
                     setStory(data.story);
                     setChoices(data.choices || []);
                     setStatusMessage("");
+                    watchIllustration(data.illustration);
                     
                     if (data.session_id) {
                         setSessionId(data.session_id);
@@ -163,7 +195,9 @@ function App() {
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({ 
                 choice, 
-                session_id: sessionId 
+                session_id: sessionId,
+                // Same key for every submit of this turn, so a double-click plays it only once
+                idempotency_key: `${sessionId}-turn-${gameHistory.length}`
             })
         })
         .then(response => {
@@ -176,14 +210,19 @@ function App() {
             console.log("Next story received:", data);
             
             if (data.story) {
-                // First, generate summary for the PREVIOUS chapter plus the choice made
-                // This happens after we know the choice was successful
-                const summary = await getSummaryForChapter(currentChapterStory, choiceText);
-                setChapterSummaries(prev => [...prev, summary]);
+                // Fetch the summary of the PREVIOUS chapter plus the choice made without
+                // waiting for it; the sidebar shows the raw chapter until it arrives
+                getSummaryForChapter(currentChapterStory, choiceText, currentChapterIndex + 1)
+                    .then(summary => setChapterSummaries(prev => {
+                        const next = [...prev];
+                        next[currentChapterIndex] = summary;
+                        return next;
+                    }));
                 
-                // Then update current story and choices for the NEW chapter
+                // Update current story and choices for the NEW chapter
                 setStory(data.story);
                 setChoices(data.choices || []);
+                watchIllustration(data.illustration);
                 
                 // Update moral alignment if provided
                 if (data.moral_alignment) {
@@ -231,6 +270,7 @@ function App() {
         setStatusMessage("");
         setGameEnded(false);
         setConclusion("");
+        watchIllustration(null);
         setShowSetup(true); // Show setup screen again
     };
 
@@ -337,12 +377,12 @@ function App() {
                                 <div className="chapter">Chapter {index + 1}</div>
                                 
                                 {/* Show the AI summary for completed chapters (we have a summary) */}
-                                {index < chapterSummaries.length && (
+                                {chapterSummaries[index] && (
                                     <div className="chapter-summary">{chapterSummaries[index]}</div>
                                 )}
                                 
                                 {/* For chapters without summary (current chapter), show raw content */}
-                                {index >= chapterSummaries.length && (
+                                {!chapterSummaries[index] && (
                                     <>
                                         <div className="story-summary">{createSummary(entry.story)}</div>
                                         {index < choicesMade.length && (
@@ -368,7 +408,12 @@ function App() {
                                     <p className="conclusion-text">{conclusion}</p>
                                 </>
                             ) : story ? (
-                                <p>{story}</p>
+                                <>
+                                    {illustration && (
+                                        <img className="scene-illustration" src={illustration} alt="" />
+                                    )}
+                                    <p>{story}</p>
+                                </>
                             ) : (
                                 <p>Waiting for your story to begin...</p>
                             )}